@@ -0,0 +1,187 @@
+"""
+Compares the size and load time of the cache in each of the json backend's file formats, on a synthetic estate.
+
+    python benchmarks/cache_formats.py --repos 25000 --projects 300000
+
+The msgpack format needs the msgpack package, formats whose dependencies are missing are skipped.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "snyk_scm_mapper"))
+
+from cache_store import CACHE_FORMATS  # noqa: E402
+from cache_store import get_codec  # noqa: E402
+from models.organizations import Org  # noqa: E402
+from models.organizations import Orgs  # noqa: E402
+from models.organizations import Target  # noqa: E402
+from models.repositories import Project  # noqa: E402
+from models.repositories import Repo  # noqa: E402
+from models.sync import SnykWatchList  # noqa: E402
+from utils import load_watchlist  # noqa: E402
+
+
+def make_estate(repo_count: int, project_count: int, org_count: int):
+    """
+    A watchlist of repo_count repos spread over org_count Snyk orgs, with project_count projects shared evenly
+    between the repos (and the targets of their orgs)
+    """
+    rand = random.Random(0)
+
+    def make_id() -> uuid.UUID:
+        return uuid.UUID(int=rand.getrandbits(128), version=4)
+
+    group_id = make_id()
+    orgs = [
+        Org(
+            id=make_id(),
+            name=f"Org {o}",
+            slug=f"org-{o}",
+            group_id=group_id,
+            group_name="group",
+            integrations={"github-enterprise": str(make_id())},
+        )
+        for o in range(org_count)
+    ]
+
+    watchlist = SnykWatchList()
+    per_repo = max(project_count // max(repo_count, 1), 1)
+
+    for r in range(repo_count):
+        org = orgs[r % org_count]
+        full_name = f"github-org-{r % 40}/repo-{r}"
+        target = Target(
+            id=make_id(),
+            org_id=org.id,
+            org_slug=org.slug,
+            name=full_name,
+            origin="github-enterprise",
+            remote_url=f"https://github.example.com/{full_name}",
+            is_private=True,
+            repo_id=str(r),
+        )
+        org.targets.append(target)
+
+        repo = Repo(
+            url=f"https://github.example.com/{full_name}",
+            source={
+                "fork": False,
+                "name": f"repo-{r}",
+                "owner": f"github-org-{r % 40}",
+                "branch": "main",
+                "url": f"https://github.example.com/{full_name}.git",
+                "project_base": full_name,
+            },
+            id=r,
+            updated_at="2022-06-01 12:00:00",
+            full_name=full_name,
+            org=org.slug,
+            branches=["main"],
+            tags=[{"key": "team", "value": f"team-{r % 25}"}, {"key": "tier", "value": str(r % 3)}],
+            topics=["service", "backend"],
+        )
+
+        for p in range(per_repo):
+            project = Project(
+                id=make_id(),
+                name=f"{full_name}:services/svc-{p}/package.json",
+                tags=[{"key": "team", "value": f"team-{r % 25}"}],
+                branch="main",
+                type="npm",
+                status="active",
+                org_id=org.id,
+                org_slug=org.slug,
+                origin="github-enterprise",
+                target=str(target.id),
+                target_path=f"services/svc-{p}/package.json",
+                repo_name=full_name,
+                repo_id=r,
+            )
+            org.projects.append(project)
+            repo.projects.append(project)
+
+        watchlist.repos.append(repo)
+
+    return watchlist, orgs
+
+
+def dir_size(path: str) -> int:
+    total = 0
+
+    for root, dirs, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+
+    return total
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repos", type=int, default=25000)
+    parser.add_argument("--projects", type=int, default=300000)
+    parser.add_argument("--orgs", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=3, help="loads timed per format, the best is reported")
+    args = parser.parse_args()
+
+    print(f"building {args.repos} repos / {args.projects} projects in {args.orgs} orgs", file=sys.stderr)
+    watchlist, orgs = make_estate(args.repos, args.projects, args.orgs)
+
+    results = list()
+    workdir = tempfile.mkdtemp(prefix="mapper-bench-")
+
+    try:
+        for fmt in CACHE_FORMATS:
+            try:
+                get_codec(fmt)
+            except Exception as e:
+                print(f"skipping {fmt}: {e}", file=sys.stderr)
+                continue
+
+            cache_dir = os.path.join(workdir, fmt)
+            os.mkdir(cache_dir)
+
+            for record in watchlist.repos:
+                record.changed()
+            for org in orgs:
+                org.changed()
+                for record in (*org.targets, *org.projects):
+                    record.changed()
+
+            save_time = timed(lambda: watchlist.save(cache_dir, fmt=fmt))
+            save_time += timed(lambda: Orgs(orgs=orgs, cache=cache_dir, cache_format=fmt).save())
+
+            def load():
+                loaded = load_watchlist(cache_dir, fmt=fmt)
+                assert len(loaded.repos) == len(watchlist.repos)
+                Orgs(cache=cache_dir, cache_format=fmt).load()
+
+            load_time = min(timed(load) for _ in range(args.runs))
+
+            results.append((fmt, dir_size(cache_dir), save_time, load_time))
+    finally:
+        shutil.rmtree(workdir)
+
+    base_size, base_load = results[0][1], results[0][3]
+
+    print(f"{'format':<10}{'size MB':>10}{'size':>8}{'save s':>10}{'load s':>10}{'load':>8}")
+    for fmt, size, save_time, load_time in results:
+        print(
+            f"{fmt:<10}{size / 1e6:>10.1f}{size / base_size:>8.0%}"
+            f"{save_time:>10.2f}{load_time:>10.2f}{load_time / base_load:>8.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Runs sync, targets and tags --update end to end against the fake GitHub and Snyk APIs of tests/fakes.py,
+recording each command's wall time, peak RSS and the requests it made.
+
+    python benchmarks/e2e.py --repos 25000 --projects 300000 --output results.json
+    python benchmarks/e2e.py --repos 25000 --projects 300000 --baseline results.json
+
+With --baseline, a command whose wall time, peak RSS or requests grew by more than --tolerance over the baseline
+is reported as a regression and the run exits with 1. Arguments after -- are passed to the mapper, for example
+-- --cache-backend sqlite
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import yaml
+
+
+# the fake APIs are the tests' own
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+
+from fakes import FakeGitHub  # noqa: E402
+from fakes import FakeSnyk  # noqa: E402
+from fakes import add_estate_arguments  # noqa: E402
+from fakes import estate_from_args  # noqa: E402
+
+
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "snyk_scm_mapper", "cli.py")
+
+# the mapper only takes a UUID as the Snyk token, this one is outside the range of the fakes' synthetic ids, which
+# recordings would otherwise redact along with the token
+SNYK_TOKEN = "ffffffff-ffff-4fff-bfff-ffffffffffff"
+
+COMMANDS = {
+    "sync": ["sync"],
+    "targets": ["targets", "--save"],
+    "tags": ["tags", "--update"],
+}
+
+# the measurements compared against a baseline
+MEASURES = ("seconds", "peak_rss_mb", "requests")
+
+
+def write_conf(workdir: str, estate, forks: bool, github_tokens: int = 1):
+    conf = {
+        "schema": 2,
+        "github_orgs": estate.github_orgs,
+        "github_token_env_name": "GITHUB_TOKEN",
+        "snyk": {"groups": [{"name": "benchmark", "id": estate.group_id, "token_env_name": "SNYK_TOKEN"}]},
+        "default": {"orgName": estate.snyk_org_slug(0), "integrationName": "github-enterprise"},
+        "forks": forks,
+    }
+
+    if github_tokens > 1:
+        conf["github_tokens"] = [{"token_env_name": f"GITHUB_TOKEN_{i}"} for i in range(2, github_tokens + 1)]
+
+    with open(f"{workdir}/snyk-sync.yaml", "w") as the_file:
+        yaml.safe_dump(conf, the_file)
+
+    with open(f"{workdir}/snyk-orgs.yaml", "w") as the_file:
+        yaml.safe_dump(estate.orgs_file(), the_file)
+
+    os.mkdir(f"{workdir}/cache")
+
+
+def run_command(workdir: str, args: List[str], github_tokens: int = 1) -> Tuple[int, float, float]:
+    """
+    Runs the mapper, returning its exit code, wall time and peak RSS in MB
+    """
+    env = {**os.environ, "GITHUB_TOKEN": "benchmark", "SNYK_TOKEN": SNYK_TOKEN}
+    env.update({f"GITHUB_TOKEN_{i}": f"benchmark-{i}" for i in range(2, github_tokens + 1)})
+
+    start = time.perf_counter()
+
+    with open(f"{workdir}/output.log", "ab") as output:
+        process = subprocess.Popen([sys.executable, CLI, *args], cwd=workdir, env=env, stdout=output, stderr=output)
+        # wait4 gives the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    seconds = time.perf_counter() - start
+
+    return process.returncode, seconds, usage.ru_maxrss / 1024
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = list()
+
+    for command, result in results.items():
+        if command not in baseline:
+            continue
+
+        for measure in MEASURES:
+            before, after = baseline[command][measure], result[measure]
+
+            if before and after > before * (1 + tolerance):
+                regressions.append(f"{command} {measure}: {before:.1f} -> {after:.1f} (+{after / before - 1:.0%})")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_estate_arguments(parser)
+    parser.add_argument("--commands", default="sync,targets,tags", help="commands to run, in order")
+    parser.add_argument("--no-forks", action="store_true", help="don't scan forks for import.yaml during sync")
+    parser.add_argument("--github-tokens", type=int, default=1, help="GitHub tokens the mapper spreads requests over")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="growth over the baseline counted as a regression"
+    )
+    parser.add_argument("--keep", action="store_true", help="keep the working directory (cache, logs, metrics)")
+    parser.add_argument("mapper_args", nargs="*", help="extra arguments for the mapper, after --")
+    args = parser.parse_args()
+
+    estate = estate_from_args(args)
+    github = FakeGitHub(estate, args.latency_ms / 1000, args.github_limit, args.github_window).start()
+    snyk = FakeSnyk(estate, args.latency_ms / 1000).start()
+
+    workdir = tempfile.mkdtemp(prefix="mapper-e2e-")
+    write_conf(workdir, estate, not args.no_forks, args.github_tokens)
+
+    print(
+        f"{args.repos} repos / {args.projects} projects in {args.github_orgs} GitHub and {args.snyk_orgs} Snyk orgs, "
+        f"working in {workdir}",
+        file=sys.stderr,
+    )
+
+    base_args = [
+        "--conf",
+        f"{workdir}/snyk-sync.yaml",
+        "--github-url",
+        github.url,
+        "--snyk-url",
+        snyk.url,
+        "--cache-timeout",
+        "1440",
+        "--metrics-json",
+        workdir,
+        *args.mapper_args,
+    ]
+
+    results: Dict[str, dict] = dict()
+
+    for command in args.commands.split(","):
+        print(f"running {command}", file=sys.stderr)
+        github.take_counts()
+        snyk.take_counts()
+
+        code, seconds, peak_rss = run_command(workdir, [*base_args, *COMMANDS[command]], args.github_tokens)
+
+        requests = {f"github {k}": v for k, v in github.take_counts().items()}
+        requests.update({f"snyk {k}": v for k, v in snyk.take_counts().items()})
+
+        metrics_file = f"{workdir}/snyk_scm_mapper_{command}.json"
+        phases = dict()
+        if os.path.isfile(metrics_file):
+            with open(metrics_file) as the_file:
+                phases = json.load(the_file)["phases"]
+
+        results[command] = {
+            "exit_code": code,
+            "seconds": seconds,
+            "peak_rss_mb": peak_rss,
+            "requests": sum(requests.values()),
+            "requests_by_endpoint": requests,
+            "phases": phases,
+        }
+
+        if code != 0:
+            print(f"{command} exited with {code}, see {workdir}/output.log", file=sys.stderr)
+
+    print(f"{'command':<10}{'exit':>6}{'seconds':>10}{'peak MB':>10}{'requests':>10}  slowest phases")
+    for command, result in results.items():
+        slowest = sorted(result["phases"].items(), key=lambda p: p[1], reverse=True)[:3]
+        phases = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in slowest)
+        print(
+            f"{command:<10}{result['exit_code']:>6}{result['seconds']:>10.1f}{result['peak_rss_mb']:>10.0f}"
+            f"{result['requests']:>10}  {phases}"
+        )
+
+    for command, result in results.items():
+        endpoints = ", ".join(f"{k} {v}" for k, v in sorted(result["requests_by_endpoint"].items()))
+        print(f"{command} requests: {endpoints}")
+
+    if args.output:
+        with open(args.output, "w") as the_file:
+            json.dump({"estate": vars(args), "results": results}, the_file, indent=4)
+
+    failed = any(r["exit_code"] != 0 for r in results.values())
+
+    if args.baseline:
+        with open(args.baseline) as the_file:
+            regressions = compare(results, json.load(the_file)["results"], args.tolerance)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+        failed = failed or bool(regressions)
+
+    if args.keep:
+        print(f"kept {workdir}", file=sys.stderr)
+    else:
+        shutil.rmtree(workdir)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
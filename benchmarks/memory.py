@@ -0,0 +1,76 @@
+"""
+Measures the memory held by a loaded cache (the watchlist's repos and every org's targets and projects, with the
+repos linked to their orgs' projects as sync does), with and without the compact record representation.
+
+    python benchmarks/memory.py --repos 25000 --projects 300000
+"""
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "snyk_scm_mapper"))
+
+from cache_formats import make_estate  # noqa: E402
+from models.organizations import Orgs  # noqa: E402
+from models.tracking import TrackedModel  # noqa: E402
+from utils import load_watchlist  # noqa: E402
+
+
+def measure(cache_dir: str) -> int:
+    gc.collect()
+    tracemalloc.start()
+
+    watchlist = load_watchlist(cache_dir)
+    orgs = Orgs(cache=cache_dir)
+    orgs.load()
+
+    for repo in watchlist.repos:
+        for project in orgs.find_projects_by_repo(repo.full_name, repo.id):
+            repo.add_project(project)
+
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repos", type=int, default=25000)
+    parser.add_argument("--projects", type=int, default=300000)
+    parser.add_argument("--orgs", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"building {args.repos} repos / {args.projects} projects in {args.orgs} orgs", file=sys.stderr)
+    watchlist, orgs = make_estate(args.repos, args.projects, args.orgs)
+
+    cache_dir = tempfile.mkdtemp(prefix="mapper-bench-")
+    watchlist.save(cache_dir)
+    Orgs(orgs=orgs, cache=cache_dir).save()
+    records = args.repos * 2 + sum(len(o.projects) for o in orgs)
+    del watchlist, orgs
+
+    compact = TrackedModel.compact
+
+    # without compaction every record keeps its own strings, ids, tags and __fields_set__
+    TrackedModel.compact = lambda self: None
+    plain = measure(cache_dir)
+    TrackedModel.compact = compact
+    compacted = measure(cache_dir)
+
+    shutil.rmtree(cache_dir)
+
+    print(f"{'records':<12}{'MB':>10}{'bytes/record':>14}")
+    for label, held in (("plain", plain), ("compact", compacted)):
+        print(f"{label:<12}{held / 1e6:>10.1f}{held / records:>14.0f}")
+    print(f"compact holds {compacted / plain:.0%} of the plain records' memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator
+from typing import List
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+from metrics import metrics
+from requests.adapters import HTTPAdapter
+from snyk.client import SnykClient
+from snyk.errors import SnykHTTPError
+
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def retry_after(resp: requests.Response, default: float) -> float:
+    """
+    How long a 429 asks to wait before the retry, Retry-After being either seconds or an HTTP date. default when
+    it doesn't say
+    """
+    value = resp.headers.get("Retry-After")
+
+    if value is None:
+        return default
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+class AsyncRestClient:
+    """
+    asyncio client for paginated Snyk REST listings. All requests share one pooled session sized to the
+    concurrency limit, tokens are passed per request so orgs from every group can be listed at once.
+
+    The project doesn't depend on an async HTTP library, so the blocking requests calls are run on the client's own
+    worker threads, with a semaphore keeping the number in flight at or below the pool size.
+    """
+
+    def __init__(
+        self,
+        url: str = "https://api.snyk.io/rest",
+        version: Optional[str] = None,
+        user_agent: str = "pysnyk/snyk_services/snyk_scm_mapper",
+        concurrency: int = 16,
+        tries: int = 3,
+        delay: float = 1,
+        backoff: float = 2,
+        verify: bool = True,
+    ):
+        self.url = url.rstrip("/")
+        self.version = version
+        self.concurrency = max(concurrency, 1)
+        self.tries = max(tries, 1)
+        self.delay = delay
+        self.backoff = backoff
+        self.verify = verify
+
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": user_agent})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @classmethod
+    def from_client(cls, template: SnykClient, concurrency: int = 16) -> "AsyncRestClient":
+        return cls(
+            url=template.api_url,
+            version=template.version,
+            user_agent=template.api_headers.get("User-Agent"),
+            concurrency=concurrency,
+            tries=max(template.tries, 3),
+            delay=template.delay,
+            backoff=template.backoff,
+            verify=template.verify,
+        )
+
+    def make_url(self, path: str) -> str:
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+
+        # next links may or may not repeat the base path (/rest) of the API
+        base_path = urlparse(self.url).path
+
+        if base_path and path.startswith(f"{base_path}/"):
+            path = path[len(base_path) :]
+
+        return f"{self.url}/{path.lstrip('/')}"
+
+    async def get(self, path: str, token: str, params: Optional[dict] = None) -> dict:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        url = self.make_url(path)
+        headers = {"Authorization": f"token {token}"}
+
+        delay = self.delay
+
+        for attempt in range(1, self.tries + 1):
+            async with self._semaphore:
+                logger.debug(f"GET: {url} params={params}")
+                metrics.request("snyk", retry=attempt > 1)
+                try:
+                    resp = await asyncio.get_running_loop().run_in_executor(
+                        self.executor,
+                        functools.partial(self.session.get, url, headers=headers, params=params, verify=self.verify),
+                    )
+                except requests.RequestException as e:
+                    if attempt == self.tries:
+                        raise e
+                    logger.warning(f"Retrying: {url} failed with {e!r}")
+                    resp = None
+
+            if resp is not None and resp.status_code not in RETRY_STATUS:
+                break
+
+            if attempt < self.tries:
+                wait = delay
+                if resp is not None and resp.status_code == 429:
+                    wait = retry_after(resp, delay)
+                    metrics.rate_limited("snyk", wait)
+                await asyncio.sleep(wait)
+                delay = delay * self.backoff
+
+        if resp is None or not resp.ok:
+            logger.error(f"GET {url} failed")
+            raise SnykHTTPError(resp)
+
+        return resp.json()
+
+    async def iter_pages(self, path: str, token: str, params: Optional[dict] = None) -> AsyncIterator[List[dict]]:
+        """
+        Follows links.next from the first page, yielding each page's data as it arrives.
+        Stops on the same conditions as SnykClient.get_rest_pages
+        """
+        first_params = {k: str(v).lower() if isinstance(v, bool) else v for k, v in (params or dict()).items()}
+        first_params = {k: v for k, v in first_params.items() if v is not None}
+
+        if self.version and "version" not in first_params:
+            first_params["version"] = self.version
+
+        page = await self.get(path, token, first_params)
+        yield page["data"]
+
+        while page.get("links", {}).get("next"):
+            next_url = page["links"]["next"]
+
+            if next_url == page["links"].get("self"):
+                break
+
+            # next links come back with every parameter already set
+            page = await self.get(next_url, token)
+
+            if not page.get("data"):
+                break
+
+            yield page["data"]
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
@@ -0,0 +1,379 @@
+import json
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any
+from typing import BinaryIO
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Type
+from typing import Union
+from uuid import UUID
+
+from models.tracking import TrackedModel
+from models.tracking import is_current
+from models.tracking import schema_header
+from pydantic import BaseModel
+
+
+try:
+    import msgpack
+except ImportError:  # only needed for the msgpack cache format
+    msgpack = None
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMATS = ("json", "msgpack")
+
+# how often, and how far apart, an index not matching its data file is read again while a save swaps them in
+INDEX_READ_TRIES = 5
+INDEX_READ_DELAY = 0.05
+
+
+def atomic_write(filename: str, data: Union[str, bytes]):
+    """
+    Writes through a temporary file swapped into place, so readers see either the old or the new contents
+    """
+    tmp_file = f"{filename}.{os.getpid()}.tmp"
+
+    with open(tmp_file, "wb" if isinstance(data, bytes) else "w") as the_file:
+        the_file.write(data)
+
+    os.replace(tmp_file, filename)
+
+
+class JsonCodec:
+    """
+    JSON Lines: one record per line
+    """
+
+    name = "json"
+    data_extension = "jsonl"
+
+    def encode(self, data: Any) -> bytes:
+        if isinstance(data, BaseModel):
+            return data.json().encode("utf-8") + b"\n"
+
+        return json.dumps(data, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def iter_decode(self, the_file: BinaryIO) -> Iterator[Any]:
+        for line in the_file:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                # lines stand alone, so a damaged one only loses that record
+                logger.warning(f"skipping unreadable record in {the_file.name}: {e!r}")
+
+    def encode_document(self, data: Any) -> bytes:
+        return json.dumps(data, indent=4).encode("utf-8")
+
+
+class MsgpackCodec:
+    """
+    msgpack: records packed back to back. About three quarters the size of the JSON Lines files and quicker to
+    decode, but needs the optional msgpack package (the msgpack extra)
+    """
+
+    name = "msgpack"
+    data_extension = "msgpack"
+
+    # UUIDs are packed as their 16 bytes rather than 36 characters of text
+    UUID_TYPE = 1
+
+    def encode(self, data: Any) -> bytes:
+        if isinstance(data, BaseModel):
+            data = data.dict()
+
+        return msgpack.packb(data, default=self.default)
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, ext_hook=self.ext_hook)
+
+    def iter_decode(self, the_file: BinaryIO) -> Iterator[Any]:
+        yield from msgpack.Unpacker(the_file, ext_hook=self.ext_hook)
+
+    def encode_document(self, data: Any) -> bytes:
+        return self.encode(data)
+
+    @classmethod
+    def default(cls, value: Any) -> Any:
+        if isinstance(value, UUID):
+            return msgpack.ExtType(cls.UUID_TYPE, value.bytes)
+
+        # what pydantic's json() would write for anything else msgpack can't hold
+        return str(value)
+
+    @classmethod
+    def ext_hook(cls, code: int, data: bytes) -> Any:
+        if code == cls.UUID_TYPE:
+            return UUID(bytes=data)
+
+        return msgpack.ExtType(code, data)
+
+
+CODECS = {"json": JsonCodec(), "msgpack": MsgpackCodec()}
+
+
+def get_codec(fmt: str):
+    if fmt not in CODECS:
+        raise Exception(f"unknown cache format {fmt}, expected one of {', '.join(CACHE_FORMATS)}")
+
+    if fmt == "msgpack" and msgpack is None:
+        raise Exception(
+            "the msgpack cache format needs the msgpack package, install it with: poetry install -E msgpack (or pip install msgpack)"
+        )
+
+    return CODECS[fmt]
+
+
+def write_document(path: str, name: str, data: Any, fmt: str = "json"):
+    """
+    Writes a single document (an org's metadata or integrations) as {name}.json or {name}.msgpack, removing the
+    copy in any other format
+    """
+    codec = get_codec(fmt)
+
+    atomic_write(f"{path}/{name}.{codec.name}", codec.encode_document(data))
+
+    for other in CACHE_FORMATS:
+        if other != fmt and os.path.isfile(f"{path}/{name}.{other}"):
+            os.remove(f"{path}/{name}.{other}")
+
+
+def find_document(path: str, name: str, fmt: str = "json") -> Optional[str]:
+    """
+    The file a document was written to, looking for the given format first
+    """
+    for candidate in (fmt, *CACHE_FORMATS):
+        if os.path.isfile(f"{path}/{name}.{candidate}"):
+            return f"{path}/{name}.{candidate}"
+
+    return None
+
+
+def read_document(filename: str) -> Any:
+    with open(filename, "rb") as the_file:
+        return get_codec(filename.rsplit(".", 1)[-1]).decode(the_file.read())
+
+
+class RecordStore:
+    """
+    One file holding every record of a kind (the watchlist's repos, an org's targets or its projects), next to an
+    index of where each record sits in the file. Reading or writing a whole org is a couple of syscalls instead of
+    one open per record, and the index still allows a single record to be read without parsing the rest.
+    The first record is a schema_header for the model the records were written from, and the index records the
+    size of the data file it describes. Records are JSON Lines ({name}.jsonl) or msgpack ({name}.msgpack), see CACHE_FORMATS.
+    """
+
+    def __init__(self, path: str, name: str, model: Type[TrackedModel], fmt: str = "json"):
+        self.codec = get_codec(fmt)
+        self.path = path
+        self.name = name
+        self.data_file = f"{path}/{name}.{self.codec.data_extension}"
+        self.index_file = f"{path}/{name}.idx.{self.codec.name}"
+        self.model = model
+        self._index: Optional[Dict[str, Tuple[int, int]]] = None
+        self._header: Optional[dict] = None
+
+    @classmethod
+    def find(cls, path: str, name: str, model: Type[TrackedModel], fmt: str = "json") -> "RecordStore":
+        """
+        The store to read from: the one in the given format if it exists, otherwise one written in another format
+        (which the next save in the given format replaces)
+        """
+        for candidate in (fmt, *CACHE_FORMATS):
+            if candidate == "msgpack" and msgpack is None:
+                continue
+            store = cls(path, name, model, candidate)
+            if os.path.isfile(store.data_file):
+                return store
+
+        return cls(path, name, model, fmt)
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.data_file) and os.path.isfile(self.index_file)
+
+    def header(self) -> Optional[dict]:
+        """
+        The schema_header the data file starts with, None for files written before there was one
+        """
+        if self._header is None:
+            with open(self.data_file, "rb") as the_file:
+                first_record = next(self.codec.iter_decode(the_file), None)
+
+            if isinstance(first_record, dict) and "cache_schema" in first_record:
+                self._header = first_record
+            else:
+                self._header = dict()
+
+        return self._header or None
+
+    def is_trusted(self) -> bool:
+        """
+        Whether the records were written by this version of the mapper, and so can be loaded without validation
+        """
+        return is_current(self.header(), self.model)
+
+    def save(self, records: Sequence[TrackedModel], key: Callable[[Any], str] = lambda r: str(r.id)) -> bool:
+        """
+        Writes the records in order, replacing the previous contents of the store and any copy of it in another
+        format. Unchanged records are copied from the current file rather than serialised again, changed ones are
+        serialised once, and nothing is written at all when the result would match the current file.
+        Returns whether the store was rewritten
+        """
+        old_index = self.index() if self.exists() else dict()
+        keys: List[str] = [key(r) for r in records]
+        fresh: Dict[int, bytes] = dict()
+
+        # the index only locates the last of several records sharing an id, so those are always serialised
+        repeated = {k for k, count in Counter(keys).items() if count > 1}
+
+        with self.open_data() as old_file:
+            # positions whose bytes in the current file can be copied as they are
+            reused = set()
+
+            for pos, record in enumerate(records):
+                record_id = keys[pos]
+
+                if old_file is None or record_id not in old_index or record_id in repeated:
+                    continue
+
+                if not record.is_changed():
+                    reused.add(pos)
+                    continue
+
+                # a record rebuilt with the same content (such as a re-fetched project) doesn't need writing either
+                encoded = self.codec.encode(record)
+
+                if self.read_at(old_file, record_id) == encoded:
+                    reused.add(pos)
+                else:
+                    fresh[pos] = encoded
+
+            if old_file is not None and len(reused) == len(records) and keys == list(old_index.keys()):
+                for record in records:
+                    record.mark_saved()
+                self.remove_other_formats()
+                return False
+
+            index: Dict[str, Tuple[int, int]] = dict()
+            header = self.codec.encode(schema_header(self.model))
+            offset = len(header)
+
+            with open(f"{self.data_file}.tmp", "wb") as the_file:
+                the_file.write(header)
+
+                for pos, record_id in enumerate(keys):
+                    if pos in reused:
+                        encoded = self.read_at(old_file, record_id)
+                    elif pos in fresh:
+                        encoded = fresh.pop(pos)
+                    else:
+                        encoded = self.codec.encode(records[pos])
+                    the_file.write(encoded)
+                    index[record_id] = (offset, len(encoded))
+                    offset += len(encoded)
+
+        with open(f"{self.index_file}.tmp", "wb") as the_file:
+            the_file.write(self.codec.encode({"data_size": offset, "records": index}))
+
+        # between the two swaps the new data file sits next to the old index, which index() tells from the size
+        os.replace(f"{self.data_file}.tmp", self.data_file)
+        os.replace(f"{self.index_file}.tmp", self.index_file)
+
+        self._index = index
+        self._header = None
+
+        for record in records:
+            record.mark_saved()
+
+        self.remove_other_formats()
+
+        return True
+
+    def remove_other_formats(self):
+        for fmt in CACHE_FORMATS:
+            if fmt == self.codec.name:
+                continue
+
+            for filename in (
+                f"{self.path}/{self.name}.{CODECS[fmt].data_extension}",
+                f"{self.path}/{self.name}.idx.{fmt}",
+            ):
+                if os.path.isfile(filename):
+                    os.remove(filename)
+
+    @contextmanager
+    def open_data(self) -> Iterator[Optional[BinaryIO]]:
+        # records written for another schema can't be copied into a file written for this one
+        if not self.exists() or not self.is_trusted():
+            yield None
+            return
+
+        with open(self.data_file, "rb") as the_file:
+            yield the_file
+
+    def read_at(self, the_file: BinaryIO, record_id: str) -> bytes:
+        position = self.index()[record_id]
+        the_file.seek(position[0])
+
+        return the_file.read(position[1])
+
+    def read(self) -> Iterator[Any]:
+        """
+        Yields each record of the data file, decoded but not yet parsed into the model
+        """
+        with open(self.data_file, "rb") as the_file:
+            records = self.codec.iter_decode(the_file)
+
+            if self.header() is not None:
+                next(records, None)
+
+            yield from records
+
+    def index(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Where each record sits in the data file. An index that doesn't match the data file, as when another
+        process's save has swapped in its data file but not yet its index, is read again until it does
+        """
+        if self._index is None:
+            for _ in range(INDEX_READ_TRIES):
+                with open(self.index_file, "rb") as the_file:
+                    decoded = self.codec.decode(the_file.read())
+
+                # indexes written before the data file's size was recorded are taken as they are
+                if "records" not in decoded:
+                    decoded = {"data_size": None, "records": decoded}
+
+                if decoded["data_size"] in (None, os.path.getsize(self.data_file)):
+                    break
+
+                time.sleep(INDEX_READ_DELAY)
+            else:
+                raise Exception(f"{self.index_file} does not match {self.data_file}")
+
+            self._index = {k: (int(v[0]), int(v[1])) for k, v in decoded["records"].items()}
+
+        return self._index
+
+    def get(self, record_id: str) -> Optional[Any]:
+        position = self.index().get(str(record_id))
+
+        if position is None:
+            return None
+
+        with open(self.data_file, "rb") as the_file:
+            return self.codec.decode(self.read_at(the_file, str(record_id)))
@@ -14,30 +14,42 @@ from typing import Optional
 from uuid import UUID
 
 import api
+import github_graphql
+import http_record
+import sync_plan
+import tag_updates
 import typer
 import yaml
 from __version__ import __version__
-from github import Github
+from api_async import AsyncRestClient
+from cache_store import CACHE_FORMATS
+from cache_store import get_codec
 from github.ContentFile import ContentFile
 from github.PaginatedList import PaginatedList
+from github_pool import make_pool
+from http_cache import ResponseCache
+from metrics import MeteredSnykClient
+from metrics import metrics
 from models.organizations import Orgs
 from models.repositories import Repo
 from models.sync import Settings
 from models.sync import SnykWatchList
-from snyk.client import SnykClient
-from snyk.errors import SnykHTTPError
+from rate_governor import governor
+from utils import GithubClients
+from utils import clone_client
 from utils import default_settings
 from utils import filter_chunk
-from utils import get_organization_wrapper
+from utils import get_organizations
 from utils import get_page_wrapper
-from utils import get_repo_count_wrapper
+from utils import get_repo_count_estimate
 from utils import get_repos_wrapper
+from utils import iter_repo_pages
 from utils import jopen
 from utils import jwrite
+from utils import load_sync_state
 from utils import load_watchlist
 from utils import logger
 from utils import set_log_level
-from utils import update_client
 from utils import yopen
 
 
@@ -177,6 +189,126 @@ def main(
         envvar="SNYK_SYNC_SET_ROOT_LOG_LEVEL",
         callback=settings_callback,
     ),
+    github_workers: int = typer.Option(
+        default=8,
+        help="Maximum number of concurrent GitHub API requests while listing repos",
+        envvar="SNYK_MAPPER_GITHUB_WORKERS",
+        callback=settings_callback,
+    ),
+    snyk_workers: int = typer.Option(
+        default=4,
+        help="Maximum number of Snyk orgs refreshed concurrently",
+        envvar="SNYK_MAPPER_SNYK_WORKERS",
+        callback=settings_callback,
+    ),
+    snyk_async: bool = typer.Option(
+        default=False,
+        help="List the targets and projects of every Snyk org at once through an asyncio client, "
+        "with --snyk-workers requests in flight",
+        envvar="SNYK_MAPPER_SNYK_ASYNC",
+        callback=settings_callback,
+    ),
+    github_cache: bool = typer.Option(
+        default=True,
+        help="Keep GitHub responses in the cache directory and revalidate them with conditional requests",
+        envvar="SNYK_MAPPER_GITHUB_CACHE",
+        callback=settings_callback,
+    ),
+    github_incremental: bool = typer.Option(
+        default=False,
+        help="Only list repos updated since the previous sync, with a full listing every --full-listing-interval",
+        envvar="SNYK_MAPPER_GITHUB_INCREMENTAL",
+        callback=settings_callback,
+    ),
+    full_listing_interval: float = typer.Option(
+        default=24,
+        help="Hours between full GitHub listings (which remove deleted repos) when listing incrementally",
+        envvar="SNYK_MAPPER_FULL_LISTING_INTERVAL",
+        callback=settings_callback,
+    ),
+    github_graphql: bool = typer.Option(
+        default=False,
+        help="List repos and their import.yaml through the GitHub GraphQL API instead of REST and code search",
+        envvar="SNYK_MAPPER_GITHUB_GRAPHQL",
+        callback=settings_callback,
+    ),
+    github_graphql_url: str = typer.Option(
+        default=github_graphql.GRAPHQL_URL,
+        help="GitHub GraphQL endpoint used with --github-graphql",
+        envvar="SNYK_MAPPER_GITHUB_GRAPHQL_URL",
+        callback=settings_callback,
+    ),
+    github_url: str = typer.Option(
+        default="https://api.github.com",
+        help="GitHub REST API, https://<host>/api/v3 for GitHub Enterprise Server",
+        envvar="SNYK_MAPPER_GITHUB_URL",
+        callback=settings_callback,
+    ),
+    snyk_url: str = typer.Option(
+        default="https://api.snyk.io",
+        help="Snyk API host, the v1 API is under /v1 and the REST API under /rest",
+        envvar="SNYK_MAPPER_SNYK_URL",
+        callback=settings_callback,
+    ),
+    cache_backend: str = typer.Option(
+        default="json",
+        help="Cache storage: json files, or a sqlite database (cache.db) the targets and tags commands query directly",
+        envvar="SNYK_MAPPER_CACHE_BACKEND",
+        callback=settings_callback,
+    ),
+    tag_workers: int = typer.Option(
+        default=8,
+        help="Maximum number of projects whose tags are updated concurrently by tags --update",
+        envvar="SNYK_MAPPER_TAG_WORKERS",
+        callback=settings_callback,
+    ),
+    trust_cache_minutes: float = typer.Option(
+        default=0,
+        help="When the cache is younger than this many minutes, tags --update takes the cached project tags as live "
+        "and only re-reads projects whose update fails. 0 reads every project first",
+        envvar="SNYK_MAPPER_TRUST_CACHE_MINUTES",
+        callback=settings_callback,
+    ),
+    cache_format: str = typer.Option(
+        default="json",
+        help="File format of the json backend's records: json, or msgpack (smaller and faster to load, needs the "
+        "msgpack package)",
+        envvar="SNYK_MAPPER_CACHE_FORMAT",
+        callback=settings_callback,
+    ),
+    metrics_json: Optional[Path] = typer.Option(
+        None,
+        help="Write a JSON summary of the run's phase durations, requests, retries, rate limit sleeps and cache hits "
+        "to this file (or, for a directory, to snyk_scm_mapper_<command>.json in it)",
+        envvar="SNYK_MAPPER_METRICS_JSON",
+        callback=settings_callback,
+    ),
+    metrics_textfile: Optional[Path] = typer.Option(
+        None,
+        help="Write the same metrics in the Prometheus text format, for the node exporter's textfile collector "
+        "(a directory gets snyk_scm_mapper_<command>.prom)",
+        envvar="SNYK_MAPPER_METRICS_TEXTFILE",
+        callback=settings_callback,
+    ),
+    record: Optional[Path] = typer.Option(
+        None,
+        help="Record every GitHub and Snyk HTTP exchange of the run, with credentials scrubbed, to <command>.jsonl in "
+        "this directory",
+        envvar="SNYK_MAPPER_RECORD",
+        callback=settings_callback,
+    ),
+    replay: Optional[Path] = typer.Option(
+        None,
+        help="Answer every HTTP request from a recording in this directory made with --record, instead of the network",
+        envvar="SNYK_MAPPER_REPLAY",
+        callback=settings_callback,
+    ),
+    replay_latency: bool = typer.Option(
+        False,
+        help="With --replay, make each response take as long as it did when recorded",
+        envvar="SNYK_MAPPER_REPLAY_LATENCY",
+        callback=settings_callback,
+    ),
 ):
     # We keep this as the global settings hash
     global s
@@ -187,51 +319,124 @@ def main(
 
     s = Settings.parse_obj(ctx.params)
 
+    # written however the command ends, so a failed run is measured too
+    metrics.command = ctx.invoked_subcommand or "all"
+    ctx.call_on_close(lambda: metrics.write(s.metrics_json, s.metrics_textfile))
+
+    if s.record is not None and s.replay is not None:
+        raise typer.BadParameter("--record and --replay can't be used together")
+
+    if s.record is not None or s.replay is not None:
+        if s.record is not None:
+            recording = http_record.Recorder(s.record, metrics.command, [s.github_token, str(s.snyk_token)])
+        else:
+            recording = http_record.Replayer(s.replay, metrics.command, s.replay_latency)
+
+        # the conditional requests of the response cache depend on what's on disk, not on what was recorded
+        s.github_cache = False
+
+        http_record.install(recording)
+        ctx.call_on_close(lambda: typer.echo(recording.summary(), err=True))
+        ctx.call_on_close(http_record.uninstall)
+
     if ctx.invoked_subcommand is None:
         typer.echo("Snyk Scm Mapper invoked with no subcommand, executing all", err=True)
         if status() is False:
             sync()
 
 
-@app.command()
-def sync(
+@app.command("sync")
+def sync_command(
     show_rate_limit: bool = typer.Option(
         False,
         "--show-rate-limit",
-        help="Display GH rate limit status between each batch of API calls",
-    )
+        help="Display the GitHub rate limits left, and any wait for them to reset, as the sync goes",
+    ),
+    plan: bool = typer.Option(
+        False,
+        "--plan",
+        help="Estimate the requests and time a sync would take against the current rate limits, without syncing",
+    ),
 ):
     """
     Force a sync of the local cache of the GitHub / Snyk data.
     """
+    sync(show_rate_limit, plan)
+
+
+def sync(show_rate_limit: bool = False, plan: bool = False):
+    """
+    The sync command, also run by the other commands when the cache is missing or stale. Kept apart from the typer
+    command so it can be called directly, where the options' defaults would be typer's OptionInfo objects
+    """
 
     global watchlist
 
     typer.echo("Mapper starting", err=True)
 
+    governor.report = show_rate_limit
+
     load_conf()
 
     # either load the watchlist from disk
     # or return an empty one if there is none
 
-    tmp_watch: SnykWatchList = load_watchlist(s.cache_dir)
-    watchlist.repos = tmp_watch.repos
-    logger.debug(f"loaded snyk watch list [{pformat(tmp_watch)}]")
+    with metrics.phase("load_cache"):
+        tmp_watch: SnykWatchList = load_watchlist(s.cache_dir, s.cache_backend, s.cache_format)
+        watchlist.use_cache(tmp_watch)
+        logger.debug(f"loaded snyk watch list [{pformat(tmp_watch)}]")
+
+        sync_state = load_sync_state(s.cache_dir)
 
     GH_PAGE_LIMIT = 100
-    gh = Github(s.github_token, per_page=GH_PAGE_LIMIT)
+    if s.github_cache:
+        gh_cache = ResponseCache(Path(f"{s.cache_dir}/github"))
+    else:
+        gh_cache = None
 
-    client = SnykClient(str(s.snyk_token), user_agent=f"pysnyk/snyk_services/mapper/{__version__}", tries=2, delay=1)
+    gh_pool = make_pool(s.github_token, s.github_tokens, s.github_url)
 
-    v3client = SnykClient(
+    for credential in gh_pool.credentials.values():
+        http_record.add_secret(credential.token)
+
+    if len(gh_pool) > 1:
+        typer.echo(f"Spreading GitHub requests over {len(gh_pool)} credentials", err=True)
+
+    gh_clients = GithubClients(
+        s.github_token,
+        per_page=GH_PAGE_LIMIT,
+        pool_size=s.github_workers,
+        base_url=s.github_url,
+        response_cache=gh_cache,
+        credential_pool=gh_pool,
+    )
+    gh = gh_clients.get()
+
+    client = MeteredSnykClient(
+        str(s.snyk_token),
+        url=f"{s.snyk_url}/v1",
+        user_agent=f"pysnyk/snyk_services/mapper/{__version__}",
+        tries=2,
+        delay=1,
+    )
+
+    v3client = MeteredSnykClient(
         str(s.snyk_token),
         version="2022-04-06~beta",
-        url="https://api.snyk.io/rest",
+        url=f"{s.snyk_url}/rest",
         user_agent=f"pysnyk/snyk_services/mapper/{__version__}",
         tries=2,
         delay=3,
     )
 
+    if plan:
+        sync_orgs = Orgs(
+            cache=str(s.cache_dir), groups=s.snyk_groups, backend=s.cache_backend, cache_format=s.cache_format
+        )
+        updated_since = get_incremental_watermark(sync_state, len(watchlist.repos))
+        typer.echo(sync_plan.plan_sync(s, gh, client, watchlist, sync_orgs, updated_since))
+        return
+
     if s.github_orgs is not None:
         gh_orgs = list(s.github_orgs)
         logger.debug(f"github orgs loaded from settings [{pformat(gh_orgs)}]")
@@ -244,61 +449,119 @@ def sync(
     typer.echo("Getting all GitHub repos", err=True)
 
     repo_ids: list = []
+    import_yamls: list = []
 
-    for gh_org_name in gh_orgs:
-        logger.debug(f"processing org {gh_org_name}")
-        gh_org = get_organization_wrapper(gh, gh_org_name, show_rate_limit)
-        gh_repos = get_repos_wrapper(
-            gh_org=gh_org, show_rate_limit=show_rate_limit, type="all", sort="updated", direction="desc"
-        )
-        gh_repos_count = get_repo_count_wrapper(gh, gh_repos)
+    listing_started = dt.utcnow()
+    updated_since = get_incremental_watermark(sync_state, len(watchlist.repos))
+
+    if updated_since is not None:
+        typer.echo(f"Listing only repos updated since {updated_since}", err=True)
+
+    with metrics.phase("repo_enumeration"):
+        if s.github_graphql:
+            # the GraphQL listing already carries each repo's import.yaml, so there's no code search or fork scan
+            with typer.progressbar(length=1, label=f"Processing repos in {len(gh_orgs)} orgs: ") as gh_progress:
+                for gh_org_name, gql_page, gql_total in github_graphql.iter_repos(
+                    s.github_token,
+                    gh_orgs,
+                    s.github_graphql_url,
+                    GH_PAGE_LIMIT,
+                    s.github_workers,
+                    show_rate_limit,
+                    gh_pool,
+                ):
+                    logger.debug(f"processing graphql repos page of {gh_org_name}")
+                    gh_progress.length = max(gql_total, 1)
+
+                    for gh_repo, import_yaml in gql_page:
+                        logger.debug(f"processing repo {pformat(gh_repo)}")
+                        watchlist.add_repo(gh_repo)
+                        repo_ids.append(gh_repo.id)
+
+                        if import_yaml is not None and (s.forks is True or not gh_repo.fork):
+                            import_yamls.extend(filter_chunk([import_yaml], exclude_list))
+
+                    gh_progress.update(len(gql_page))
+        else:
+            gh_repos: Dict[str, PaginatedList] = dict()
+            gh_pages: Dict[str, int] = dict()
+            gh_repos_total = 0
+
+            for gh_org_name, gh_org in zip(
+                gh_orgs, get_organizations(gh_clients, gh_orgs, s.github_workers, show_rate_limit)
+            ):
+                logger.debug(f"processing org {gh_org_name}")
+                gh_repos[gh_org_name] = get_repos_wrapper(
+                    gh_org=gh_org, show_rate_limit=show_rate_limit, type="all", sort="updated", direction="desc"
+                )
+                logger.debug(f"loaded org=[{pformat(gh_org)}] repos=[{pformat({gh_repos[gh_org_name]})}]")
+
+                if updated_since is not None:
+                    # the listing is newest first, so we walk it a page at a time until we pass the watermark
+                    gh_pages[gh_org_name] = 1
+                    continue
+
+                gh_repos_count = get_repo_count_estimate(gh, gh_org, gh_repos[gh_org_name], show_rate_limit)
+
+                pages = gh_repos_count // GH_PAGE_LIMIT
+
+                if (gh_repos_count % GH_PAGE_LIMIT) > 0:
+                    pages += 1
+
+                logger.debug(f"repos_count={gh_repos_count}, calculated pages={pages}")
 
-        pages = gh_repos_count // GH_PAGE_LIMIT
-        logger.debug(f"loaded org=[{pformat(gh_org)}] repos=[{pformat({gh_repos})}]")
-        logger.debug(f"repos_count={gh_repos_count}, calculated pages={pages}")
+                gh_pages[gh_org_name] = pages
+                gh_repos_total += gh_repos_count
 
-        if (gh_repos_count % GH_PAGE_LIMIT) > 0:
-            pages += 1
+            if updated_since is not None:
+                gh_label = f"Processing repos updated since {updated_since} in {len(gh_orgs)} orgs: "
+            else:
+                gh_label = f"Processing {gh_repos_total} repos in {len(gh_orgs)} orgs: "
 
-        logger.debug(f"repos_count={gh_repos_count}, calculated pages={pages}")
+            with typer.progressbar(length=max(sum(gh_pages.values()), 1), label=gh_label) as gh_progress:
+                for gh_org_name, gh_page, queued in iter_repo_pages(
+                    gh_clients, gh_repos, gh_pages, GH_PAGE_LIMIT, s.github_workers, show_rate_limit, updated_since
+                ):
+                    logger.debug(f"processing repos page of {gh_org_name}")
+                    # pages beyond the estimate are queued as we go, so the bar grows with them
+                    gh_progress.length = max(gh_progress.length, queued)
 
-        with typer.progressbar(
-            length=pages, label=f"Processing {gh_repos_count} repos in {gh_org_name}: "
-        ) as gh_progress:
-            for r_int in range(0, pages):
-                logger.debug(f"processing repos page {r_int}")
-                for gh_repo in get_page_wrapper(gh_repos, r_int, show_rate_limit):
-                    logger.debug(f"processing repo {pformat(gh_repo)}")
-                    watchlist.add_repo(gh_repo)
-                    repo_ids.append(gh_repo.id)
+                    for gh_repo in gh_page:
+                        logger.debug(f"processing repo {pformat(gh_repo)}")
+                        watchlist.add_repo(gh_repo)
+                        repo_ids.append(gh_repo.id)
 
-                gh_progress.update(1)
+                    gh_progress.update(1)
 
-    watchlist.prune(repo_ids)
+        if updated_since is None:
+            watchlist.prune(repo_ids)
+        else:
+            logger.debug(f"incremental listing, pruning deleted repos is left to the next full listing")
     logger.debug(f"watchlist=[{pformat(watchlist)}]")
 
-    import_yamls: list = []
-    for gh_org in gh_orgs:
-        logger.debug(f"processing org {pformat(gh_org)}")
-        search = f"org:{gh_org} path:.snyk.d filename:import language:yaml"
-        import_repos: PaginatedList[ContentFile] = gh.search_code(query=search)
+    with metrics.phase("code_search"):
+        if not s.github_graphql:
+            for gh_org in gh_orgs:
+                logger.debug(f"processing org {pformat(gh_org)}")
+                search = f"org:{gh_org} path:.snyk.d filename:import language:yaml"
+                import_repos: PaginatedList[ContentFile] = gh.search_code(query=search)
 
-        import_repos_count = import_repos.totalCount
+                import_repos_count = import_repos.totalCount
 
-        import_repos_pages = import_repos_count // GH_PAGE_LIMIT
+                import_repos_pages = import_repos_count // GH_PAGE_LIMIT
 
-        if (import_repos_count % GH_PAGE_LIMIT) > 0:
-            import_repos_pages += 1
+                if (import_repos_count % GH_PAGE_LIMIT) > 0:
+                    import_repos_pages += 1
 
-        logger.debug(f"import_repos_count={import_repos_count}, import_repos_pages={import_repos_pages}")
+                logger.debug(f"import_repos_count={import_repos_count}, import_repos_pages={import_repos_pages}")
 
-        filtered_repos = []
-        for i in range(0, import_repos_pages):
-            logger.debug(f"processing page of repos {i}")
-            current_page = get_page_wrapper(import_repos, i, show_rate_limit)
-            filtered_repos.extend(filter_chunk(current_page, exclude_list))
-        import_yamls.extend(filtered_repos)
-    logger.debug(f"filtered_repos(len)={len(filtered_repos)} import_yamls(len)={len(import_yamls)}")
+                filtered_repos = []
+                for i in range(0, import_repos_pages):
+                    logger.debug(f"processing page of repos {i}")
+                    current_page = get_page_wrapper(import_repos, i, show_rate_limit)
+                    filtered_repos.extend(filter_chunk(current_page, exclude_list))
+                import_yamls.extend(filtered_repos)
+            logger.debug(f"filtered_repos(len)={len(filtered_repos)} import_yamls(len)={len(import_yamls)}")
     # we will likely want to put a limit around this, as we need to walk forked repose and try to get import.yaml
     # since github won't index a fork if it has less stars than upstream
 
@@ -307,78 +570,148 @@ def sync(
 
     logger.debug(f"forks(len):{len(forks)}")
 
-    if s.forks is True and len(forks) > 0:
-        logger.debug(f"processing {len(forks)} forks")
-        typer.echo(f"Scanning {len(forks)} forks for import.yaml", err=True)
-
-        with typer.progressbar(forks, label="Scanning: ") as forks_progress:
-            for fork in forks_progress:
-                try:
-                    logger.debug(f"processing fork [{pformat(fork)}]")
-                    f_owner = fork.source.owner
-                    f_name = fork.source.name
-                    f_repo = gh.get_repo(f"{f_owner}/{f_name}")
-
-                    f_yaml = f_repo.get_contents(".snyk.d/import.yaml")
-                    yaml_repo = watchlist.get_repo(f_repo.id)
-                    if yaml_repo:
-                        yaml_repo.parse_import(f_yaml, instance=s.instance)
-                except Exception as e:
-                    typer.echo(f"\n\n - error processing fork: {e!r}\n")
-                    typer.echo("dumping fork object:")
-                    pprint(fork)
-                    logger.error(f"error processing fork... message={str(e)}")
-
-        typer.echo(f"Have {len(import_yamls)} Repos with an import.yaml", err=True)
-
-    if len(import_yamls) > 0:
-        logger.debug(f"processing [{pformat(import_yamls)}] imports")
-        typer.echo(f"Loading import.yaml for non fork-ed repos", err=True)
-
-        with typer.progressbar(import_yamls, label="Scanning: ") as import_progress:
-            for import_yaml in import_progress:
-                logger.debug(f"processing import [{pformat(import_yaml)}")
-                r_id = import_yaml.repository.id
-
-                import_repo = watchlist.get_repo(r_id)
-
-                if import_repo and str(import_repo.import_sha) != str(import_yaml.sha):
+    with metrics.phase("fork_scan"):
+        if s.forks is True and len(forks) > 0 and not s.github_graphql:
+            logger.debug(f"processing {len(forks)} forks")
+            typer.echo(f"Scanning {len(forks)} forks for import.yaml", err=True)
+
+            with typer.progressbar(forks, label="Scanning: ") as forks_progress:
+                for fork in forks_progress:
                     try:
-                        import_repo.parse_import(import_yaml, instance=s.instance)
+                        logger.debug(f"processing fork [{pformat(fork)}]")
+                        f_owner = fork.source.owner
+                        f_name = fork.source.name
+                        f_repo = gh.get_repo(f"{f_owner}/{f_name}")
+
+                        f_yaml = f_repo.get_contents(".snyk.d/import.yaml")
+                        yaml_repo = watchlist.get_repo(f_repo.id)
+                        if yaml_repo:
+                            yaml_repo.parse_import(f_yaml, instance=s.instance)
                     except Exception as e:
-                        typer.echo(
-                            f"\n\n*** ERROR processing import.yaml file:"
-                            f"Please check that it is valid YAML\n {e}"
-                            f"\ndumping repo object: {import_repo}\n"
-                        )
-                        logger.error(f"error processing import... message={str(e)}")
+                        typer.echo(f"\n\n - error processing fork: {e!r}\n")
+                        typer.echo("dumping fork object:")
+                        pprint(fork)
+                        logger.error(f"error processing fork... message={str(e)}")
+
+            typer.echo(f"Have {len(import_yamls)} Repos with an import.yaml", err=True)
+
+    with metrics.phase("import_yaml"):
+        if len(import_yamls) > 0:
+            logger.debug(f"processing [{pformat(import_yamls)}] imports")
+            typer.echo(f"Loading import.yaml for non fork-ed repos", err=True)
+
+            with typer.progressbar(import_yamls, label="Scanning: ") as import_progress:
+                for import_yaml in import_progress:
+                    logger.debug(f"processing import [{pformat(import_yaml)}")
+                    r_id = import_yaml.repository.id
+
+                    import_repo = watchlist.get_repo(r_id)
+
+                    if import_repo and str(import_repo.import_sha) != str(import_yaml.sha):
+                        try:
+                            import_repo.parse_import(import_yaml, instance=s.instance)
+                        except Exception as e:
+                            typer.echo(
+                                f"\n\n*** ERROR processing import.yaml file:"
+                                f"Please check that it is valid YAML\n {e}"
+                                f"\ndumping repo object: {import_repo}\n"
+                            )
+                            logger.error(f"error processing import... message={str(e)}")
 
     # this calls our new Orgs object which caches and populates Snyk data locally for us
-    all_orgs = Orgs(cache=str(s.cache_dir), groups=s.snyk_groups)
+    all_orgs = Orgs(cache=str(s.cache_dir), groups=s.snyk_groups, backend=s.cache_backend, cache_format=s.cache_format)
     select_orgs = [str(o["orgId"]) for k, o in s.snyk_orgs.items()]
 
     logger.error(f"all_orgs={pformat(all_orgs)} select_orgs={pformat(select_orgs)}")
+    if show_rate_limit:
+        typer.echo(governor.state(), err=True)
+
     typer.echo(f"Updating cache of Snyk projects", err=True)
 
-    all_orgs.refresh_orgs(client, v3client, origin="github-enterprise", selected_orgs=select_orgs)
-    all_orgs.save()
+    with metrics.phase("snyk_refresh"):
+        if s.snyk_async:
+            async_client = AsyncRestClient.from_client(v3client, concurrency=s.snyk_workers)
+        else:
+            async_client = None
+
+        all_orgs.refresh_orgs(
+            client,
+            v3client,
+            origin="github-enterprise",
+            selected_orgs=select_orgs,
+            workers=s.snyk_workers,
+            async_client=async_client,
+        )
+
+        if async_client is not None:
+            async_client.close()
+
+    with metrics.phase("save"):
+        all_orgs.save()
 
     typer.echo("Scanning Snyk for projects originating from GitHub Enterprise Repos", err=True)
-    for repo in watchlist.repos:
-        logger.debug(f"processing watchlist repo={pformat(repo)}")
-        found_projects = all_orgs.find_projects_by_repo(repo.full_name, repo.id)
-        for p in found_projects:
-            logger.debug(f"repo found and added")
-            repo.add_project(p)
-
-    watchlist.save(cachedir=str(s.cache_dir))
+    with metrics.phase("join"):
+        for repo in watchlist.repos:
+            logger.debug(f"processing watchlist repo={pformat(repo)}")
+            found_projects = all_orgs.find_projects_by_repo(repo.full_name, repo.id)
+            for p in found_projects:
+                logger.debug(f"repo found and added")
+                repo.add_project(p)
+
+    listing_state = {"last_listing": dt.isoformat(listing_started)}
+
+    if updated_since is None:
+        listing_state["last_full_listing"] = dt.isoformat(listing_started)
+    elif "last_full_listing" in sync_state:
+        listing_state["last_full_listing"] = sync_state["last_full_listing"]
+
+    with metrics.phase("save"):
+        watchlist.save(cachedir=str(s.cache_dir), state=listing_state, backend=s.cache_backend, fmt=s.cache_format)
     typer.echo("Sync completed", err=True)
 
+    if gh_cache is not None:
+        logger.info(f"github response cache hits={gh_cache.hits} misses={gh_cache.misses}")
+        typer.echo(gh_cache.summary(), err=True)
+        metrics.cache("github", gh_cache.hits, gh_cache.misses)
+
+        # a full listing makes every request a sync repeats, the entries it didn't use (like the contents of an
+        # import.yaml, only fetched again once it changes) would never be revalidated. Incremental listings only
+        # make some of those requests, so their unused entries are left for the next full listing
+        if updated_since is None:
+            logger.info(f"pruned {gh_cache.prune_unused()} unused github response cache entries")
+
+    metrics.count("repos", len(watchlist.repos))
+    metrics.count("import_yamls", len(import_yamls))
+    metrics.count("orgs", len(all_orgs.orgs))
+    metrics.count("projects", sum(len(o.projects) for o in all_orgs.orgs))
+
     del all_orgs
 
     typer.echo(f"Total Repos: {len(watchlist.repos)}", err=True)
 
 
+def get_incremental_watermark(sync_state: dict, cached_repos: int) -> Optional[dt]:
+    """
+    Returns the time the previous listing started when this sync can stop at it, or None when a full listing
+    is due: incremental listing is off, there is no usable previous listing, or the last full listing (which is
+    the only one that can notice deleted repos) is older than the full listing interval
+    """
+    if not s.github_incremental or s.github_graphql:
+        return None
+
+    if cached_repos == 0 or "last_listing" not in sync_state or "last_full_listing" not in sync_state:
+        logger.debug("no previous listing to work from, doing a full listing")
+        return None
+
+    last_full_listing = dt.fromisoformat(sync_state["last_full_listing"])
+
+    if last_full_listing < dt.utcnow() - timedelta(hours=s.full_listing_interval):
+        logger.debug(f"last full listing was at {last_full_listing}, doing a full listing")
+        return None
+
+    return dt.fromisoformat(sync_state["last_listing"])
+
+
 @app.command()
 def status():
     """
@@ -421,7 +754,8 @@ def status():
 
     typer.echo("Attempting to load cache", err=True)
 
-    watchlist = load_watchlist(s.cache_dir)
+    with metrics.phase("load_cache"):
+        watchlist = load_watchlist(s.cache_dir, s.cache_backend, s.cache_format)
     logger.debug(f"watchlist={pformat(watchlist)}")
 
     typer.echo("Cache loaded successfully", err=True)
@@ -457,15 +791,19 @@ def targets(
         sync()
     else:
         load_conf()
-        tmp_watch: SnykWatchList = load_watchlist(s.cache_dir)
-        watchlist.repos = tmp_watch.repos
-        logger.debug(f"loaded cache... tmp_watch={pformat(watchlist.repos)}")
+        with metrics.phase("load_cache"):
+            tmp_watch: SnykWatchList = load_watchlist(s.cache_dir, s.cache_backend, s.cache_format)
+            watchlist.use_cache(tmp_watch)
+            logger.debug(f"loaded cache... tmp_watch={pformat(watchlist.repos)}")
 
     # print(f"{watchlist=}")
 
-    all_orgs = Orgs(cache=str(s.cache_dir), groups=s.snyk_groups)
-    all_orgs.load()
-    logger.debug(f"all_orgs={pformat(all_orgs)}")
+    with metrics.phase("load_cache"):
+        all_orgs = Orgs(
+            cache=str(s.cache_dir), groups=s.snyk_groups, backend=s.cache_backend, cache_format=s.cache_format
+        )
+        all_orgs.load(lazy=True)
+        logger.debug(f"all_orgs={pformat(all_orgs)}")
 
     target_list = []
 
@@ -481,32 +819,35 @@ def targets(
 
     logger.debug(f"filtered_repos={pformat(filtered_repos)}")
 
-    for r in filtered_repos:
-        logger.debug(f"processing repo={pformat(r)}")
-        if r.needs_reimport(s.default_org, s.snyk_orgs) or force_refresh:
-            logger.debug(f"needs reimport")
-            for branch in r.get_reimport(s.default_org, s.snyk_orgs):
-                logger.debug(f"processing branch={pformat(branch)}")
-                if branch.project_count() == 0 or force_refresh:
-                    if force_default:
-                        org_id = s.snyk_orgs[s.default_org]["orgId"]
-                        int_id = s.snyk_orgs[s.default_org]["integrations"]["github-enterprise"]
-                    else:
-                        org_id = branch.org_id
-                        int_id = branch.integrations["github-enterprise"]
-
-                    logger.debug(f"org_id={org_id}, int_id={int_id}")
-                    source = r.source.get_target()
-                    logger.debug(f"source={pformat(source)}")
-                    source["branch"] = branch.name
-
-                    target = {
-                        "target": source,
-                        "integrationId": int_id,
-                        "orgId": org_id,
-                    }
-
-                    target_list.append(target)
+    with metrics.phase("targets"):
+        for r in filtered_repos:
+            logger.debug(f"processing repo={pformat(r)}")
+            if watchlist.needs_reimport(r) or force_refresh:
+                logger.debug(f"needs reimport")
+                for branch in watchlist.get_reimport(r):
+                    logger.debug(f"processing branch={pformat(branch)}")
+                    if branch.project_count() == 0 or force_refresh:
+                        if force_default:
+                            org_id = s.snyk_orgs[s.default_org]["orgId"]
+                            int_id = s.snyk_orgs[s.default_org]["integrations"]["github-enterprise"]
+                        else:
+                            org_id = branch.org_id
+                            int_id = branch.integrations["github-enterprise"]
+
+                        logger.debug(f"org_id={org_id}, int_id={int_id}")
+                        source = r.source.get_target()
+                        logger.debug(f"source={pformat(source)}")
+                        source["branch"] = branch.name
+
+                        target = {
+                            "target": source,
+                            "integrationId": int_id,
+                            "orgId": org_id,
+                        }
+
+                        target_list.append(target)
+
+    metrics.count("targets", len(target_list))
 
     final_targets: List = list()
     logger.debug(f"final_targets={pformat(final_targets)}")
@@ -523,25 +864,26 @@ def targets(
 
         final_targets.append(g_targets)
 
-    if save_targets is True:
-        logger.debug(f"saving targets")
-        typer.echo(f"Writing targets to {s.targets_dir}", err=True)
-        if os.path.isdir(f"{s.targets_dir}") is not True:
-            typer.echo(f"Creating directory to {s.targets_dir}", err=True)
-            os.mkdir(f"{s.targets_dir}")
-        for targets in final_targets:
-            file_name = f"{s.targets_dir}/{targets.pop('name')}.json"
-            if len(targets["targets"]) > 50:
-                minimize = True
-            else:
-                minimize = False
+    with metrics.phase("write"):
+        if save_targets is True:
+            logger.debug(f"saving targets")
+            typer.echo(f"Writing targets to {s.targets_dir}", err=True)
+            if os.path.isdir(f"{s.targets_dir}") is not True:
+                typer.echo(f"Creating directory to {s.targets_dir}", err=True)
+                os.mkdir(f"{s.targets_dir}")
+            for targets in final_targets:
+                file_name = f"{s.targets_dir}/{targets.pop('name')}.json"
+                if len(targets["targets"]) > 50:
+                    minimize = True
+                else:
+                    minimize = False
 
-            if jwrite(targets, file_name, minimize):
-                typer.echo(f"Wrote {file_name} Successfully", err=True)
-            else:
-                typer.echo(f"Failed to Write {file_name}", err=True)
-    else:
-        typer.echo(json.dumps(final_targets, indent=2))
+                if jwrite(targets, file_name, minimize):
+                    typer.echo(f"Wrote {file_name} Successfully", err=True)
+                else:
+                    typer.echo(f"Failed to Write {file_name}", err=True)
+        else:
+            typer.echo(json.dumps(final_targets, indent=2))
 
 
 @app.command()
@@ -555,7 +897,13 @@ def tags(
     global s
     global watchlist
 
-    v1client = SnykClient(str(s.snyk_token), user_agent=f"pysnyk/snyk_services/mapper/{__version__}", tries=1, delay=1)
+    v1client = MeteredSnykClient(
+        str(s.snyk_token),
+        url=f"{s.snyk_url}/v1",
+        user_agent=f"pysnyk/snyk_services/mapper/{__version__}",
+        tries=1,
+        delay=1,
+    )
 
     if status() == False:
         logger.debug(f"cache not current, syncing")
@@ -564,27 +912,33 @@ def tags(
         logger.debug(f"loading config")
         load_conf()
 
-    tmp_watch = load_watchlist(s.cache_dir)
-    logger.debug(f"tmp_watch={pformat(tmp_watch)}")
-    watchlist.repos = tmp_watch.repos
+    with metrics.phase("load_cache"):
+        tmp_watch = load_watchlist(s.cache_dir, s.cache_backend, s.cache_format)
+        logger.debug(f"tmp_watch={pformat(tmp_watch)}")
+        watchlist.use_cache(tmp_watch)
 
-    all_orgs = Orgs(cache=str(s.cache_dir), groups=s.snyk_groups)
-    all_orgs.load()
-    logger.debug(f"all_orgs={all_orgs}")
+        all_orgs = Orgs(
+            cache=str(s.cache_dir), groups=s.snyk_groups, backend=s.cache_backend, cache_format=s.cache_format
+        )
+        all_orgs.load(lazy=True)
+        logger.debug(f"all_orgs={all_orgs}")
 
     needs_tags = list()
+    tag_summary = tag_updates.TagUpdateSummary()
+    trust_cache = update_tags is True and cache_is_trusted()
 
-    for group in s.snyk_groups:
-        logger.debug(f"processing group={pformat(group)}")
-        group_tags = {"name": group["name"], "tags": list()}
+    with metrics.phase("tag_diff"):
+        for group in s.snyk_groups:
+            logger.debug(f"processing group={pformat(group)}")
+            group_tags = {"name": group["name"], "tags": list()}
 
-        orgs = all_orgs.get_orgs_by_group(group)
-        logger.debug(f"orgs={pformat(orgs)}")
-        o_ids = [str(o.id) for o in orgs]
+            orgs = all_orgs.get_orgs_by_group(group)
+            logger.debug(f"orgs={pformat(orgs)}")
+            o_ids = [str(o.id) for o in orgs]
 
-        group_tags["tags"] = watchlist.get_proj_tag_updates(o_ids)
+            group_tags["tags"] = watchlist.get_proj_tag_updates(o_ids)
 
-        needs_tags.append(group_tags)
+            needs_tags.append(group_tags)
 
     # now we iterate over needs_tags by group and save out a per group tag file
 
@@ -596,38 +950,13 @@ def tags(
 
                 snyk_token = all_orgs.get_token_for_group(g_tags["name"])
 
-                update_client(v1client, snyk_token)
-
-                for p in g_tags["tags"]:
-                    # v1 api for tags only accepts strings for tag value
-                    # this forces everything to string
-                    for t in p["tags"]:
-                        for k in t:
-                            if type(t[k]) is not str:
-                                t[k] = str(t[k])
+                # the group's client is shared by the workers, so its token is never swapped while they run
+                group_client = clone_client(v1client, snyk_token)
 
-                    p_path = f"org/{p['org_id']}/project/{p['project_id']}"
-                    p_tag_path = f"{p_path}/tags"
-
-                    try:
-                        p_live = v1client.get(p_path).json()
-                    except SnykHTTPError as e:
-                        typer.echo(f"Error: retrieving project path: {p_path} error:\n{e}")
-                        logger.exception(f"issue getting project path error={str(e)}")
-                        break
-
-                    tags_to_post = [t for t in p["tags"] if t not in p_live["tags"]]
-
-                    if len(tags_to_post) > 0:
-                        typer.echo(f"Updating {g_tags['name']} project {p_live['name']} tags", err=True)
-                        for tag in tags_to_post:
-                            try:
-                                v1client.post(p_tag_path, tag)
-                            except SnykHTTPError as e:
-                                if e.code == 422:
-                                    typer.echo(f"Error: Tag for project already exists")
-                                else:
-                                    raise Exception(f"snyk api returned code: {e.code}")
+                with metrics.phase("tag_update"):
+                    tag_updates.update_tags(
+                        group_client, g_tags["tags"], g_tags["name"], s.tag_workers, tag_summary, trust_cache
+                    )
 
             if save_tags is True:
                 typer.echo(f"Writing {g_tags['name']} tag updates to {s.tags_dir}")
@@ -646,6 +975,49 @@ def tags(
         else:
             typer.echo(f"No {g_tags['name']} projects require tag updates", err=True)
 
+    metrics.count("tag_updates", sum(len(g_tags["tags"]) for g_tags in needs_tags))
+
+    if update_tags is True:
+        metrics.count("tags_posted", tag_summary.posted)
+        metrics.count("tags_existing", tag_summary.existing)
+        metrics.count("projects_tagged", tag_summary.updated)
+        metrics.count("project_reads", tag_summary.reads)
+        metrics.count("tag_failures", len(tag_summary.failures))
+
+        typer.echo(str(tag_summary), err=True)
+
+        for failure in tag_summary.failures:
+            typer.echo(f" - {failure['project']}: {failure['error']}", err=True)
+
+        if tag_summary.failures:
+            raise typer.Exit(code=1)
+
+
+def cache_is_trusted() -> bool:
+    """
+    Whether the cache is recent enough (see --trust-cache-minutes) for tag updates to go by its project tags
+    """
+    if not s.trust_cache_minutes:
+        return False
+
+    last_sync = load_sync_state(s.cache_dir).get("last_sync")
+
+    if last_sync is None:
+        return False
+
+    age = dt.utcnow() - dt.fromisoformat(last_sync)
+
+    if age > timedelta(minutes=s.trust_cache_minutes):
+        typer.echo(
+            f"Cache is older than {s.trust_cache_minutes} minutes, reading each project before tagging", err=True
+        )
+        return False
+
+    typer.echo(
+        f"Cache is {age.total_seconds() / 60:.0f} minutes old, updating tags from the cached projects", err=True
+    )
+    return True
+
 
 @app.command()
 def autoconf(
@@ -659,7 +1031,9 @@ def autoconf(
     """
     global s
 
-    client = SnykClient(str(s.snyk_token), user_agent=f"pysnyk/snyk_services/mapper/{__version__}")
+    client = MeteredSnykClient(
+        str(s.snyk_token), url=f"{s.snyk_url}/v1", user_agent=f"pysnyk/snyk_services/mapper/{__version__}"
+    )
 
     conf: Dict[Any, Any] = dict()
     conf["schema"] = 2
@@ -714,6 +1088,47 @@ def autoconf(
     logger.debug(f"snyk_orgs={pformat(snyk_orgs)}")
 
 
+cache_app = typer.Typer(help="Manage the local cache")
+app.add_typer(cache_app, name="cache")
+
+
+@cache_app.command("convert")
+def cache_convert(
+    to: str = typer.Option(..., "--to", help=f"Format to rewrite the cache in: {', '.join(CACHE_FORMATS)}"),
+):
+    """
+    Rewrites the cached repos and Snyk orgs in another file format, keeping the time of the last sync
+    """
+    global s
+
+    if s.cache_backend != "json":
+        typer.echo("Only the json cache backend has a file format to convert", err=True)
+        raise typer.Exit(code=1)
+
+    try:
+        get_codec(to)
+    except Exception as e:
+        typer.echo(f"Error: {e}", err=True)
+        raise typer.Exit(code=1)
+
+    typer.echo(f"Converting the cache in {s.cache_dir} to {to}", err=True)
+
+    tmp_watch = load_watchlist(s.cache_dir, "json", to)
+
+    if not tmp_watch.repos:
+        typer.echo("No cached repos to convert, run a sync first", err=True)
+        raise typer.Exit(code=1)
+
+    # the conversion isn't a sync, so the cache keeps its age
+    tmp_watch.save(cachedir=str(s.cache_dir), state=load_sync_state(s.cache_dir), fmt=to)
+
+    all_orgs = Orgs(cache=str(s.cache_dir), cache_format=to)
+    all_orgs.load(lazy=True)
+    all_orgs.save()
+
+    typer.echo(f"Converted {len(tmp_watch.repos)} repos and {len(all_orgs.orgs)} orgs to {to}", err=True)
+
+
 def load_conf():
     global s
     global watchlist
@@ -726,6 +1141,9 @@ def load_conf():
 
     s.snyk_groups = conf_file["snyk"]["groups"]
 
+    # extra GitHub tokens and GitHub Apps, on top of the github_token
+    s.github_tokens = conf_file.get("github_tokens", list())
+
     s.snyk_orgs = yopen(s.snyk_orgs_file)
 
     watchlist.default_org = s.default_org
@@ -737,6 +1155,7 @@ def load_conf():
         env_var = group["token_env_name"]
         if env_var in environ.keys():
             group["snyk_token"] = environ[env_var]
+            http_record.add_secret(group["snyk_token"])
         else:
             raise Exception(f"Environment Variable {env_var} is not set properly and required")
 
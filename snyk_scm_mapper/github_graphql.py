@@ -0,0 +1,259 @@
+import base64
+import logging
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import backoff
+import requests
+import typer
+from github.ContentFile import ContentFile
+from github.GithubException import GithubException
+from github.GithubException import RateLimitExceededException
+from github.Repository import Repository
+from github_pool import CredentialPool
+from metrics import metrics
+from rate_governor import RATE_LIMIT_TRIES
+from rate_governor import governor
+
+
+logger = logging.getLogger(__name__)
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+IMPORT_YAML_PATH = ".snyk.d/import.yaml"
+
+REPOS_QUERY = """
+query($org: String!, $first: Int!, $cursor: String) {
+  organization(login: $org) {
+    repositories(first: $first, after: $cursor, orderBy: {field: UPDATED_AT, direction: DESC}) {
+      totalCount
+      pageInfo {
+        hasNextPage
+        endCursor
+      }
+      nodes {
+        databaseId
+        name
+        nameWithOwner
+        url
+        isFork
+        isArchived
+        visibility
+        updatedAt
+        owner {
+          login
+        }
+        defaultBranchRef {
+          name
+        }
+        repositoryTopics(first: 100) {
+          nodes {
+            topic {
+              name
+            }
+          }
+        }
+        importYaml: object(expression: "HEAD:%s") {
+          ... on Blob {
+            oid
+            text
+          }
+        }
+      }
+    }
+  }
+}
+""" % (
+    IMPORT_YAML_PATH
+)
+
+GraphQLRepo = Tuple[Repository, Optional[ContentFile]]
+
+
+def make_session(token: str) -> requests.Session:
+    session = requests.Session()
+    session.headers.update({"Authorization": f"bearer {token}"})
+    session.headers.update({"User-Agent": "pysnyk/snyk_services/snyk_scm_mapper"})
+
+    return session
+
+
+# the governor waits out the limit before the retry, see utils
+@backoff.on_exception(
+    backoff.constant, RateLimitExceededException, interval=0, jitter=None, max_tries=RATE_LIMIT_TRIES
+)
+def graphql_query(
+    session: requests.Session,
+    url: str,
+    query: str,
+    variables: dict,
+    show_rate_limit: bool = False,
+    pool: Optional[CredentialPool] = None,
+):
+    if pool is not None:
+        credential = governor.acquire("graphql", pool.serving(variables.get("org")))
+        headers = {"Authorization": pool.authorization(credential)}
+    else:
+        credential = governor.acquire("graphql")
+        headers = dict()
+
+    metrics.request("github_graphql")
+    resp = session.post(url, json={"query": query, "variables": variables}, headers=headers)
+
+    try:
+        data = resp.json()
+    except ValueError:
+        data = {}
+
+    errors = data.get("errors") or list()
+
+    rate_limited = any(e.get("type") == "RATE_LIMITED" for e in errors)
+    rate_limited = governor.update("graphql", resp.status_code, resp.headers, resp.text, credential, rate_limited)
+
+    # only a rate limit the governor will wait out is retried, any other 403 (SAML, missing scopes) is final
+    if rate_limited:
+        if not show_rate_limit:
+            typer.echo("GitHub rate limit was hit.. backing off...")
+        raise RateLimitExceededException(resp.status_code, data, dict(resp.headers))
+
+    if resp.status_code != 200 or (errors and not data.get("data")):
+        raise GithubException(resp.status_code, data, dict(resp.headers))
+
+    for error in errors:
+        logger.warning(f"graphql query returned a partial error: {error}")
+
+    return data["data"]
+
+
+def to_repository(node: dict) -> Repository:
+    """
+    Reshapes a GraphQL repository node into the REST representation SnykWatchList.add_repo expects
+    """
+    if node["defaultBranchRef"] is not None:
+        default_branch = node["defaultBranchRef"]["name"]
+    else:
+        default_branch = None
+
+    raw_repo = {
+        "id": node["databaseId"],
+        "name": node["name"],
+        "full_name": node["nameWithOwner"],
+        "html_url": node["url"],
+        "fork": node["isFork"],
+        "archived": node["isArchived"],
+        "visibility": str(node["visibility"]).lower(),
+        "updated_at": node["updatedAt"],
+        "owner": {"login": node["owner"]["login"]},
+        "default_branch": default_branch,
+        "topics": [t["topic"]["name"] for t in node["repositoryTopics"]["nodes"]],
+    }
+
+    return Repository(None, {}, raw_repo, completed=True)
+
+
+def to_import_yaml(node: dict, repo: Repository) -> Optional[ContentFile]:
+    """
+    Wraps the import.yaml blob in the same ContentFile that a code search hit provides to Repo.parse_import
+    """
+    blob = node.get("importYaml")
+
+    if not blob or blob.get("text") is None:
+        return None
+
+    raw_content = {
+        "name": IMPORT_YAML_PATH.split("/")[-1],
+        "path": IMPORT_YAML_PATH,
+        "sha": blob["oid"],
+        "encoding": "base64",
+        "content": base64.b64encode(str(blob["text"]).encode("utf-8")).decode("ascii"),
+        "repository": repo.raw_data,
+    }
+
+    return ContentFile(None, {}, raw_content, completed=True)
+
+
+def get_repos_page(
+    session: requests.Session,
+    url: str,
+    gh_org_name: str,
+    cursor: Optional[str] = None,
+    page_size: int = 100,
+    show_rate_limit: bool = False,
+    pool: Optional[CredentialPool] = None,
+) -> Tuple[List[GraphQLRepo], int, Optional[str]]:
+    """
+    Returns one page of an org's repos with their import.yaml, the org's total repo count, and the cursor
+    for the next page (None on the last page)
+    """
+    variables = {"org": gh_org_name, "first": page_size, "cursor": cursor}
+
+    data = graphql_query(session, url, REPOS_QUERY, variables, show_rate_limit, pool)
+
+    if data.get("organization") is None:
+        raise Exception(f"GitHub org {gh_org_name} was not found or is not visible to this token")
+
+    repositories = data["organization"]["repositories"]
+
+    page = list()
+
+    for node in repositories["nodes"]:
+        if node is None:
+            continue
+        repo = to_repository(node)
+        page.append((repo, to_import_yaml(node, repo)))
+
+    if repositories["pageInfo"]["hasNextPage"]:
+        next_cursor = repositories["pageInfo"]["endCursor"]
+    else:
+        next_cursor = None
+
+    return page, int(repositories["totalCount"]), next_cursor
+
+
+def iter_repos(
+    token: str,
+    gh_org_names: List[str],
+    url: str = GRAPHQL_URL,
+    page_size: int = 100,
+    workers: int = 1,
+    show_rate_limit: bool = False,
+    pool: Optional[CredentialPool] = None,
+) -> Iterator[Tuple[str, List[GraphQLRepo], int]]:
+    """
+    Walks the repos of every org through the GraphQL API, one cursor chain per org with orgs fetched concurrently.
+    Yields (org name, page of (repo, import.yaml) pairs, total repos across the orgs seen so far). With a credential
+    pool, each page is fetched with the credential serving its org that has the most rate limit left
+    """
+    session = make_session(token)
+    totals: Dict[str, int] = dict()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        running: Dict[Future, str] = dict()
+
+        def queue_page(gh_org_name: str, cursor: Optional[str]):
+            future = executor.submit(
+                get_repos_page, session, url, gh_org_name, cursor, page_size, show_rate_limit, pool
+            )
+            running[future] = gh_org_name
+
+        for gh_org_name in gh_org_names:
+            queue_page(gh_org_name, None)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                gh_org_name = running.pop(future)
+                page, total, next_cursor = future.result()
+                totals[gh_org_name] = total
+
+                if next_cursor is not None:
+                    queue_page(gh_org_name, next_cursor)
+
+                yield gh_org_name, page, sum(totals.values())
@@ -0,0 +1,170 @@
+import logging
+import re
+import threading
+import time
+from os import environ
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from github import Auth
+from github import GithubIntegration
+from rate_governor import DEFAULT_CREDENTIAL
+
+
+logger = logging.getLogger(__name__)
+
+# installation tokens last an hour, they're replaced this long before they expire
+TOKEN_REFRESH_MARGIN = 300
+
+
+class Credential:
+    """
+    A GitHub token of the pool, usable for the orgs it is limited to, or for any org when it isn't
+    """
+
+    def __init__(self, name: str, token: Optional[str] = None, orgs: Optional[Iterable[str]] = None):
+        self.name = name
+        self.token = token
+        self.orgs = {str(o).lower() for o in orgs} if orgs else None
+
+    def serves(self, org: Optional[str]) -> bool:
+        if self.orgs is None:
+            return True
+
+        return org is not None and org.lower() in self.orgs
+
+    def authorization(self) -> str:
+        return f"token {self.token}"
+
+
+class AppCredential(Credential):
+    """
+    A GitHub App installation, whose short lived installation token is created on first use and replaced before
+    it expires. Without an installation id, the installation on its (only) org is looked up
+    """
+
+    def __init__(
+        self,
+        name: str,
+        app_id: str,
+        private_key: str,
+        orgs: Optional[Iterable[str]] = None,
+        installation_id: Optional[int] = None,
+        base_url: str = "https://api.github.com",
+    ):
+        super().__init__(name, orgs=orgs)
+        self.integration = GithubIntegration(auth=Auth.AppAuth(app_id, private_key), base_url=base_url)
+        self.installation_id = installation_id
+        self.expires = 0.0
+        self.lock = threading.Lock()
+
+    def authorization(self) -> str:
+        with self.lock:
+            if self.token is None or self.expires - TOKEN_REFRESH_MARGIN <= time.time():
+                if self.installation_id is None:
+                    org = next(iter(self.orgs or list()))
+                    self.installation_id = self.integration.get_org_installation(org).id
+
+                access = self.integration.get_access_token(self.installation_id)
+                self.token = access.token
+                self.expires = access.expires_at.timestamp()
+                logger.info(f"created an installation token for {self.name}, expiring {access.expires_at}")
+
+            return f"token {self.token}"
+
+
+class CredentialPool:
+    """
+    The GitHub credentials a sync spreads its requests over. Requests are sent with the default token, and the
+    connection swaps in whichever credential serving the request's org the rate governor picks
+    """
+
+    def __init__(self, default_token: str, credentials: Optional[List[Credential]] = None):
+        self.default_authorization = f"token {default_token}"
+        self.credentials: Dict[str, Credential] = {DEFAULT_CREDENTIAL: Credential(DEFAULT_CREDENTIAL, default_token)}
+
+        for credential in credentials or list():
+            self.credentials[credential.name] = credential
+
+    def __len__(self) -> int:
+        return len(self.credentials)
+
+    def serving(self, org: Optional[str]) -> List[str]:
+        """
+        The credentials that can make a request concerning org. Requests that can't be tied to an org go to the
+        credentials not limited to any
+        """
+        names = [c.name for c in self.credentials.values() if c.serves(org)]
+
+        return names or [DEFAULT_CREDENTIAL]
+
+    def authorization(self, name: str) -> str:
+        return self.credentials[name].authorization()
+
+
+def request_org(url: str) -> Optional[str]:
+    """
+    The org (or user) a GitHub REST request concerns, when its URL tells
+    """
+    parts = urlsplit(url)
+
+    match = re.search(r"/(?:orgs|repos|users)/([^/]+)", parts.path)
+    if match:
+        return match.group(1)
+
+    if "/search/" in parts.path:
+        query = " ".join(parse_qs(parts.query).get("q", list()))
+        match = re.search(r"\b(?:org|user|repo):([^/\s]+)", query)
+        if match:
+            return match.group(1)
+
+    return None
+
+
+def make_pool(default_token: str, entries: Optional[List[dict]] = None, base_url: str = "https://api.github.com"):
+    """
+    Builds the pool from the github_tokens of snyk-sync.yaml, each entry either a token
+    (token_env_name, optionally orgs) or a GitHub App (app_id, private_key_env_name or private_key_file, and
+    orgs or installation_id)
+    """
+    credentials: List[Credential] = list()
+
+    for i, entry in enumerate(entries or list()):
+        orgs = entry.get("orgs")
+
+        if "token_env_name" in entry:
+            env_var = entry["token_env_name"]
+            if env_var not in environ.keys():
+                raise Exception(f"Environment Variable {env_var} is not set properly and required")
+            credentials.append(Credential(env_var, environ[env_var], orgs))
+            continue
+
+        if "app_id" not in entry:
+            raise Exception(f"github_tokens entry {i + 1} needs a token_env_name or an app_id")
+
+        if "private_key_file" in entry:
+            with open(entry["private_key_file"], "r") as the_file:
+                private_key = the_file.read()
+        elif entry.get("private_key_env_name") in environ.keys():
+            private_key = environ[entry["private_key_env_name"]]
+        else:
+            raise Exception(f"GitHub App {entry['app_id']} needs a private_key_file or a private_key_env_name set")
+
+        if "installation_id" in entry:
+            name = f"app {entry['app_id']} installation {entry['installation_id']}"
+            credentials.append(
+                AppCredential(name, entry["app_id"], private_key, orgs, int(entry["installation_id"]), base_url)
+            )
+        elif orgs:
+            # an installation only reaches the org it's installed on
+            for org in orgs:
+                name = f"app {entry['app_id']} {org}"
+                credentials.append(AppCredential(name, entry["app_id"], private_key, [org], None, base_url))
+        else:
+            raise Exception(f"GitHub App {entry['app_id']} needs its orgs or an installation_id")
+
+    return CredentialPool(default_token, credentials)
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+from typing import Optional
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+# headers that describe the 304 itself rather than the cached representation
+FRESH_HEADERS = ("date", "x-ratelimit-limit", "x-ratelimit-remaining", "x-ratelimit-reset", "x-ratelimit-used")
+
+
+class ResponseCache:
+    """
+    On disk cache of GitHub GET responses keyed by URL (and the credential used), revalidated with
+    If-None-Match / If-Modified-Since. A 304 doesn't count against GitHub's primary rate limit, and is answered
+    here with the stored body so callers never see the difference.
+
+    Entries are touched whenever they're read or written, so those a run didn't use can be told apart by their
+    modification time and pruned.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # with a second to spare for file systems whose timestamps lag the clock
+        self.opened = time.time() - 1
+
+    def key(self, url: str, headers: Dict[str, str]) -> str:
+        auth = headers.get("Authorization", "")
+        return hashlib.sha256(f"{auth}\n{url}".encode("utf-8")).hexdigest()
+
+    def get(self, url: str, headers: Dict[str, str]) -> Optional[dict]:
+        entry_file = self.path / f"{self.key(url, headers)}.json"
+
+        try:
+            with open(entry_file, "r") as the_file:
+                entry = json.load(the_file)
+
+            os.utime(entry_file)
+
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"ignoring unreadable response cache entry {entry_file}: {e!r}")
+            return None
+
+    def conditional_headers(self, entry: dict) -> Dict[str, str]:
+        conditions = dict()
+
+        if entry.get("etag"):
+            conditions["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            conditions["If-Modified-Since"] = entry["last_modified"]
+
+        return conditions
+
+    def store(self, url: str, headers: Dict[str, str], resp: requests.Response):
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+
+        with self.lock:
+            self.misses += 1
+
+        if not etag and not last_modified:
+            return
+
+        entry = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": dict(resp.headers),
+            "body": resp.text,
+        }
+
+        entry_file = self.path / f"{self.key(url, headers)}.json"
+        tmp_file = entry_file.with_suffix(f".{threading.get_ident()}.tmp")
+
+        with open(tmp_file, "w") as the_file:
+            json.dump(entry, the_file)
+
+        os.replace(tmp_file, entry_file)
+
+    def revalidated(self, resp: requests.Response, entry: dict) -> requests.Response:
+        """
+        Turns a 304 into the 200 it stands for, using the stored body and headers
+        """
+        headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+
+        for name in FRESH_HEADERS:
+            if name in resp.headers:
+                headers[name] = resp.headers[name]
+
+        resp.status_code = 200
+        resp.headers = headers
+        resp._content = str(entry["body"]).encode("utf-8")
+        resp.encoding = "utf-8"
+
+        with self.lock:
+            self.hits += 1
+
+        return resp
+
+    def prune_unused(self) -> int:
+        """
+        Removes the entries (and any temporary files left by an interrupted write) that weren't read or written
+        since the cache was opened, returning how many were removed
+        """
+        removed = 0
+
+        for entry_file in self.path.iterdir():
+            try:
+                if entry_file.stat().st_mtime < self.opened:
+                    entry_file.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue
+
+        return removed
+
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+    def hit_ratio(self) -> float:
+        if self.lookups() == 0:
+            return 0.0
+
+        return self.hits / self.lookups()
+
+    def summary(self) -> str:
+        return f"{self.hits} of {self.lookups()} GitHub requests were served from cache ({self.hit_ratio():.0%})"
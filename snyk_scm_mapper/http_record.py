@@ -0,0 +1,297 @@
+import base64
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from pathlib import Path
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+logger = logging.getLogger(__name__)
+
+REDACTED = "REDACTED"
+
+# headers and query parameters that carry credentials, never written to a recording
+SECRET_HEADERS = ("authorization", "proxy-authorization", "cookie", "set-cookie", "x-api-key")
+SECRET_PARAMS = ("access_token", "client_secret", "token")
+
+# GitHub's token formats: personal, OAuth, user to server, installation and refresh tokens
+GITHUB_TOKEN_PATTERN = re.compile(r"\bgh[pousr]_[A-Za-z0-9]{36,}\b|\bgithub_pat_[A-Za-z0-9_]{22,}\b")
+
+# the body is stored decoded, so the headers describing its encoding on the wire no longer apply
+WIRE_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+# every requests session, including the throwaway ones pysnyk's SnykClient makes per request, sends through this
+_original_send = HTTPAdapter.send
+
+
+class Scrubber:
+    """
+    Removes credentials from what is recorded: the secret headers and query parameters, and any known token
+    value wherever else it turns up
+    """
+
+    def __init__(self, secrets: Optional[List[str]] = None):
+        self.secrets: List[str] = list()
+
+        for secret in secrets or list():
+            self.add(secret)
+
+    def add(self, secret: Optional[str]):
+        # short values would redact unrelated text
+        if secret and len(str(secret)) >= 8 and str(secret) not in self.secrets:
+            self.secrets.append(str(secret))
+
+    def text(self, value: str) -> str:
+        for secret in self.secrets:
+            value = value.replace(secret, REDACTED)
+
+        # GitHub App installation tokens are handed out in responses, before they can be added as secrets
+        return GITHUB_TOKEN_PATTERN.sub(REDACTED, value)
+
+    def url(self, url: str) -> str:
+        parts = urlsplit(url)
+
+        if parts.query:
+            query = [(k, REDACTED if k.lower() in SECRET_PARAMS else v) for k, v in parse_qsl(parts.query, True)]
+            parts = parts._replace(query=urlencode(query))
+
+        return self.text(urlunsplit(parts))
+
+    def headers(self, headers) -> Dict[str, str]:
+        return {
+            k: REDACTED if k.lower() in SECRET_HEADERS else self.text(str(v))
+            for k, v in headers.items()
+            if k.lower() not in WIRE_HEADERS
+        }
+
+
+def request_key(scrubber: Scrubber, request: requests.PreparedRequest) -> Tuple[str, str, str]:
+    """
+    What a request is replayed by: its method, its scrubbed URL and a digest of its scrubbed body
+    """
+    body = request.body or b""
+
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+    elif not isinstance(body, str):
+        # a streamed body can't be read without consuming it
+        body = ""
+
+    body = scrubber.text(body).encode("utf-8")
+
+    return str(request.method), scrubber.url(str(request.url)), hashlib.sha256(body).hexdigest()
+
+
+def encode_body(scrubber: Scrubber, content: bytes) -> dict:
+    try:
+        return {"body": scrubber.text(content.decode("utf-8"))}
+    except UnicodeDecodeError:
+        return {"body_base64": base64.b64encode(content).decode("ascii")}
+
+
+def decode_body(exchange: dict) -> bytes:
+    if "body_base64" in exchange:
+        return base64.b64decode(exchange["body_base64"])
+
+    return str(exchange.get("body", "")).encode("utf-8")
+
+
+class Recorder:
+    """
+    Writes every HTTP exchange of the run, GitHub's and Snyk's alike, to <path>/<command>.jsonl with the
+    credentials scrubbed. Threads record concurrently, each exchange is one line
+    """
+
+    def __init__(self, path: Path, command: str, secrets: Optional[List[str]] = None):
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self.filename = Path(path) / f"{command}.jsonl"
+        self.scrubber = Scrubber(secrets)
+        self.lock = threading.Lock()
+        self.count = 0
+        self.started = time.time()
+
+        # a recording is of one run
+        self.file = open(self.filename, "w")
+
+    def send(self, adapter: HTTPAdapter, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        method, url, body_digest = request_key(self.scrubber, request)
+        exchange = {
+            "method": method,
+            "url": url,
+            "body_sha256": body_digest,
+            "request_headers": self.scrubber.headers(request.headers),
+            "offset": time.time() - self.started,
+        }
+
+        start = time.perf_counter()
+
+        try:
+            resp = _original_send(adapter, request, **kwargs)
+            content = resp.content
+        except requests.RequestException as e:
+            exchange.update({"elapsed": time.perf_counter() - start, "error": self.scrubber.text(repr(e))})
+            self.write(exchange)
+            raise
+
+        exchange.update(
+            {
+                "elapsed": time.perf_counter() - start,
+                "status": resp.status_code,
+                "reason": resp.reason,
+                "headers": self.scrubber.headers(resp.headers),
+                **encode_body(self.scrubber, content or b""),
+            }
+        )
+        self.write(exchange)
+
+        return resp
+
+    def write(self, exchange: dict):
+        line = json.dumps(exchange)
+
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def summary(self) -> str:
+        return f"recorded {self.count} HTTP exchanges to {self.filename}"
+
+
+class Replayer:
+    """
+    Answers every HTTP request of the run from a recording made by Recorder, without touching the network.
+
+    Requests are matched on their method, URL and body. A request made more than once gets the recorded responses
+    in the order they were recorded, so retries and repeated reads play out as they did, and once those run out the
+    last one is repeated. A request that was never recorded gets a 404. With latency, each response takes as long
+    as it originally did
+    """
+
+    def __init__(self, path: Path, command: str, latency: bool = False):
+        self.filename = Path(path) / f"{command}.jsonl"
+        self.scrubber = Scrubber()
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.exchanges: Dict[Tuple[str, str, str], Deque[dict]] = dict()
+        self.replayed = 0
+        self.misses = 0
+        self.first_miss: Optional[str] = None
+
+        with open(self.filename, "r") as the_file:
+            for line in the_file:
+                if not line.strip():
+                    continue
+                exchange = json.loads(line)
+                key = (exchange["method"], exchange["url"], exchange["body_sha256"])
+                self.exchanges.setdefault(key, deque()).append(exchange)
+
+        logger.info(f"loaded {sum(len(e) for e in self.exchanges.values())} HTTP exchanges from {self.filename}")
+
+    def next_exchange(self, key: Tuple[str, str, str]) -> Optional[dict]:
+        with self.lock:
+            recorded = self.exchanges.get(key)
+
+            if not recorded:
+                self.misses += 1
+                self.first_miss = self.first_miss or f"{key[0]} {key[1]}"
+                return None
+
+            self.replayed += 1
+
+            return recorded.popleft() if len(recorded) > 1 else recorded[0]
+
+    def send(self, adapter: HTTPAdapter, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        key = request_key(self.scrubber, request)
+        exchange = self.next_exchange(key)
+
+        if exchange is None:
+            logger.warning(f"no recorded response for {key[0]} {key[1]}, answering 404")
+            exchange = {"status": 404, "reason": "Not Recorded", "headers": {}, "body": "", "elapsed": 0}
+
+        if self.latency:
+            time.sleep(exchange.get("elapsed", 0))
+
+        if "error" in exchange:
+            raise requests.ConnectionError(f"replayed {exchange['error']}", request=request)
+
+        resp = requests.Response()
+        resp.status_code = exchange["status"]
+        resp.reason = exchange.get("reason")
+        resp.headers = CaseInsensitiveDict(exchange["headers"])
+        resp._content = decode_body(exchange)
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp.url = str(request.url)
+        resp.request = request
+        resp.connection = adapter
+        resp.elapsed = timedelta(seconds=exchange.get("elapsed", 0))
+
+        return resp
+
+    def close(self):
+        pass
+
+    def summary(self) -> str:
+        summary = f"replayed {self.replayed} HTTP exchanges from {self.filename}"
+
+        if self.misses:
+            summary += f", {self.misses} requests had no recording (first: {self.first_miss})"
+
+        return summary
+
+
+_active: Optional[Union[Recorder, Replayer]] = None
+
+
+def install(handler):
+    """
+    Routes every requests adapter through the recorder or replayer
+    """
+    global _active
+
+    def send(adapter: HTTPAdapter, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        return handler.send(adapter, request, **kwargs)
+
+    HTTPAdapter.send = send  # type: ignore
+    _active = handler
+
+
+def uninstall():
+    global _active
+
+    HTTPAdapter.send = _original_send  # type: ignore
+
+    if _active is not None:
+        _active.close()
+        _active = None
+
+
+def add_secret(secret: Optional[str]):
+    """
+    Scrubs a token loaded after the recording started, such as a group's from its env var
+    """
+    if isinstance(_active, Recorder):
+        _active.scrubber.add(secret)
@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+
+import requests
+from cache_store import atomic_write
+from snyk.client import SnykClient
+from snyk.errors import SnykHTTPError
+
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "snyk_scm_mapper"
+
+
+class Metrics:
+    """
+    What a run spent its time and requests on: the duration of each phase, requests, retries and rate limit
+    sleeps per API, cache hits and misses, and counts of what was processed. Shared by every thread of the run
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.command = "all"
+        self.started = time.time()
+        self.phases: Dict[str, float] = dict()
+        self.requests: Dict[str, int] = dict()
+        self.retries: Dict[str, int] = dict()
+        self.rate_limit_sleeps: Dict[str, int] = dict()
+        self.rate_limit_sleep_seconds: Dict[str, float] = dict()
+        self.cache_hits: Dict[str, int] = dict()
+        self.cache_misses: Dict[str, int] = dict()
+        self.counts: Dict[str, int] = dict()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Times the block as the named phase, a phase entered more than once adds up
+        """
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    def request(self, api: str, retry: bool = False):
+        with self.lock:
+            self.requests[api] = self.requests.get(api, 0) + 1
+            if retry:
+                self.retries[api] = self.retries.get(api, 0) + 1
+
+    def rate_limited(self, api: str, seconds: float):
+        with self.lock:
+            self.rate_limit_sleeps[api] = self.rate_limit_sleeps.get(api, 0) + 1
+            self.rate_limit_sleep_seconds[api] = self.rate_limit_sleep_seconds.get(api, 0) + seconds
+
+    def cache(self, name: str, hits: int, misses: int):
+        with self.lock:
+            self.cache_hits[name] = self.cache_hits.get(name, 0) + hits
+            self.cache_misses[name] = self.cache_misses.get(name, 0) + misses
+
+    def count(self, name: str, value: int):
+        with self.lock:
+            self.counts[name] = value
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                "command": self.command,
+                "started": self.started,
+                "duration_seconds": time.time() - self.started,
+                "phases": dict(self.phases),
+                "requests": dict(self.requests),
+                "retries": dict(self.retries),
+                "rate_limit_sleeps": dict(self.rate_limit_sleeps),
+                "rate_limit_sleep_seconds": dict(self.rate_limit_sleep_seconds),
+                "cache_hits": dict(self.cache_hits),
+                "cache_misses": dict(self.cache_misses),
+                "counts": dict(self.counts),
+            }
+
+    def prometheus(self) -> str:
+        """
+        The summary in the Prometheus text format, every metric labelled with the command that was run
+        """
+        summary = self.summary()
+        command = summary["command"]
+        lines = list()
+
+        def gauge(name: str, help: str, label: Optional[str], values: Dict[str, float]):
+            lines.append(f"# HELP {PREFIX}_{name} {help}")
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            for key, value in sorted(values.items()):
+                labels = f'command="{command}"' + (f',{label}="{key}"' if label else "")
+                lines.append(f"{PREFIX}_{name}{{{labels}}} {value!r}")
+
+        gauge("run_duration_seconds", "Duration of the last run", None, {"": summary["duration_seconds"]})
+        gauge("run_timestamp_seconds", "When the last run finished", None, {"": time.time()})
+        gauge("phase_duration_seconds", "Time the last run spent in each phase", "phase", summary["phases"])
+        gauge("requests", "Requests the last run made to each API, retries included", "api", summary["requests"])
+        gauge("retries", "Requests the last run retried after a failure", "api", summary["retries"])
+        gauge("rate_limit_sleeps", "Times the last run waited on a rate limit", "api", summary["rate_limit_sleeps"])
+        gauge(
+            "rate_limit_sleep_seconds",
+            "Time the last run spent waiting on rate limits",
+            "api",
+            summary["rate_limit_sleep_seconds"],
+        )
+        gauge("cache_hits", "Lookups the last run answered from a cache", "cache", summary["cache_hits"])
+        gauge("cache_misses", "Lookups the last run couldn't answer from a cache", "cache", summary["cache_misses"])
+        gauge("items", "What the last run processed", "kind", summary["counts"])
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_file: Optional[Path] = None, textfile: Optional[Path] = None):
+        """
+        Writes the JSON summary and the Prometheus textfile. Either may be a directory, which then gets a
+        snyk_scm_mapper_<command> file, so each command keeps its own
+        """
+        for target, extension, render in (
+            (json_file, "json", lambda: json.dumps(self.summary(), indent=4)),
+            (textfile, "prom", self.prometheus),
+        ):
+            if target is None:
+                continue
+
+            filename = str(target)
+            if os.path.isdir(filename):
+                filename = f"{filename}/{PREFIX}_{self.command}.{extension}"
+
+            try:
+                # node exporter reads the textfile whenever it's scraped, so it's never seen half written
+                atomic_write(filename, render())
+            except OSError as e:
+                logger.warning(f"could not write metrics to {filename}: {e!r}")
+
+
+metrics = Metrics()
+
+
+class MeteredSnykClient(SnykClient):
+    """
+    SnykClient counting each request it makes, and the retries among them, in metrics
+    """
+
+    _last_failed = threading.local()
+
+    def request(self, method, url: str, headers: object, params: object = None, json: object = None):
+        # retry_call makes every attempt of a request from the same thread, one after another, so an attempt
+        # following a failed one for the same url is a retry, unless the failed one was already the last try
+        last_failed = getattr(self._last_failed, "attempt", None)
+
+        if last_failed is not None and last_failed[0] == (method, url) and last_failed[1] < self.tries:
+            attempt = last_failed[1] + 1
+        else:
+            attempt = 1
+
+        metrics.request("snyk", retry=attempt > 1)
+
+        try:
+            resp = super().request(method, url, headers, params, json)
+        except (SnykHTTPError, requests.RequestException):
+            self._last_failed.attempt = ((method, url), attempt)
+            raise
+
+        self._last_failed.attempt = None
+
+        return resp
@@ -1,29 +1,55 @@
+import asyncio
+import functools
 import json
 import logging
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any
+from typing import AsyncIterator
+from typing import Callable
+from typing import ClassVar
 from typing import Dict
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Tuple
 from uuid import UUID
 
 from api import v1_get_pages
+from api_async import AsyncRestClient
+from cache_store import RecordStore
+from cache_store import find_document
+from cache_store import read_document
+from cache_store import write_document
 from pydantic import UUID4
 from pydantic import BaseModel
 from pydantic import Field
+from pydantic import PrivateAttr
 from pydantic import validator
 from snyk.client import SnykClient
+from sqlite_cache import SqliteCache
+from utils import clone_client
 from utils import jopen
 from utils import to_camel_case
-from utils import update_client
 
 from .repositories import Project
+from .tracking import TrackedModel
+from .tracking import is_current
+from .tracking import schema_header
 
 
 logger = logging.getLogger(__name__)
 
+# per-record directories written by older versions, replaced by a RecordStore each
+LEGACY_RECORD_DIRS = ("targets", "projects")
 
-class Target(BaseModel):
+# the fields of an Org that Org.defer leaves unloaded until first used
+LAZY_FIELDS = {"integrations": dict, "targets": list, "projects": list}
+
+
+class Target(TrackedModel):
     class Config:
         allow_population_by_field_name = True
 
@@ -36,6 +62,8 @@ class Target(BaseModel):
     is_private: bool = Field(alias="attributes")
     repo_id: Optional[str] = Field(alias="attributes")
 
+    compact_fields: ClassVar[Tuple[str, ...]] = ("org_id", "org_slug", "origin")
+
     # , "origin", "remote_url", "is_private", "repo_id"
     @validator("name", "origin", "remote_url", pre=True)
     def validate_strings(cls, value, values, config, field):
@@ -80,7 +108,7 @@ class Target(BaseModel):
             return str(value["id"])
 
 
-class Org(BaseModel):
+class Org(TrackedModel):
     id: UUID4
     integrations: Dict[str, UUID4] = dict()
     projects: List[Project] = list()
@@ -90,7 +118,19 @@ class Org(BaseModel):
     group_id: UUID4
     group_name: str
     origins: List[str] = list()
-    last_updated: str = datetime.isoformat(datetime.utcnow())
+    # a factory, so the schema (and its fingerprint, see models.tracking) doesn't change with the time it's imported
+    last_updated: str = Field(default_factory=lambda: datetime.isoformat(datetime.utcnow()))
+
+    # lookup indexes over targets and projects, built on first use and dropped whenever either list changes
+    _target_indexes: Optional[Dict[str, Dict]] = PrivateAttr(default=None)
+    _project_index: Optional[Dict[str, List[Project]]] = PrivateAttr(default=None)
+
+    # where each target / project id sits in its list, so adds can replace duplicates without a scan
+    _target_positions: Optional[Dict[UUID, int]] = PrivateAttr(default=None)
+    _project_positions: Optional[Dict[UUID, int]] = PrivateAttr(default=None)
+
+    # fills in the LAZY_FIELDS of a deferred org, see defer()
+    _loader: Optional[Callable[["Org"], None]] = PrivateAttr(default=None)
     #       "name": "myDefaultOrg",
     #  "id": "689ce7f9-7943-4a71-b704-2ba575f01089",
     #  "slug": "my-default-org",
@@ -100,6 +140,87 @@ class Org(BaseModel):
     # def id(self):
     #     return self.orgId
 
+    def __getattr__(self, name):
+        # only reached for attributes the instance doesn't have, which for fields means they were deferred
+        if name in LAZY_FIELDS and self._loader is not None:
+            self.materialise()
+            return self.__dict__[name]
+
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def __setattr__(self, name, value):
+        if name in LAZY_FIELDS:
+            self.materialise()
+
+        super().__setattr__(name, value)
+
+        if name == "targets":
+            self._target_indexes = None
+            self._target_positions = None
+        elif name == "projects":
+            self._project_index = None
+            self._project_positions = None
+
+    def defer(self, loader: Callable[["Org"], None]):
+        """
+        Unloads the org's integrations, targets and projects, which loader(org) fills in the first time any of
+        them is used. Used when only the org metadata is needed, so the rest of the cache is never parsed
+        """
+        for name in LAZY_FIELDS:
+            self.__dict__.pop(name, None)
+
+        self._loader = loader
+
+    def is_deferred(self) -> bool:
+        return self._loader is not None
+
+    def materialise(self):
+        loader, self._loader = self._loader, None
+
+        if loader is None:
+            return
+
+        for name, default in LAZY_FIELDS.items():
+            self.__dict__.setdefault(name, default())
+
+        loader(self)
+
+    def target_positions(self) -> Dict[UUID, int]:
+        if self._target_positions is None:
+            self._target_positions = {t.id: idx for idx, t in enumerate(self.targets)}
+
+        return self._target_positions
+
+    def project_positions(self) -> Dict[UUID, int]:
+        if self._project_positions is None:
+            self._project_positions = {p.id: idx for idx, p in enumerate(self.projects)}
+
+        return self._project_positions
+
+    def target_indexes(self) -> Dict[str, Dict]:
+        if self._target_indexes is None:
+            indexes: Dict[str, Dict] = {"repo_id": dict(), "name": dict(), "id": dict()}
+
+            for t in self.targets:
+                indexes["repo_id"].setdefault(t.repo_id, list()).append(t)
+                indexes["name"].setdefault(str(t.name).lower(), list()).append(t)
+                indexes["id"].setdefault(str(t.id), list()).append(t)
+
+            self._target_indexes = indexes
+
+        return self._target_indexes
+
+    def project_index(self) -> Dict[str, List[Project]]:
+        if self._project_index is None:
+            index: Dict[str, List[Project]] = dict()
+
+            for p in self.projects:
+                index.setdefault(str(p.target).lower(), list()).append(p)
+
+            self._project_index = index
+
+        return self._project_index
+
     def has(self, item):
         return item in self.integrations
 
@@ -114,6 +235,26 @@ class Org(BaseModel):
     def int_list(self):
         return list(self.integrations.keys())
 
+    def parse_target(self, target: dict) -> Target:
+        new_target = Target.parse_obj(target)
+        new_target.org_id = self.id
+        new_target.org_slug = self.slug
+
+        return new_target
+
+    def parse_project(self, project: dict) -> Project:
+        project["org_id"] = self.id
+        project["org_slug"] = self.slug
+
+        return Project.parse_obj(project)
+
+    def link_project(self, project: Project):
+        project_target = self.get_target_info(project.target)
+
+        if project_target:
+            project.repo_name = project_target.name
+            project.repo_id = project_target.repo_id
+
     def refresh_targets(self, client: SnykClient, origin: str = None, exclude_empty: bool = True, limit: int = 100):
         """
         Retrieves all the targets from this org object, using the provided client
@@ -127,10 +268,7 @@ class Org(BaseModel):
         targets = client.get_v3_pages(path, params)
 
         for target in targets:
-            new_target = Target.parse_obj(target)
-            new_target.org_id = self.id
-            new_target.org_slug = self.slug
-            self.add_target(new_target)
+            self.add_target(self.parse_target(target))
 
     def refresh_projects(self, client: SnykClient, origin: str = None, target: UUID4 = None, limit: int = 100):
         """
@@ -145,18 +283,35 @@ class Org(BaseModel):
         projects = client.get_v3_pages(path, params)
 
         for project in projects:
-            project["org_id"] = self.id
-            project["org_slug"] = self.slug
+            new_project = self.parse_project(project)
 
-            new_project = Project.parse_obj(project)
+            self.link_project(new_project)
 
-            project_target = self.get_target_info(new_project.target)
+            self.add_project(new_project)
 
-            if project_target:
-                new_project.repo_name = project_target.name
-                new_project.repo_id = project_target.repo_id
+    async def iter_targets_async(
+        self, client: AsyncRestClient, token: str, origin: str = None, exclude_empty: bool = True, limit: int = 100
+    ) -> AsyncIterator[Target]:
+        """
+        Yields this org's targets as each page of the listing arrives
+        """
+        params = {"origin": origin, "limit": limit, "excludeEmpty": exclude_empty}
 
-            self.add_project(new_project)
+        async for page in client.iter_pages(f"orgs/{self.id}/targets", token, params):
+            for target in page:
+                yield self.parse_target(target)
+
+    async def iter_projects_async(
+        self, client: AsyncRestClient, token: str, origin: str = None, target: UUID4 = None, limit: int = 100
+    ) -> AsyncIterator[Project]:
+        """
+        Yields this org's projects as each page of the listing arrives, they aren't linked to their targets yet
+        """
+        params = {"targetId": target, "origin": origin, "limit": limit}
+
+        async for page in client.iter_pages(f"orgs/{self.id}/projects", token, params):
+            for project in page:
+                yield self.parse_project(project)
 
     def refresh_origins(self):
         target_origins = [o.origin for o in self.targets]
@@ -185,8 +340,41 @@ class Org(BaseModel):
         self.refresh_integrations(v1client)
         self.last_updated = datetime.isoformat(datetime.utcnow())
 
+    async def refresh_async(
+        self,
+        client: AsyncRestClient,
+        token: str,
+        v1client: SnykClient,
+        origin: str = None,
+        target: UUID4 = None,
+    ):
+        """
+        Same as refresh, but the target listing, project listing and integrations lookup run concurrently.
+        Projects are linked to their targets once both listings are complete
+        """
+        new_projects: List[Project] = list()
+
+        async def collect_targets():
+            async for new_target in self.iter_targets_async(client, token, origin):
+                self.add_target(new_target)
+
+        async def collect_projects():
+            async for new_project in self.iter_projects_async(client, token, origin, target):
+                new_projects.append(new_project)
+
+        await asyncio.gather(
+            collect_targets(), collect_projects(), asyncio.to_thread(self.refresh_integrations, v1client)
+        )
+
+        for new_project in new_projects:
+            self.link_project(new_project)
+            self.add_project(new_project)
+
+        self.refresh_origins()
+        self.last_updated = datetime.isoformat(datetime.utcnow())
+
     def get_target_info(self, id: UUID) -> Optional[Target]:
-        found_target = [t for t in self.targets if str(t.id) == str(id)]
+        found_target = self.target_indexes()["id"].get(str(id), list())
 
         if len(found_target) == 1:
             target = found_target[0]
@@ -206,91 +394,144 @@ class Org(BaseModel):
 
         return the_dict
 
-    def save(self, path):
-        if os.path.isdir(f"{path}/targets") is not True:
-            os.mkdir(f"{path}/targets")
+    def save(self, path, fmt: str = "json"):
+        # a deferred org whose records were never used has nothing new to write, unless it's changing format
+        if self.is_deferred() and not self.is_changed():
+            if find_document(path, "metadata", fmt) == f"{path}/metadata.{fmt}":
+                return
+            self.materialise()
 
-        if os.path.isdir(f"{path}/projects") is not True:
-            os.mkdir(f"{path}/projects")
+        write_document(path, "integrations", {k: str(v) for k, v in self.integrations.items()}, fmt)
 
-        with open(f"{path}/integrations.json", "w") as the_file:
-            json.dump(self.integrations, the_file, indent=4)
+        write_document(path, "metadata", {**self.get_metadata(), **schema_header(Org)}, fmt)
 
-        with open(f"{path}/metadata.json", "w") as the_file:
-            json.dump(self.get_metadata(), the_file, indent=4)
+        RecordStore(path, "targets", Target, fmt).save(self.targets)
 
-        for target in self.targets:
-            with open(f"{path}/targets/{target.id}.json", "w") as the_file:
-                json.dump(json.loads(target.json()), the_file, indent=4)
+        RecordStore(path, "projects", Project, fmt).save(self.projects)
 
-        for project in self.projects:
-            with open(f"{path}/projects/{project.id}.json", "w") as the_file:
-                json.dump(json.loads(project.json()), the_file, indent=4)
+        self.mark_saved()
 
-        pass
+        # the consolidated stores replace the old one-file-per-record layout, which is dropped once they are written
+        for legacy_dir in LEGACY_RECORD_DIRS:
+            if os.path.isdir(f"{path}/{legacy_dir}"):
+                shutil.rmtree(f"{path}/{legacy_dir}")
 
     def add_project(self, project: Project):
-        add_project = True
+        positions = self.project_positions()
 
-        for idx, item in enumerate(self.projects):
-            if project.id == item.id:
-                add_project = False
-                self.projects[idx] = project
-
-        if add_project:
+        if project.id in positions:
+            if self.projects[positions[project.id]] == project:
+                return
+            self.projects[positions[project.id]] = project
+        else:
+            positions[project.id] = len(self.projects)
             self.projects.append(project)
 
-    def add_target(self, target: Target):
-        add_target = True
+        self._project_index = None
+        self.changed()
 
-        for idx, item in enumerate(self.targets):
-            if target.id == item.id:
-                add_target = False
-                self.targets[idx] = target
+    def add_target(self, target: Target):
+        positions = self.target_positions()
 
-        if add_target:
+        if target.id in positions:
+            if self.targets[positions[target.id]] == target:
+                return
+            self.targets[positions[target.id]] = target
+        else:
+            positions[target.id] = len(self.targets)
             self.targets.append(target)
 
-    def load(self, path):
-        if os.path.isdir(f"{path}/targets") is not True:
-            raise Exception(f"{path}/targets does not exist")
+        self._target_indexes = None
+        self.changed()
 
-        if os.path.isdir(f"{path}/projects") is not True:
-            raise Exception(f"{path}/projects does not exist")
+    def load(self, path, fmt: str = "json"):
+        integrations_file = find_document(path, "integrations", fmt)
 
-        if os.path.isfile(f"{path}/integrations.json") is not True:
-            raise Exception(f"{path}/integrations.json does not exist")
+        if integrations_file is None:
+            raise Exception(f"{path}/integrations.{fmt} does not exist")
 
-        self.integrations = jopen(f"{path}/integrations.json")
+        self.integrations = read_document(integrations_file)
 
-        for target_file in os.listdir(f"{path}/targets"):
-            if os.path.isfile(f"{path}/targets/{target_file}") and target_file.endswith(".json"):
-                new_target = Target.parse_file(f"{path}/targets/{target_file}")
+        for record, trusted in self.read_records(path, "targets", Target, fmt):
+            self.add_target(Target.from_cache(record, trusted))
 
-                self.add_target(new_target)
+        for record, trusted in self.read_records(path, "projects", Project, fmt):
+            self.add_project(Project.from_cache(record, trusted))
 
-        for project_file in os.listdir(f"{path}/projects"):
-            if os.path.isfile(f"{path}/projects/{project_file}") and project_file.endswith(".json"):
-                new_project = Project.parse_file(f"{path}/projects/{project_file}")
+        self.loaded()
 
-                self.add_project(new_project)
+    def load_sqlite(self, db_path):
+        store = SqliteCache(db_path)
+
+        integrations, targets, projects = store.get_org_records(str(self.id))
+
+        self.integrations = json.loads(integrations)
+
+        trusted = store.is_trusted(Target)
+        for target in targets:
+            self.add_target(Target.from_cache(json.loads(target), trusted))
+
+        trusted = store.is_trusted(Project)
+        for project in projects:
+            self.add_project(Project.from_cache(json.loads(project), trusted))
+
+        store.close()
+
+        self.loaded()
+
+    def loaded(self):
+        """
+        Marks the org and its records as matching the cache they were just read from
+        """
+        for target in self.targets:
+            target.mark_saved()
+
+        for project in self.projects:
+            project.mark_saved()
+
+        self.mark_saved()
+
+    def read_records(self, path, name, model, fmt: str = "json") -> Iterator[Tuple[Any, bool]]:
+        """
+        Reads an org's targets or projects from its consolidated store, falling back to the
+        one-file-per-record layout of older caches (which the next save migrates).
+        Yields each decoded record with whether it can be trusted to match the current schema
+        """
+        store = RecordStore.find(path, name, model, fmt)
+
+        if store.exists():
+            trusted = store.is_trusted()
+            for record in store.read():
+                yield record, trusted
+        elif os.path.isdir(f"{path}/{name}"):
+            logger.info(f"loading {path}/{name} from the legacy per-record layout")
+            for record_file in os.listdir(f"{path}/{name}"):
+                if os.path.isfile(f"{path}/{name}/{record_file}") and record_file.endswith(".json"):
+                    yield jopen(f"{path}/{name}/{record_file}"), False
+        else:
+            raise Exception(f"{store.data_file} does not exist")
 
     def find_targets_by_repo(self, name, id) -> List[Target]:
-        targets_by_id = [t for t in self.targets if t.repo_id == id]
+        indexes = self.target_indexes()
+
+        targets_by_id = list(indexes["repo_id"].get(id, list()))
 
-        targets_by_name = [t for t in self.targets if str(t.name).lower() == str(name).lower()]
+        targets_by_name = indexes["name"].get(str(name).lower(), list())
 
         if len(targets_by_name) == 0 and len(targets_by_id) == 0:
             return list()
         else:
+            found_ids = {t.id for t in targets_by_id}
+
             for target in targets_by_name:
-                if target.id not in [t.id for t in targets_by_id]:
+                if target.id not in found_ids:
                     targets_by_id.append(target)
+                    found_ids.add(target.id)
 
             return targets_by_id
 
     def find_projects_by_target(self, id) -> List[Project]:
-        projects = [p for p in self.projects if str(p.target).lower() == str(id).lower()]
+        projects = list(self.project_index().get(str(id).lower(), list()))
 
         return projects
 
@@ -312,50 +553,110 @@ class Orgs(BaseModel):
     orgs: List[Org] = list()
     cache: str = ""
     groups: List[dict] = list()
+    backend: str = "json"
+    cache_format: str = "json"
+
+    _org_positions: Optional[Dict[UUID, int]] = PrivateAttr(default=None)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+
+        if name == "orgs":
+            self._org_positions = None
+
+    def org_positions(self) -> Dict[UUID, int]:
+        if self._org_positions is None:
+            self._org_positions = {o.id: idx for idx, o in enumerate(self.orgs)}
+
+        return self._org_positions
+
+    def refresh_orgs(
+        self,
+        v1client: SnykClient,
+        v3client: SnykClient,
+        origin: str = None,
+        selected_orgs: list = [],
+        workers: int = 1,
+        async_client: Optional[AsyncRestClient] = None,
+    ):
+        """
+        Refreshes every org of every group, up to `workers` orgs at a time.
+        The given clients are only used as templates, each group gets its own pair using the group's token,
+        so no client ever has its token swapped while another thread is using it.
+        With an async_client, the targets and projects of every org are listed through it all at once instead
+        """
+        group_clients = dict()
 
-    def refresh_orgs(self, v1client: SnykClient, v3client: SnykClient, origin: str = None, selected_orgs: list = []):
         for group in self.groups:
-            group_id = group["id"]
-            group_token = group["snyk_token"]
+            group_clients[str(group["id"])] = (
+                clone_client(v1client, group["snyk_token"]),
+                clone_client(v3client, group["snyk_token"]),
+            )
 
-            v1client = update_client(v1client, group_token)
+        def get_group_orgs(group: dict) -> Optional[dict]:
+            v1_group_client = group_clients[str(group["id"])][0]
 
             try:
-                new_orgs = v1_get_pages(f"group/{group_id}/orgs", v1client, "orgs")
+                return v1_get_pages(f"group/{group['id']}/orgs", v1_group_client, "orgs")
             except:
                 print(f"Unable to load orgs from: {group['name']} with token stored at: {group['token_env_name']}")
+                return None
 
-            for org in new_orgs["orgs"]:
-                if len(selected_orgs) == 0 or org["id"] in selected_orgs:
-                    org["group_id"] = new_orgs["id"]
-                    org["group_name"] = new_orgs["name"]
-                    self.add_org(Org.parse_obj(org))
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            # map keeps the group order, so orgs are added in the same order whatever finishes first
+            for new_orgs in executor.map(get_group_orgs, self.groups):
+                if new_orgs is None:
+                    continue
 
-        for org in self.orgs:
-            logger.debug(f"Refreshing Org: {org.name}")
+                for org in new_orgs["orgs"]:
+                    if len(selected_orgs) == 0 or org["id"] in selected_orgs:
+                        org["group_id"] = new_orgs["id"]
+                        org["group_name"] = new_orgs["name"]
+                        self.add_org(Org.parse_obj(org))
+
+            if async_client is not None:
+                v1_clients = {org.id: group_clients[str(org.group_id)][0] for org in self.orgs}
+                asyncio.run(self.refresh_orgs_async(async_client, v1_clients, origin))
+                return
 
-            snyk_token = self.get_token_for_org(org)
+            def refresh_org(org: Org):
+                logger.debug(f"Refreshing Org: {org.name}")
 
-            v1client = update_client(v1client, snyk_token)
-            v3client = update_client(v3client, snyk_token)
+                v1_org_client, v3_org_client = group_clients[str(org.group_id)]
 
-            org.refresh(v1client, v3client, origin)
+                org.refresh(v1_org_client, v3_org_client, origin)
 
-        pass
+            # each org only writes to itself, and results are collected in org order so the first failure
+            # (in org order) is the one raised
+            for refreshed in [executor.submit(refresh_org, org) for org in self.orgs]:
+                refreshed.result()
+
+    async def refresh_orgs_async(
+        self, client: AsyncRestClient, v1_clients: Dict[UUID, SnykClient], origin: str = None
+    ):
+        refreshes = [
+            org.refresh_async(client, self.get_token_for_org(org), v1_clients[org.id], origin) for org in self.orgs
+        ]
+
+        results = await asyncio.gather(*refreshes, return_exceptions=True)
+
+        # raise the first failure in org order, not whichever happened to fail first
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
 
     def add_org(self, org: Org):
-        add_org = True
-
-        for idx, item in enumerate(self.orgs):
-            if org.id == item.id:
-                add_org = False
-                self.orgs[idx].name = org.name
-                self.orgs[idx].slug = org.slug
-                self.orgs[idx].group_name = org.group_name
-                self.orgs[idx].group_id = org.group_id
-                self.orgs[idx].last_updated = org.last_updated
-
-        if add_org:
+        positions = self.org_positions()
+
+        if org.id in positions:
+            idx = positions[org.id]
+            self.orgs[idx].name = org.name
+            self.orgs[idx].slug = org.slug
+            self.orgs[idx].group_name = org.group_name
+            self.orgs[idx].group_id = org.group_id
+            self.orgs[idx].last_updated = org.last_updated
+        else:
+            positions[org.id] = len(self.orgs)
             self.orgs.append(org)
 
     def summary(self):
@@ -373,6 +674,12 @@ class Orgs(BaseModel):
         print(f"All Targets: {sum(all_targets)}")
 
     def save(self):
+        if self.backend == "sqlite":
+            store = SqliteCache(f"{self.cache}/cache.db")
+            store.save_orgs(self.orgs)
+            store.close()
+            return
+
         if os.path.isdir(f"{self.cache}/org") is not True:
             os.mkdir(f"{self.cache}/org")
 
@@ -380,9 +687,16 @@ class Orgs(BaseModel):
             if os.path.isdir(f"{self.cache}/org/{org.slug}") is not True:
                 os.mkdir(f"{self.cache}/org/{org.slug}")
 
-            org.save(f"{self.cache}/org/{org.slug}")
+            org.save(f"{self.cache}/org/{org.slug}", self.cache_format)
+
+    def load(self, lazy: bool = False):
+        """
+        Loads every cached org. With lazy, only the org metadata is read up front, each org's integrations,
+        targets and projects are read the first time they are used
+        """
+        if self.backend == "sqlite":
+            return self.load_sqlite(lazy)
 
-    def load(self):
         if os.path.isdir(f"{self.cache}/org") is not True:
             raise Exception(f"{self.cache}/org does not exist")
 
@@ -393,15 +707,90 @@ class Orgs(BaseModel):
                 load_orgs.append(f"{self.cache}/org/{dir}")
 
         for org_path in load_orgs:
-            if os.path.isfile(f"{org_path}/metadata.json") is not True:
-                raise Exception(f"{org_path}/metadata.json does not exist")
+            metadata_file = find_document(org_path, "metadata", self.cache_format)
+
+            if metadata_file is None:
+                raise Exception(f"{org_path}/metadata.{self.cache_format} does not exist")
+
+            metadata = read_document(metadata_file)
+            new_org = Org.from_cache(metadata, is_current(metadata, Org))
+
+            if lazy:
+                new_org.defer(functools.partial(Org.load, path=org_path, fmt=self.cache_format))
+                new_org.mark_saved()
+            else:
+                new_org.load(org_path, self.cache_format)
+
+            self.add_org(new_org)
+
+    def load_sqlite(self, lazy: bool = False):
+        db_path = f"{self.cache}/cache.db"
+
+        if os.path.isfile(db_path) is not True:
+            raise Exception(f"{db_path} does not exist")
+
+        store = SqliteCache(db_path)
+
+        trusted = store.is_trusted(Org)
 
-            new_org = Org.parse_file(f"{org_path}/metadata.json")
+        for org_id, metadata in store.iter_org_metadata():
+            new_org = Org.from_cache(json.loads(metadata), trusted)
 
-            new_org.load(org_path)
+            if lazy:
+                new_org.defer(functools.partial(Org.load_sqlite, db_path=db_path))
+                new_org.mark_saved()
+            else:
+                new_org.load_sqlite(db_path)
 
             self.add_org(new_org)
 
+        store.close()
+
+    def cached_record_counts(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Returns the number of targets and projects each cached org holds, by org id. The counts come from the
+        store indexes (or the database) without reading the records themselves
+        """
+        if self.backend == "sqlite":
+            db_path = f"{self.cache}/cache.db"
+
+            if os.path.isfile(db_path) is not True:
+                return dict()
+
+            store = SqliteCache(db_path)
+            counts = store.org_record_counts()
+            store.close()
+
+            return counts
+
+        counts = dict()
+
+        if os.path.isdir(f"{self.cache}/org") is not True:
+            return counts
+
+        for dir in os.listdir(f"{self.cache}/org"):
+            org_path = f"{self.cache}/org/{dir}"
+            metadata_file = find_document(org_path, "metadata", self.cache_format)
+
+            if metadata_file is None:
+                continue
+
+            org_counts = list()
+
+            for name, model in (("targets", Target), ("projects", Project)):
+                store = RecordStore.find(org_path, name, model, self.cache_format)
+
+                if store.exists():
+                    org_counts.append(len(store.index()))
+                elif os.path.isdir(f"{org_path}/{name}"):
+                    org_counts.append(len(os.listdir(f"{org_path}/{name}")))
+                else:
+                    org_counts.append(0)
+
+            counts[str(read_document(metadata_file)["id"])] = (org_counts[0], org_counts[1])
+
+        return counts
+
     def find_projects_by_repo(self, name, id) -> List[Project]:
         found_projects = list()
 
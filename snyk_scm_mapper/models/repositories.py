@@ -1,6 +1,8 @@
 from datetime import datetime
+from typing import ClassVar
 from typing import List
 from typing import Optional
+from typing import Tuple
 
 import yaml
 from github import ContentFile
@@ -9,6 +11,8 @@ from pydantic import BaseModel
 from pydantic import Field
 from pydantic import validator
 
+from .tracking import TrackedModel
+
 
 class Source(BaseModel):
     fork: bool
@@ -29,7 +33,7 @@ class Tag(BaseModel):
     value: str
 
 
-class Project(BaseModel):
+class Project(TrackedModel):
     class Config:
         allow_population_by_field_name = True
 
@@ -47,6 +51,18 @@ class Project(BaseModel):
     repo_name: str = ""
     repo_id: Optional[int] = None
 
+    compact_fields: ClassVar[Tuple[str, ...]] = (
+        "tags",
+        "branch",
+        "type",
+        "status",
+        "org_id",
+        "org_slug",
+        "origin",
+        "target",
+        "repo_name",
+    )
+
     @validator("name", "origin", "type", "status", "branch", pre=True)
     def validate_strings(cls, value, values, config, field):
         if isinstance(value, str):
@@ -149,7 +165,7 @@ class Branch(BaseModel):
         return len(self.tags)
 
 
-class Repo(BaseModel):
+class Repo(TrackedModel):
     url: str
     source: Source
     id: int
@@ -165,6 +181,8 @@ class Repo(BaseModel):
     archived: bool = False
     visibility: str = "public"
 
+    compact_fields: ClassVar[Tuple[str, ...]] = ("tags", "org", "topics", "visibility")
+
     def get_reimport(self, default_org, snyk_orgs: dict) -> List[Branch]:
         """
         Returns a list branches and their associated projects that can be used for reimport
@@ -263,11 +281,16 @@ class Repo(BaseModel):
     def add_project(self, project: Project):
         if self.has_project(project.id):
             for idx, item in enumerate(self.projects):
-                if project.id == item.id:
+                if project.id == item.id and project is not item:
+                    # an equal project (the cached copy of one the org holds) is swapped for the org's instance
+                    # too, so each project is held once, but doesn't make the repo changed
+                    if project != item:
+                        self.changed()
                     self.projects[idx] = project
 
         else:
             self.projects.append(project)
+            self.changed()
 
     def match(self, **kwargs):
         valid_keys = {x: y for x, y in kwargs.items() if x in self.source.__dict__}
@@ -319,6 +342,8 @@ class Repo(BaseModel):
                 tmp_tag = {"key": k, "value": v}
                 self.tags.append(Tag.parse_obj(tmp_tag))
 
+            self.changed()
+
         if "branches" in r_yaml.keys():
             self.branches = r_yaml["branches"]
 
@@ -1,15 +1,21 @@
 import json
+import os
 from datetime import datetime
 from pathlib import Path
 from typing import Any
 from typing import Dict
 from typing import List
+from typing import Literal
 from typing import Optional
 
+from cache_store import RecordStore
+from cache_store import atomic_write
 from github import Repository
 from pydantic import UUID4
 from pydantic import BaseModel
+from pydantic import PrivateAttr
 from pydantic import error_wrappers
+from sqlite_cache import SqliteCache
 
 from .repositories import Branch
 from .repositories import Project
@@ -33,10 +39,30 @@ class Settings(BaseModel):
     snyk_token: Optional[UUID4]
     github_token: Optional[str]
     github_orgs: List[str] = list()
+    github_tokens: List[dict] = list()
     cache_timeout: Optional[float]
     instance: Optional[str]
     forks: bool = False
     force_sync: bool = False
+    github_workers: int = 8
+    snyk_workers: int = 4
+    tag_workers: int = 8
+    trust_cache_minutes: float = 0
+    snyk_async: bool = False
+    github_cache: bool = True
+    github_incremental: bool = False
+    full_listing_interval: float = 24
+    github_graphql: bool = False
+    github_graphql_url: str = "https://api.github.com/graphql"
+    github_url: str = "https://api.github.com"
+    snyk_url: str = "https://api.snyk.io"
+    cache_backend: Literal["json", "sqlite"] = "json"
+    cache_format: Literal["json", "msgpack"] = "json"
+    metrics_json: Optional[Path]
+    metrics_textfile: Optional[Path]
+    record: Optional[Path]
+    replay: Optional[Path]
+    replay_latency: bool = False
 
     def __getitem__(self, item):
         return getattr(self, item)
@@ -50,6 +76,37 @@ class SnykWatchList(BaseModel):
     default_org: str = ""
     snyk_orgs: dict = {}
 
+    # repos by id, built on first use and dropped whenever repos is assigned. The list is only changed through
+    # add_repo (which keeps the index up to date), prune or assigning it, never appended to from outside
+    _repo_index: Optional[Dict[int, Repo]] = PrivateAttr(default=None)
+
+    # set when loaded from the sqlite cache, whose repos come without projects: those are looked up through it
+    _store: Optional[SqliteCache] = PrivateAttr(default=None)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+
+        if name == "repos":
+            self._repo_index = None
+
+    def use_cache(self, loaded: "SnykWatchList"):
+        """
+        Takes the repos of a watchlist read by load_watchlist, along with the sqlite store they came from
+        """
+        self.repos = loaded.repos
+        self._store = loaded._store
+
+    def repo_index(self) -> Dict[int, Repo]:
+        if self._repo_index is None:
+            index: Dict[int, Repo] = dict()
+
+            for repo in self.repos:
+                index.setdefault(repo.id, repo)
+
+            self._repo_index = index
+
+        return self._repo_index
+
     def match(self, **kwargs):
         data = []
 
@@ -60,28 +117,26 @@ class SnykWatchList(BaseModel):
         return data
 
     def get_repo(self, id) -> Repo:
-        if self.has_repo(id):
-            filter_repo = [r for r in self.repos if r.id == id]
-
-            return filter_repo[0]
-        else:
-            return None
+        return self.repo_index().get(id)
 
     def has_repo(self, id) -> bool:
-        filter_repo = [r for r in self.repos if r.id == id]
-
-        return bool(len(filter_repo))
+        return id in self.repo_index()
 
-    def save(self, cachedir):
-        json_repos = [json.loads(r.json(by_alias=False)) for r in self.repos]
+    def save(self, cachedir, state: Optional[dict] = None, backend: str = "json", fmt: str = "json"):
+        if backend == "sqlite":
+            store = self._store or SqliteCache(f"{cachedir}/cache.db")
+            store.save_repos(self.repos)
+        else:
+            # one record per repo, only repos that changed since the cache was loaded are serialised again
+            RecordStore(cachedir, "data", Repo, fmt).save(self.repos)
 
-        with open(f"{cachedir}/data.json", "w") as the_file:
-            json.dump(json_repos, the_file, indent=4)
+            # data.json from older versions is superseded by the record store
+            if os.path.isfile(f"{cachedir}/data.json"):
+                os.remove(f"{cachedir}/data.json")
 
-        with open(f"{cachedir}/sync.json", "w") as the_file:
-            state = {"last_sync": datetime.isoformat(datetime.utcnow())}
+        state = {"last_sync": datetime.isoformat(datetime.utcnow()), **(state or dict())}
 
-            json.dump(state, the_file, indent=4)
+        atomic_write(f"{cachedir}/sync.json", json.dumps(state, indent=4))
 
     def add_repo(self, repo: Repository.Repository):
         tmp_source = Source(
@@ -110,9 +165,9 @@ class SnykWatchList(BaseModel):
         else:
             org_name = "default"
 
-        if self.has_repo(repo.id):
-            existing_repo = self.get_repo(repo.id)
+        existing_repo = self.get_repo(repo.id)
 
+        if existing_repo is not None:
             if existing_repo.is_older(repo.updated_at) or existing_repo.org != org_name:
                 existing_repo.source = tmp_source
 
@@ -147,6 +202,7 @@ class SnykWatchList(BaseModel):
                     updated_at=str(repo.updated_at),
                     full_name=str(repo.full_name),
                 )
+                self.repo_index()[tmp_target.id] = tmp_target
                 self.repos.append(tmp_target)
             except error_wrappers.ValidationError as e:
                 # we just want to skip repos we can't validate
@@ -155,7 +211,22 @@ class SnykWatchList(BaseModel):
     def get_org_id(self, project: Project) -> str:
         pass
 
+    def get_reimport(self, repo: Repo) -> List[Branch]:
+        if self._store is not None:
+            return self._store.get_reimport(repo, self.default_org, self.snyk_orgs)
+
+        return repo.get_reimport(self.default_org, self.snyk_orgs)
+
+    def needs_reimport(self, repo: Repo) -> bool:
+        if self._store is not None:
+            return self._store.needs_reimport(repo, self.default_org, self.snyk_orgs)
+
+        return repo.needs_reimport(self.default_org, self.snyk_orgs)
+
     def get_proj_tag_updates(self, org_ids: list) -> List[Branch]:
+        if self._store is not None:
+            return self._store.get_proj_tag_updates(self.default_org, self.snyk_orgs, org_ids)
+
         has_tags = [r for r in self.repos if r.has_tags()]
 
         needs_tags = list()
@@ -212,4 +283,6 @@ class SnykWatchList(BaseModel):
 
     # removes repositories that don't exist in github anymore
     def prune(self, repo_ids: list):
-        self.repos = [r for r in self.repos if r.id in repo_ids]
+        keep = set(repo_ids)
+
+        self.repos = [r for r in self.repos if r.id in keep]
@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import sys
+from typing import Any
+from typing import ClassVar
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Type
+from typing import TypeVar
+from uuid import UUID
+
+from pydantic import BaseModel
+from pydantic import PrivateAttr
+from pydantic.fields import SHAPE_LIST
+from pydantic.fields import SHAPE_SINGLETON
+from pydantic.utils import lenient_issubclass
+
+
+logger = logging.getLogger(__name__)
+
+# bump whenever what a cached record means changes without its fields changing (a validator's behaviour, say),
+# changes to the fields themselves are picked up by schema_fingerprint
+CACHE_SCHEMA_VERSION = 1
+
+_fingerprints: Dict[str, str] = dict()
+
+# shared instances of the values that repeat across records, see intern_value
+_interned: Dict[Any, Any] = dict()
+
+# a __fields_set__ per model, shared by every record of it that has all its fields set
+_all_fields: Dict[type, set] = dict()
+
+T = TypeVar("T", bound="TrackedModel")
+
+
+def schema_fingerprint(model: Type[BaseModel]) -> str:
+    if model.__name__ not in _fingerprints:
+        _fingerprints[model.__name__] = hashlib.sha256(model.schema_json().encode("utf-8")).hexdigest()[:16]
+
+    return _fingerprints[model.__name__]
+
+
+def schema_header(model: Type[BaseModel]) -> dict:
+    """
+    Describes the records of a cache file, so a later load can tell whether they were written by this version
+    """
+    return {"cache_schema": CACHE_SCHEMA_VERSION, "model": model.__name__, "fingerprint": schema_fingerprint(model)}
+
+
+def is_current(header: Optional[dict], model: Type[BaseModel]) -> bool:
+    if not isinstance(header, dict):
+        return False
+
+    return (
+        header.get("cache_schema") == CACHE_SCHEMA_VERSION
+        and header.get("model") == model.__name__
+        and header.get("fingerprint") == schema_fingerprint(model)
+    )
+
+
+def intern_value(value: Any) -> Any:
+    """
+    Returns a shared instance equal to value, for values that repeat across thousands of records (org slugs, org
+    ids, tags) and are never changed in place. Lists are interned item by item, into a new list
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+
+    if isinstance(value, list):
+        return [intern_value(v) for v in value]
+
+    if isinstance(value, UUID):
+        return _interned.setdefault(value, value)
+
+    if isinstance(value, BaseModel):
+        try:
+            return _interned.setdefault((type(value), tuple(value.__dict__.items())), value)
+        except TypeError:
+            # holds something unhashable, so can't be looked up
+            return value
+
+    return value
+
+
+def all_fields_set(model: Type[BaseModel]) -> set:
+    if model not in _all_fields:
+        _all_fields[model] = set(model.__fields__)
+
+    return _all_fields[model]
+
+
+# how construct_trusted converts each field of a model, worked out once per model
+_plans: Dict[type, List[Tuple[str, bool, bool, str, Any]]] = dict()
+
+
+def construct_plan(model: Type[BaseModel]) -> List[Tuple[str, bool, bool, str, Any]]:
+    if model not in _plans:
+        plan = list()
+
+        for name, field in model.__fields__.items():
+            if field.shape == SHAPE_LIST:
+                kind = "models" if lenient_issubclass(field.type_, BaseModel) else "list"
+            elif field.shape != SHAPE_SINGLETON:
+                kind = "any"
+            elif lenient_issubclass(field.type_, BaseModel):
+                kind = "model"
+            elif lenient_issubclass(field.type_, UUID):
+                kind = "uuid"
+            elif field.type_ in (str, int, bool):
+                kind = "scalar"
+            else:
+                kind = "any"
+
+            plan.append((name, bool(field.required), field.allow_none, kind, field.type_))
+
+        _plans[model] = plan
+
+    return _plans[model]
+
+
+def construct_trusted(model: Type[BaseModel], data: Any) -> Any:
+    """
+    Builds a model from the JSON it was cached as without running its validators, only converting what JSON
+    can't hold (nested models, UUIDs) and checking that required fields are there
+    """
+    if not isinstance(data, dict):
+        raise TypeError(f"{model.__name__} record must be an object")
+
+    values = dict()
+
+    for name, required, allow_none, kind, type_ in construct_plan(model):
+        if name not in data:
+            if required:
+                raise ValueError(f"{model.__name__} record is missing {name}")
+            continue
+
+        value = data[name]
+
+        if value is None:
+            if not allow_none:
+                raise ValueError(f"{model.__name__}.{name} may not be None")
+        elif kind == "scalar":
+            if not isinstance(value, type_):
+                raise TypeError(f"{model.__name__}.{name} must be {type_.__name__}")
+        elif kind == "uuid":
+            # JSON holds UUIDs as text, msgpack decodes them already
+            if not isinstance(value, UUID):
+                value = UUID(value)
+        elif kind == "model":
+            value = construct_trusted(type_, value)
+        elif kind in ("list", "models"):
+            if not isinstance(value, list):
+                raise TypeError(f"{model.__name__}.{name} must be a list")
+            if kind == "models":
+                value = [construct_trusted(type_, v) for v in value]
+
+        values[name] = value
+
+    record = model.construct(**values)
+
+    if isinstance(record, TrackedModel):
+        record.compact()
+
+    return record
+
+
+class TrackedModel(BaseModel):
+    """
+    Base for cached records that know whether they changed since they were last loaded from or written to the
+    cache, so saves can leave unchanged records alone. Assigning a field marks the record changed, methods that
+    change it in place (appending to one of its lists) call changed() themselves.
+    Records start out changed, loaders mark them saved once read back from the cache.
+    """
+
+    _changed: bool = PrivateAttr(default=True)
+
+    # fields whose values repeat across records, which are held as one shared instance each (see intern_value)
+    compact_fields: ClassVar[Tuple[str, ...]] = ()
+
+    def __init__(self, **data: Any):
+        super().__init__(**data)
+        self.compact()
+
+    @classmethod
+    def from_cache(cls: Type[T], data: Any, trusted: bool = False) -> T:
+        """
+        Loads a cached record. Records from a cache whose header matches this version are trusted, and built
+        without validation, falling back to parse_obj for anything else or any record that doesn't fit
+        """
+        if trusted:
+            try:
+                return construct_trusted(cls, data)
+            except (AttributeError, TypeError, ValueError) as e:
+                logger.warning(f"validating cached {cls.__name__} record that failed to load as trusted: {e!r}")
+
+        return cls.parse_obj(data)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+
+        if name in self.__fields__:
+            self._changed = True
+
+    def compact(self):
+        """
+        Swaps the values of compact_fields for shared instances, and the record's __fields_set__ for the one shared
+        by every record of the model when all fields are set. Hundreds of thousands of projects are held at once,
+        most of whose strings, ids and tags are the same as their neighbours'
+        """
+        values = self.__dict__
+
+        for name in self.compact_fields:
+            if name in values:
+                values[name] = intern_value(values[name])
+
+        if len(self.__fields_set__) == len(self.__fields__):
+            object.__setattr__(self, "__fields_set__", all_fields_set(type(self)))
+
+    def changed(self):
+        self._changed = True
+
+    def is_changed(self) -> bool:
+        return self._changed
+
+    def mark_saved(self):
+        self._changed = False
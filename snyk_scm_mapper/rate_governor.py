@@ -0,0 +1,255 @@
+import logging
+import threading
+import time
+from datetime import datetime as dt
+from typing import Dict
+from typing import Mapping
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import typer
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# GitHub asks for at least a minute's pause after a secondary rate limit that comes without a Retry-After
+SECONDARY_LIMIT_PAUSE = 60
+
+# GitHub's reset times are whole seconds, so waiting exactly until one can land a moment early
+RESET_SLACK = 1
+
+# below this share of its limit a budget's remaining requests are spread out until its reset
+PACE_BELOW = 0.1
+
+# how often --show-rate-limit reports the budgets
+REPORT_INTERVAL = 10
+
+# the metrics api each budget's requests and sleeps are recorded under
+METRICS_APIS = {"core": "github", "search": "github_search", "graphql": "github_graphql"}
+
+# how often a request that keeps being rate limited is retried, each retry having waited for the limit first
+RATE_LIMIT_TRIES = 10
+
+# the credential of the GitHub token in GITHUB_TOKEN (or the one github_token_env_name names)
+DEFAULT_CREDENTIAL = "default"
+
+# what a budget GitHub hasn't reported on yet ranks as, more than any limit GitHub hands out
+UNREPORTED_HEADROOM = 10**9
+
+
+class Budget:
+    """
+    What one GitHub rate limit (core, search or GraphQL) of one credential has left, as last reported by GitHub
+    """
+
+    def __init__(self, resource: str, credential: str = DEFAULT_CREDENTIAL):
+        self.resource = resource
+        self.credential = credential
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset: Optional[float] = None
+        self.blocked_until = 0.0
+        self.next_at = 0.0
+        # requests taken while the remaining count is unknown, so they can be spread before GitHub reports it
+        self.unreported = 0
+
+    def delay(self, now: float) -> float:
+        """
+        How long the next request has to wait
+        """
+        if self.blocked_until > now:
+            return self.blocked_until - now
+
+        if self.reset is not None and self.reset + RESET_SLACK <= now:
+            # a new window, whatever it holds will show in the next response
+            self.remaining = None
+            self.reset = None
+            self.next_at = 0.0
+
+        if self.remaining is None or self.reset is None:
+            return 0
+
+        if self.remaining <= 0:
+            return self.reset + RESET_SLACK - now
+
+        return max(self.next_at - now, 0)
+
+    def take(self, now: float):
+        """
+        Counts a request against the budget, once delay allows it
+        """
+        if self.remaining is None or self.reset is None:
+            self.unreported += 1
+            return
+
+        if self.limit and self.remaining < self.limit * PACE_BELOW:
+            # spread what's left evenly over the rest of the window rather than running dry early
+            self.next_at = now + (self.reset + RESET_SLACK - now) / self.remaining
+
+        self.remaining -= 1
+
+    def headroom(self) -> float:
+        """
+        The requests the budget has left, budgets never reported on ranking first
+        """
+        if self.remaining is None:
+            return UNREPORTED_HEADROOM - self.unreported
+
+        return self.remaining
+
+    def update(self, limit: int, remaining: int, reset: float):
+        # concurrent responses arrive out of order, within a window the lowest remaining is the latest
+        if self.reset == reset and self.remaining is not None:
+            remaining = min(remaining, self.remaining)
+
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.unreported = 0
+
+    def __str__(self) -> str:
+        if self.remaining is None or self.limit is None:
+            state = "unknown"
+        else:
+            state = f"{self.remaining}/{self.limit}"
+
+        if self.reset is not None:
+            state += f", resets {dt.fromtimestamp(self.reset).strftime('%H:%M:%S')}"
+
+        if self.blocked_until > time.time():
+            state += f", paused {self.blocked_until - time.time():.0f}s"
+
+        if self.credential != DEFAULT_CREDENTIAL:
+            return f"{self.credential} {self.resource} {state}"
+
+        return f"{self.resource} {state}"
+
+
+class RateGovernor:
+    """
+    Paces every GitHub request, REST, search and GraphQL alike, against the rate limit it counts towards. The
+    budgets follow the X-RateLimit headers of every response, so an exhausted budget waits exactly until its
+    reset instead of failing first, and a Retry-After or secondary rate limit pauses its budget for as long as
+    GitHub asks. Each credential has budgets of its own, a request that any of several credentials could make
+    goes to the one with the most left. Shared by every thread of the run
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.budgets: Dict[Tuple[str, str], Budget] = dict()
+        self.report = False
+        self.last_report = 0.0
+
+    def budget(self, credential: str, resource: str) -> Budget:
+        key = (credential, resource)
+
+        if key not in self.budgets:
+            self.budgets[key] = Budget(resource, credential)
+
+        return self.budgets[key]
+
+    @staticmethod
+    def resource(url: str) -> str:
+        """
+        The budget a request to url counts towards
+        """
+        if "/search/" in url:
+            return "search"
+        if url.rstrip("/").endswith("/graphql"):
+            return "graphql"
+
+        return "core"
+
+    def acquire(self, resource: str, credentials: Sequence[str] = (DEFAULT_CREDENTIAL,)) -> str:
+        """
+        Waits until the budget of one of the credentials allows another request and takes it, returning that
+        credential. The credential that can go soonest is taken, with the most requests left among those
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                budgets = [self.budget(c, resource) for c in credentials]
+                budget = min(budgets, key=lambda b: (b.delay(now), -b.headroom()))
+                wait = budget.delay(now)
+
+                if wait <= 0:
+                    budget.take(now)
+                    return budget.credential
+
+            logger.info(f"GitHub {budget}, waiting {wait:.1f}s")
+            if self.report:
+                typer.echo(f"GitHub {budget.resource} rate limit reached, waiting {wait:.0f}s", err=True)
+
+            metrics.rate_limited(METRICS_APIS[resource], wait)
+            time.sleep(wait)
+
+    def update(
+        self,
+        resource: str,
+        status: int,
+        headers: Mapping[str, str],
+        text: str = "",
+        credential: str = DEFAULT_CREDENTIAL,
+        limited: bool = False,
+    ) -> bool:
+        """
+        Takes in the rate limit state a response to credential reports, returning whether the response was rate
+        limited, the budget then waiting before its next request. limited is for callers that can tell from the
+        body, as with GraphQL's RATE_LIMITED errors
+        """
+        headers = {k.lower(): v for k, v in headers.items()}
+
+        # GitHub names the budget it counted the request against, code search has one of its own
+        reported = headers.get("x-ratelimit-resource", resource)
+        resource = "search" if "search" in reported else reported if reported in METRICS_APIS else resource
+
+        now = time.time()
+
+        with self.lock:
+            budget = self.budget(credential, resource)
+
+            try:
+                budget.update(
+                    int(headers["x-ratelimit-limit"]),
+                    int(headers["x-ratelimit-remaining"]),
+                    float(headers["x-ratelimit-reset"]),
+                )
+            except (KeyError, ValueError):
+                pass
+
+            limited = limited or (status in (403, 429) and "rate limit" in text.lower())
+
+            pause = None
+            if "retry-after" in headers:
+                try:
+                    pause = float(headers["retry-after"])
+                except ValueError:
+                    pause = SECONDARY_LIMIT_PAUSE
+            elif limited and budget.remaining != 0:
+                # a secondary rate limit, the primary one would have run out
+                pause = SECONDARY_LIMIT_PAUSE
+
+            if pause is not None:
+                budget.blocked_until = max(budget.blocked_until, now + pause)
+                logger.warning(f"GitHub asked to pause {resource} requests for {pause:.0f}s")
+
+            # an exhausted primary limit answers 403 (429 for GraphQL), whatever the message
+            limited = pause is not None or (budget.remaining == 0 and (limited or status in (403, 429)))
+
+            report = self.report and now - self.last_report >= REPORT_INTERVAL
+            if report:
+                self.last_report = now
+
+        if report:
+            typer.echo(self.state(), err=True)
+
+        return limited
+
+    def state(self) -> str:
+        with self.lock:
+            return "GitHub rate limits: " + ", ".join(str(b) for _, b in sorted(self.budgets.items()))
+
+
+governor = RateGovernor()
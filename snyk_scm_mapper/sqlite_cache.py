@@ -0,0 +1,447 @@
+import json
+import logging
+import sqlite3
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+from typing import Type
+
+from models.repositories import Branch
+from models.repositories import Project
+from models.repositories import Repo
+from models.tracking import TrackedModel
+from models.tracking import is_current
+from models.tracking import schema_header
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    full_name TEXT NOT NULL,
+    org TEXT NOT NULL,
+    archived INTEGER NOT NULL,
+    import_sha TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS repos_position ON repos (position);
+CREATE INDEX IF NOT EXISTS repos_full_name ON repos (full_name COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS branches (
+    repo_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (repo_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS tags (
+    repo_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (repo_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS repo_projects (
+    repo_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    project_id TEXT NOT NULL,
+    PRIMARY KEY (repo_id, position)
+);
+CREATE INDEX IF NOT EXISTS repo_projects_project_id ON repo_projects (project_id);
+
+CREATE TABLE IF NOT EXISTS orgs (
+    id TEXT PRIMARY KEY,
+    slug TEXT NOT NULL,
+    group_id TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    integrations TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS targets (
+    id TEXT PRIMARY KEY,
+    org_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    repo_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS targets_org_id ON targets (org_id, position);
+CREATE INDEX IF NOT EXISTS targets_name ON targets (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS targets_repo_id ON targets (repo_id);
+
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    org_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    target TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS projects_org_id ON projects (org_id, position);
+CREATE INDEX IF NOT EXISTS projects_target ON projects (target COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS project_tags (
+    project_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (project_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS cache_schema (
+    model TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+"""
+
+REPO_ROWS = "SELECT id, position, data FROM repos"
+
+# the repo rows hold everything but the projects, which are linked through repo_projects instead
+REPO_EXCLUDE = {"projects"}
+
+
+class SqliteCache:
+    """
+    SQLite alternative to data.json and the per-org cache directories. Repos, branches, tags, targets and
+    projects each get an indexed table, so the reimport and tag-diff lookups done by the targets and tags commands
+    are answered from the database instead of parsing every cached record first.
+    Each save runs in a single transaction, a failed sync leaves the previous cache in place.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def is_trusted(self, model: Type[TrackedModel]) -> bool:
+        """
+        Whether the model's rows were written by this version of the mapper, and so can be loaded without validation
+        """
+        row = self.conn.execute(
+            "SELECT version, fingerprint FROM cache_schema WHERE model = ?", (model.__name__,)
+        ).fetchone()
+
+        if row is None:
+            return False
+
+        return is_current({"cache_schema": row[0], "model": model.__name__, "fingerprint": row[1]}, model)
+
+    def mark_current(self, model: Type[TrackedModel]):
+        header = schema_header(model)
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cache_schema (model, version, fingerprint) VALUES (?, ?, ?)",
+            (model.__name__, header["cache_schema"], header["fingerprint"]),
+        )
+
+    def save_repos(self, repos: List[Repo]):
+        """
+        Writes the repos in order and drops any no longer listed. Repos whose row and projects match what's stored
+        only have their position updated, whether or not they were marked changed
+        """
+        with self.conn:
+            stored = {repo_id: (position, data) for repo_id, position, data in self.conn.execute(REPO_ROWS)}
+
+            # rows written for another schema are compared against a fresh serialisation of every repo
+            rewrite = not self.is_trusted(Repo)
+
+            stale = [(repo_id,) for repo_id in stored.keys() - {r.id for r in repos}]
+            self.delete_repos(stale)
+
+            for idx, r in enumerate(repos):
+                if r.id in stored and not r.is_changed() and not rewrite:
+                    if stored[r.id][0] != idx:
+                        self.conn.execute("UPDATE repos SET position = ? WHERE id = ?", (idx, r.id))
+                    continue
+
+                data = r.json(exclude=REPO_EXCLUDE)
+                project_ids = [str(p.id) for p in r.projects]
+
+                if r.id in stored and stored[r.id][1] == data and self.repo_project_ids(r.id) == project_ids:
+                    if stored[r.id][0] != idx:
+                        self.conn.execute("UPDATE repos SET position = ? WHERE id = ?", (idx, r.id))
+                    continue
+
+                self.delete_repos([(r.id,)])
+
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO repos (id, position, full_name, org, archived, import_sha, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (r.id, idx, r.full_name, r.org, int(r.archived), r.import_sha, data),
+                )
+
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO branches (repo_id, position, name, data) VALUES (?, ?, ?, ?)",
+                    (
+                        (r.id, b_idx, b if isinstance(b, str) else ",".join(b.keys()), json.dumps(b))
+                        for b_idx, b in enumerate(r.branches)
+                    ),
+                )
+
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO tags (repo_id, position, key, value) VALUES (?, ?, ?, ?)",
+                    ((r.id, t_idx, t.key, t.value) for t_idx, t in enumerate(r.tags)),
+                )
+
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO repo_projects (repo_id, position, project_id) VALUES (?, ?, ?)",
+                    ((r.id, p_idx, project_id) for p_idx, project_id in enumerate(project_ids)),
+                )
+
+            self.mark_current(Repo)
+
+        for r in repos:
+            r.mark_saved()
+
+    def delete_repos(self, repo_ids: List[Tuple[int]]):
+        for table, column in (
+            ("repos", "id"),
+            ("branches", "repo_id"),
+            ("tags", "repo_id"),
+            ("repo_projects", "repo_id"),
+        ):
+            self.conn.executemany(f"DELETE FROM {table} WHERE {column} = ?", repo_ids)
+
+    def repo_project_ids(self, repo_id: int) -> List[str]:
+        rows = self.conn.execute(
+            "SELECT project_id FROM repo_projects WHERE repo_id = ? ORDER BY position", (repo_id,)
+        )
+
+        return [project_id for (project_id,) in rows]
+
+    def iter_repos(self) -> Iterator[str]:
+        """
+        Yields each cached repo, without its projects, as the JSON Repo.parse_raw takes
+        """
+        for (data,) in self.conn.execute("SELECT data FROM repos ORDER BY position"):
+            yield data
+
+    def save_orgs(self, orgs: Iterable[Any]):
+        """
+        Replaces the cached targets and projects of each of the given orgs (models.organizations.Org),
+        leaving those of any other org untouched. Only records whose content differs from what's stored are written
+        """
+        with self.conn:
+            org_models = None
+            rewrite = False
+
+            for org in orgs:
+                if org_models is None:
+                    # Target lives alongside Org, which can't be imported here without an import cycle
+                    org_models = (type(org), type(org).__fields__["targets"].type_, Project)
+                    rewrite = not all(self.is_trusted(model) for model in org_models)
+
+                # a deferred org whose records were never used has nothing new to write, unless its rows were
+                # written for another schema
+                if org.is_deferred() and not org.is_changed():
+                    if not rewrite:
+                        continue
+                    org.materialise()
+
+                org_id = str(org.id)
+
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO orgs (id, slug, group_id, metadata, integrations) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        org_id,
+                        org.slug,
+                        str(org.group_id),
+                        json.dumps(org.get_metadata()),
+                        json.dumps({k: str(v) for k, v in org.integrations.items()}),
+                    ),
+                )
+
+                for target, idx, data in self.save_records("targets", org_id, org.targets, rewrite):
+                    repo_id = None if target.repo_id is None else str(target.repo_id)
+
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO targets (id, org_id, position, name, repo_id, data) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (str(target.id), org_id, idx, target.name, repo_id, data),
+                    )
+
+                for project, idx, data in self.save_records("projects", org_id, org.projects, rewrite):
+                    project_id = str(project.id)
+
+                    self.conn.execute("DELETE FROM project_tags WHERE project_id = ?", (project_id,))
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO projects (id, org_id, position, target, branch, data) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (project_id, org_id, idx, str(project.target), project.branch, data),
+                    )
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO project_tags (project_id, position, key, value) VALUES (?, ?, ?, ?)",
+                        ((project_id, t_idx, t.key, t.value) for t_idx, t in enumerate(project.tags)),
+                    )
+
+                org.mark_saved()
+
+            for model in org_models or ():
+                self.mark_current(model)
+
+    def save_records(
+        self, table: str, org_id: str, records: List[Any], rewrite: bool = False
+    ) -> Iterator[Tuple[Any, int, str]]:
+        """
+        Drops the org's rows in table (targets or projects) that are no longer listed and brings positions up to
+        date, then yields (record, position, JSON) for each record whose stored row is missing or differs.
+        With rewrite, unchanged records are compared against their stored row too
+        """
+        stored = {
+            record_id: (position, data)
+            for record_id, position, data in self.conn.execute(
+                f"SELECT id, position, data FROM {table} WHERE org_id = ?", (org_id,)
+            )
+        }
+
+        stale = [(record_id,) for record_id in stored.keys() - {str(r.id) for r in records}]
+
+        if table == "projects":
+            self.conn.executemany("DELETE FROM project_tags WHERE project_id = ?", stale)
+        self.conn.executemany(f"DELETE FROM {table} WHERE id = ?", stale)
+
+        for idx, record in enumerate(records):
+            record_id = str(record.id)
+
+            if record_id in stored and not record.is_changed() and not rewrite:
+                data = None
+            else:
+                data = record.json()
+
+            if record_id in stored and (data is None or stored[record_id][1] == data):
+                if stored[record_id][0] != idx:
+                    self.conn.execute(f"UPDATE {table} SET position = ? WHERE id = ?", (idx, record_id))
+            else:
+                yield record, idx, data
+
+            record.mark_saved()
+
+    def iter_org_metadata(self) -> Iterator[Tuple[str, str]]:
+        """
+        Yields (org id, metadata JSON) for each cached org
+        """
+        for org_id, metadata in self.conn.execute("SELECT id, metadata FROM orgs ORDER BY slug").fetchall():
+            yield org_id, metadata
+
+    def get_org_records(self, org_id: str) -> Tuple[str, List[str], List[str]]:
+        """
+        Returns the integrations, targets and projects JSON of a cached org
+        """
+        row = self.conn.execute("SELECT integrations FROM orgs WHERE id = ?", (org_id,)).fetchone()
+        integrations = row[0] if row is not None else "{}"
+
+        targets = self.conn.execute("SELECT data FROM targets WHERE org_id = ? ORDER BY position", (org_id,))
+        projects = self.conn.execute("SELECT data FROM projects WHERE org_id = ? ORDER BY position", (org_id,))
+
+        return integrations, [t for (t,) in targets], [p for (p,) in projects]
+
+    def org_record_counts(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Returns the number of targets and projects of each cached org, by org id
+        """
+        counts = {org_id: (0, 0) for (org_id,) in self.conn.execute("SELECT id FROM orgs")}
+
+        for org_id, count in self.conn.execute("SELECT org_id, COUNT(*) FROM targets GROUP BY org_id"):
+            counts[org_id] = (count, counts.get(org_id, (0, 0))[1])
+
+        for org_id, count in self.conn.execute("SELECT org_id, COUNT(*) FROM projects GROUP BY org_id"):
+            counts[org_id] = (counts.get(org_id, (0, 0))[0], count)
+
+        return counts
+
+    def has_projects(self, repo_id: int) -> bool:
+        row = self.conn.execute("SELECT 1 FROM repo_projects WHERE repo_id = ? LIMIT 1", (repo_id,)).fetchone()
+
+        return row is not None
+
+    def branch_projects(self, repo_id: int, org_id: str, branch: str) -> List[Project]:
+        rows = self.conn.execute(
+            "SELECT p.data FROM repo_projects rp JOIN projects p ON p.id = rp.project_id "
+            "WHERE rp.repo_id = ? AND p.org_id = ? AND p.branch = ? ORDER BY rp.position",
+            (repo_id, org_id, branch),
+        )
+
+        trusted = self.is_trusted(Project)
+
+        return [Project.from_cache(json.loads(data), trusted) for (data,) in rows]
+
+    def get_reimport(self, repo: Repo, default_org: str, snyk_orgs: dict) -> List[Branch]:
+        """
+        Repo.get_reimport, with each branch's projects looked up through the repo_projects index
+        """
+        todo = repo.parse_branches(default_org, snyk_orgs)
+
+        for br in todo:
+            br.projects = self.branch_projects(repo.id, br.org_id, br.name)
+
+        return todo
+
+    def needs_reimport(self, repo: Repo, default_org: str, snyk_orgs: dict) -> bool:
+        if not self.has_projects(repo.id):
+            return True
+
+        todo = repo.parse_branches(default_org, snyk_orgs)
+
+        for br in todo:
+            row = self.conn.execute(
+                "SELECT 1 FROM repo_projects rp JOIN projects p ON p.id = rp.project_id "
+                "WHERE rp.repo_id = ? AND p.org_id = ? AND p.branch = ? LIMIT 1",
+                (repo.id, br.org_id, br.name),
+            ).fetchone()
+
+            if row is None:
+                return True
+
+        return False
+
+    def get_proj_tag_updates(self, default_org: str, snyk_orgs: dict, org_ids: list) -> List[Dict]:
+        """
+        SnykWatchList.get_proj_tag_updates, reading only the repos that have tags and comparing against
+        each project's tags from the project_tags table
+        """
+        needs_tags = list()
+
+        repos = self.conn.execute(
+            "SELECT data FROM repos WHERE id IN (SELECT DISTINCT repo_id FROM tags) ORDER BY position"
+        ).fetchall()
+
+        trusted = self.is_trusted(Repo)
+
+        for (data,) in repos:
+            repo = Repo.from_cache(json.loads(data), trusted)
+
+            for branch in repo.parse_branches(default_org, snyk_orgs):
+                if branch.org_id not in org_ids:
+                    continue
+
+                projects = self.conn.execute(
+                    "SELECT p.id, p.org_id FROM repo_projects rp JOIN projects p ON p.id = rp.project_id "
+                    "WHERE rp.repo_id = ? AND p.org_id = ? AND p.branch = ? ORDER BY rp.position",
+                    (repo.id, branch.org_id, branch.name),
+                ).fetchall()
+
+                for project_id, org_id in projects:
+                    project_tags = [
+                        {"key": k, "value": v}
+                        for k, v in self.conn.execute(
+                            "SELECT key, value FROM project_tags WHERE project_id = ? ORDER BY position", (project_id,)
+                        )
+                    ]
+
+                    missing_tags = [t for t in branch.tags if t not in project_tags]
+
+                    if missing_tags:
+                        needs_tags.append({"org_id": org_id, "project_id": project_id, "tags": missing_tags})
+
+        return needs_tags
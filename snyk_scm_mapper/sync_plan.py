@@ -0,0 +1,340 @@
+import logging
+import math
+import time
+from datetime import datetime as dt
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from api import v1_get_pages
+from github import Github
+from github.GithubException import GithubException
+from models.organizations import Orgs
+from models.sync import Settings
+from models.sync import SnykWatchList
+from snyk.client import SnykClient
+from utils import clone_client
+from utils import get_organization_wrapper
+
+
+logger = logging.getLogger(__name__)
+
+# the page size sync lists GitHub repos, code search results and Snyk targets / projects with
+PAGE_SIZE = 100
+
+# Snyk doesn't publish a rate limit endpoint, this is the documented per token limit of its APIs
+SNYK_REQUESTS_PER_MINUTE = 1620
+
+# used for the time estimates when a latency couldn't be measured
+DEFAULT_LATENCY = 0.5
+
+# how long each GitHub rate limit window lasts
+GITHUB_WINDOWS = {"github": 3600, "github search": 60, "github graphql": 3600}
+
+
+def pages(count: int) -> int:
+    """
+    The requests a paged listing of count items takes, an empty listing still takes one
+    """
+    return max(math.ceil(count / PAGE_SIZE), 1)
+
+
+class Phase:
+    """
+    The requests one phase of a sync is expected to make against one API, and how long they should take
+    """
+
+    def __init__(self, name: str, api: str, requests: int, seconds: float, note: str = ""):
+        self.name = name
+        self.api = api
+        self.requests = requests
+        self.seconds = seconds
+        self.note = note
+
+
+class Headroom:
+    """
+    The requests an API will still accept in its current rate limit window
+    """
+
+    def __init__(self, api: str, remaining: int, limit: int, reset: Optional[dt] = None):
+        self.api = api
+        self.remaining = remaining
+        self.limit = limit
+        self.reset = reset
+
+    def wait(self, requests: int, now: dt) -> float:
+        """
+        Seconds spent waiting for the limit to reset if `requests` are made as fast as possible from `now`
+        """
+        if requests <= self.remaining or self.reset is None or self.limit <= 0:
+            return 0
+
+        windows = math.ceil((requests - self.remaining) / self.limit)
+
+        return max((self.reset - now).total_seconds(), 0) + (windows - 1) * GITHUB_WINDOWS[self.api]
+
+
+class SyncPlan:
+    """
+    What a sync would cost, per phase and per API, measured against the rate limit headroom
+    """
+
+    def __init__(self):
+        self.phases: List[Phase] = list()
+        self.headroom: Dict[str, Headroom] = dict()
+        self.planning_requests: Dict[str, int] = dict()
+        self.latency: Dict[str, float] = dict()
+        self.created = dt.utcnow()
+
+    def add(self, phase: Phase):
+        self.phases.append(phase)
+
+    def spent(self, api: str, requests: int = 1):
+        """
+        Counts a request the planner itself made
+        """
+        self.planning_requests[api] = self.planning_requests.get(api, 0) + requests
+
+    def requests(self, api: str) -> int:
+        return sum(p.requests for p in self.phases if p.api == api)
+
+    def apis(self) -> List[str]:
+        return list(dict.fromkeys(p.api for p in self.phases))
+
+    def seconds(self) -> float:
+        """
+        The phases run one after another, rate limit waits and Snyk's per minute limit come on top of them
+        """
+        total = sum(p.seconds for p in self.phases)
+
+        for api, headroom in self.headroom.items():
+            total += headroom.wait(self.requests(api), self.created)
+
+        # the Snyk phases can't go faster than the rate limit allows, whatever the concurrency
+        snyk_seconds = sum(p.seconds for p in self.phases if p.api == "snyk")
+        total += max(self.requests("snyk") / SNYK_REQUESTS_PER_MINUTE * 60 - snyk_seconds, 0)
+
+        return total
+
+    def __str__(self) -> str:
+        lines = [f"{'Phase':<34}{'API':<16}{'Requests':>10}{'Time':>10}  Notes"]
+
+        for p in self.phases:
+            lines.append(f"{p.name:<34}{p.api:<16}{p.requests:>10}{format_seconds(p.seconds):>10}  {p.note}".rstrip())
+
+        lines.append("")
+        lines.append(f"{'API':<16}{'Requests':>10}{'Remaining':>11}{'Limit':>8}  Headroom")
+
+        for api in self.apis():
+            requests = self.requests(api)
+            headroom = self.headroom.get(api)
+
+            if api == "snyk":
+                minutes = requests / SNYK_REQUESTS_PER_MINUTE
+                lines.append(
+                    f"{api:<16}{requests:>10}{'-':>11}{SNYK_REQUESTS_PER_MINUTE:>8}  "
+                    f"{SNYK_REQUESTS_PER_MINUTE} per minute per token, at least {format_seconds(minutes * 60)}"
+                )
+            elif headroom is None:
+                lines.append(f"{api:<16}{requests:>10}{'?':>11}{'?':>8}  rate limit unknown")
+            else:
+                if requests <= headroom.remaining:
+                    verdict = f"fits, {headroom.remaining - requests} left"
+                else:
+                    wait = format_seconds(headroom.wait(requests, self.created))
+                    verdict = f"short by {requests - headroom.remaining}, waits ~{wait} for the limit to reset"
+                if headroom.reset is not None:
+                    verdict += f" (resets {headroom.reset.strftime('%H:%M:%S')} UTC)"
+                lines.append(f"{api:<16}{requests:>10}{headroom.remaining:>11}{headroom.limit:>8}  {verdict}")
+
+        lines.append("")
+        lines.append(f"Estimated sync time: {format_seconds(self.seconds())}")
+
+        latencies = ", ".join(f"{api} {seconds * 1000:.0f}ms" for api, seconds in self.latency.items())
+        spent = ", ".join(f"{count} {api}" for api, count in self.planning_requests.items())
+        lines.append(f"Measured latency: {latencies or 'none'}. The plan itself made {spent or 'no'} requests")
+
+        return "\n".join(lines)
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f}m"
+
+    return f"{seconds / 3600:.1f}h"
+
+
+def timed(plan: SyncPlan, api: str, func):
+    """
+    Makes a planning request, keeping the slowest latency seen for its API
+    """
+    start = time.perf_counter()
+
+    try:
+        return func()
+    finally:
+        plan.spent(api)
+        plan.latency[api] = max(plan.latency.get(api, 0), time.perf_counter() - start)
+
+
+def plan_github(
+    plan: SyncPlan, settings: Settings, gh: Github, watchlist: SnykWatchList, updated_since: Optional[dt] = None
+):
+    """
+    Adds the GitHub phases: the repo listing (REST or GraphQL), code search for import.yaml files, reading the
+    import.yaml files that changed, and the fork scan. Repo counts come from each org (one request per org, sync
+    makes the same request), import.yaml counts from the cache, or a code search count for orgs not cached yet
+    """
+    orgs = list(settings.github_orgs or list())
+
+    cached_repos: Dict[str, int] = dict()
+    cached_imports: Dict[str, int] = dict()
+
+    for repo in watchlist.repos:
+        owner = repo.source.owner.lower()
+        cached_repos[owner] = cached_repos.get(owner, 0) + 1
+        if repo.import_sha:
+            cached_imports[owner] = cached_imports.get(owner, 0) + 1
+
+    listing_pages = 0
+    imports: Dict[str, int] = dict()
+
+    for gh_org_name in orgs:
+        try:
+            gh_org = timed(plan, "github", lambda: get_organization_wrapper(gh, gh_org_name))
+
+            if gh_org.total_private_repos is None:
+                repo_count = cached_repos.get(gh_org_name.lower(), 0)
+            else:
+                repo_count = int(gh_org.public_repos) + int(gh_org.total_private_repos)
+        except GithubException as e:
+            logger.warning(f"could not count the repos of {gh_org_name}: {e!r}")
+            repo_count = cached_repos.get(gh_org_name.lower(), 0)
+
+        # an incremental listing stops at the first page older than the previous listing
+        listing_pages += 1 if updated_since is not None else pages(repo_count)
+
+        if gh_org_name.lower() in cached_repos:
+            imports[gh_org_name] = cached_imports.get(gh_org_name.lower(), 0)
+        elif not settings.github_graphql:
+            search = f"org:{gh_org_name} path:.snyk.d filename:import language:yaml"
+            imports[gh_org_name] = timed(plan, "github search", lambda: gh.search_code(query=search).totalCount)
+
+    latency = plan.latency.get("github", DEFAULT_LATENCY)
+    workers = min(max(settings.github_workers, 1), max(len(orgs), 1))
+
+    if settings.github_graphql:
+        plan.add(
+            Phase(
+                "List repos",
+                "github graphql",
+                listing_pages,
+                listing_pages * latency / workers,
+                "each page also carries the repos' import.yaml",
+            )
+        )
+        return
+
+    note = "at least, until a page older than the last listing" if updated_since is not None else ""
+    plan.add(Phase("Look up orgs", "github", len(orgs), len(orgs) * latency / workers))
+    plan.add(Phase("List repos", "github", listing_pages, listing_pages * latency / workers, note))
+
+    # a count, then each page of results, one org after another
+    search_requests = sum(1 + math.ceil(count / PAGE_SIZE) for count in imports.values())
+    plan.add(Phase("Search for import.yaml", "github search", search_requests, search_requests * latency))
+
+    import_count = sum(imports.values())
+    plan.add(
+        Phase(
+            "Read import.yaml",
+            "github",
+            import_count,
+            import_count * latency,
+            "at most, only files that changed are read",
+        )
+    )
+
+    if settings.forks:
+        forks = len([r for r in watchlist.repos if r.fork])
+        plan.add(
+            Phase("Scan forks for import.yaml", "github", forks * 2, forks * 2 * latency, f"{forks} cached forks")
+        )
+
+
+def plan_github_headroom(plan: SyncPlan, gh: Github):
+    """
+    Adds the remaining GitHub rate limits, reading them doesn't count against them
+    """
+    try:
+        limits = gh.get_rate_limit()
+    except GithubException as e:
+        logger.warning(f"could not read the GitHub rate limits: {e!r}")
+        return
+
+    for api, limit in (("github", limits.core), ("github search", limits.search), ("github graphql", limits.graphql)):
+        plan.headroom[api] = Headroom(api, limit.remaining, limit.limit, limit.reset)
+
+
+def plan_snyk(plan: SyncPlan, settings: Settings, client: SnykClient, orgs: Orgs):
+    """
+    Adds the Snyk phases: listing each group's orgs (which the planner does for real, to count them) and then
+    each selected org's targets, projects and integrations. Target and project counts come from the cache,
+    orgs that aren't cached are counted as a page of each
+    """
+    selected_orgs = [str(o["orgId"]) for o in settings.snyk_orgs.values()]
+    counts = orgs.cached_record_counts()
+
+    group_pages = 0
+    org_ids: List[str] = list()
+
+    for group in settings.snyk_groups or list():
+        group_client = clone_client(client, group["snyk_token"])
+
+        try:
+            group_orgs = timed(plan, "snyk", lambda: v1_get_pages(f"group/{group['id']}/orgs", group_client, "orgs"))
+        except Exception as e:
+            logger.warning(f"could not list the orgs of group {group['name']}: {e!r}")
+            continue
+
+        group_pages += pages(len(group_orgs["orgs"]))
+        org_ids.extend(o["id"] for o in group_orgs["orgs"] if not selected_orgs or o["id"] in selected_orgs)
+
+    latency = plan.latency.get("snyk", DEFAULT_LATENCY)
+
+    target_pages = [pages(counts.get(o, (0, 0))[0]) for o in org_ids]
+    project_pages = [pages(counts.get(o, (0, 0))[1]) for o in org_ids]
+    uncached = len([o for o in org_ids if o not in counts])
+    workers = max(settings.snyk_workers, 1)
+
+    def listing_seconds(org_pages: List[int]) -> float:
+        # an org's pages are listed one after another, so its largest org bounds the time whatever the workers
+        return max(sum(org_pages) * latency / workers, max(org_pages, default=0) * latency)
+
+    note = f"{uncached} orgs not cached, counted as one page" if uncached else ""
+    plan.add(Phase("List orgs", "snyk", group_pages, group_pages * latency))
+    plan.add(Phase("List targets", "snyk", sum(target_pages), listing_seconds(target_pages), note))
+    plan.add(Phase("List projects", "snyk", sum(project_pages), listing_seconds(project_pages), note))
+    plan.add(Phase("Read integrations", "snyk", len(org_ids), len(org_ids) * latency / workers))
+
+
+def plan_sync(
+    settings: Settings,
+    gh: Github,
+    client: SnykClient,
+    watchlist: SnykWatchList,
+    orgs: Orgs,
+    updated_since: Optional[dt] = None,
+) -> SyncPlan:
+    """
+    Estimates the requests and time a sync would take, without running it
+    """
+    plan = SyncPlan()
+
+    plan_github_headroom(plan, gh)
+    plan_github(plan, settings, gh, watchlist, updated_since)
+    plan_snyk(plan, settings, client, orgs)
+
+    return plan
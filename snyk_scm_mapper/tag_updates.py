@@ -0,0 +1,161 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import typer
+from snyk.client import SnykClient
+from snyk.errors import SnykHTTPError
+
+
+logger = logging.getLogger(__name__)
+
+
+class TagUpdateSummary:
+    """
+    Tallies the outcome of a tag run across every worker
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.updated = 0
+        self.current = 0
+        self.posted = 0
+        self.existing = 0
+        self.reads = 0
+        self.reverified = 0
+        self.failures: List[Dict[str, str]] = list()
+
+    def add(self, posted: int, existing: int):
+        with self.lock:
+            if posted or existing:
+                self.updated += 1
+            else:
+                self.current += 1
+            self.posted += posted
+            self.existing += existing
+
+    def read(self):
+        with self.lock:
+            self.reads += 1
+
+    def reverify(self):
+        with self.lock:
+            self.reverified += 1
+
+    def fail(self, project_path: str, error: str):
+        with self.lock:
+            self.failures.append({"project": project_path, "error": error})
+
+    def __str__(self) -> str:
+        return (
+            f"Tag updates: {self.updated} projects updated ({self.posted} tags added, {self.existing} already "
+            f"existed), {self.current} already up to date, {len(self.failures)} failed. "
+            f"{self.reads} projects read live, {self.reverified} of them re-read after a failed update"
+        )
+
+
+def post_tags(client: SnykClient, p_tag_path: str, tags: List[dict], counts: Dict[str, int]):
+    """
+    Posts each tag, counting those added and those the project already had (a 422).
+    Any other error is raised, with counts holding what was done before it
+    """
+    for tag in tags:
+        try:
+            client.post(p_tag_path, tag)
+            counts["posted"] += 1
+        except SnykHTTPError as e:
+            if e.code == 422:
+                typer.echo(f"Error: Tag for project already exists")
+                counts["existing"] += 1
+            else:
+                logger.error(f"posting tag {tag} to {p_tag_path} failed with {e.code}")
+                raise e
+
+
+def update_project_tags(
+    client: SnykClient, update: dict, group_name: str, summary: TagUpdateSummary, trust_cache: bool = False
+):
+    """
+    Adds the tags of one entry of SnykWatchList.get_proj_tag_updates to its project, skipping any the project
+    already has live. Failures are recorded in the summary rather than raised, so one project can't stop the rest.
+    With trust_cache, the tags the update was worked out from (the cached project's) are taken as the live ones,
+    and the project is only read back if posting them fails
+    """
+    p_path = f"org/{update['org_id']}/project/{update['project_id']}"
+    p_tag_path = f"{p_path}/tags"
+
+    counts = {"posted": 0, "existing": 0}
+
+    if trust_cache:
+        typer.echo(f"Updating {group_name} project {update['project_id']} tags", err=True)
+
+        try:
+            post_tags(client, p_tag_path, update["tags"], counts)
+            summary.add(counts["posted"], counts["existing"])
+            return
+        except SnykHTTPError as e:
+            logger.info(f"re-reading {p_path} after a tag update failed with {e.code}")
+            summary.reverify()
+
+    try:
+        p_live = client.get(p_path).json()
+    except SnykHTTPError as e:
+        typer.echo(f"Error: retrieving project path: {p_path} error:\n{e}")
+        logger.exception(f"issue getting project path error={str(e)}")
+        summary.fail(p_path, f"GET returned {e.code}")
+        return
+
+    summary.read()
+
+    tags_to_post = [t for t in update["tags"] if t not in p_live["tags"]]
+
+    if len(tags_to_post) > 0 and not trust_cache:
+        typer.echo(f"Updating {group_name} project {p_live['name']} tags", err=True)
+
+    try:
+        post_tags(client, p_tag_path, tags_to_post, counts)
+    except SnykHTTPError as e:
+        summary.fail(p_path, f"POST returned {e.code}")
+        return
+
+    summary.add(counts["posted"], counts["existing"])
+
+
+def update_tags(
+    client: SnykClient,
+    updates: List[dict],
+    group_name: str,
+    workers: int = 1,
+    summary: Optional[TagUpdateSummary] = None,
+    trust_cache: bool = False,
+) -> TagUpdateSummary:
+    """
+    Applies a group's tag updates, up to `workers` projects at a time. The client is only read from, so one is
+    shared by every worker. See update_project_tags for trust_cache
+    """
+    summary = summary or TagUpdateSummary()
+
+    for update in updates:
+        # v1 api for tags only accepts strings for tag value
+        # this forces everything to string
+        for t in update["tags"]:
+            for k in t:
+                if type(t[k]) is not str:
+                    t[k] = str(t[k])
+
+    def run(update: dict):
+        try:
+            update_project_tags(client, update, group_name, summary, trust_cache)
+        except Exception as e:
+            # anything else (a connection error, an unexpected response) fails this project only
+            logger.exception(f"updating tags of project {update['project_id']} failed")
+            summary.fail(f"org/{update['org_id']}/project/{update['project_id']}", repr(e))
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for update in updates:
+            executor.submit(run, update)
+
+    return summary
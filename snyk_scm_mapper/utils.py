@@ -1,6 +1,12 @@
+import copy
 import functools
 import json
 import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from datetime import datetime
 from enum import Enum
 from logging import exception
@@ -10,7 +16,10 @@ from pathlib import Path
 from typing import Any
 from typing import Callable
 from typing import Dict
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import Union
 from typing import cast
 
@@ -18,14 +27,28 @@ import backoff
 import requests
 import typer
 import yaml
+from cache_store import RecordStore
 from github import Github
 from github.GithubException import RateLimitExceededException
 from github.Organization import Organization
 from github.PaginatedList import PaginatedList
+from github.Requester import HTTPRequestsConnectionClass
+from github.Requester import HTTPSRequestsConnectionClass
+from github.Requester import Requester
+from github.Requester import RequestsResponse
+from github_pool import CredentialPool
+from github_pool import request_org
+from http_cache import ResponseCache
+from metrics import MeteredSnykClient
+from metrics import metrics
 from models.sync import Repo
 from models.sync import Settings
 from models.sync import SnykWatchList
+from rate_governor import RATE_LIMIT_TRIES
+from rate_governor import governor
 from retry.api import retry_call
+from snyk.client import SnykClient
+from sqlite_cache import SqliteCache
 from typer import Context
 
 
@@ -88,6 +111,64 @@ def jwrite(data, filename, minimize: bool = False):
         return False
 
 
+@log
+def jarray(filename, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Yields the elements of a file holding one JSON array, decoding them one at a time from chunks of the file
+    rather than reading and decoding the whole document at once
+    """
+    decoder = json.JSONDecoder()
+
+    with open(filename, "r") as the_file:
+        buffer = ""
+        pos = 0
+        eof = False
+        opened = False
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+
+            if pos == len(buffer):
+                if eof:
+                    raise ValueError(f"{filename} ended before its JSON array was closed")
+                buffer = the_file.read(chunk_size)
+                pos = 0
+                eof = not buffer
+                continue
+
+            if not opened:
+                if buffer[pos] != "[":
+                    raise ValueError(f"{filename} does not hold a JSON array")
+                opened = True
+                pos += 1
+                continue
+
+            if buffer[pos] == "]":
+                return
+
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise e
+                end = None
+
+            # an element is only complete once a separator follows it, as the start of a cut number ("1" of "1.5")
+            # still decodes
+            if end is None or end == len(buffer) or buffer[end] not in " \t\r\n,]":
+                if eof:
+                    raise ValueError(f"{filename} holds an invalid or truncated JSON array")
+                chunk = the_file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+
+            yield element
+            pos = end
+
+
 @log
 def yopen(filename):
     with open(filename, "r") as the_file:
@@ -301,30 +382,77 @@ def ensure_dir(directory: Path) -> bool:
 
 
 @log
-def load_watchlist(cache_dir: Path) -> SnykWatchList:
+def load_watchlist(cache_dir: Path, backend: str = "json", fmt: str = "json") -> SnykWatchList:
     tmp_watchlist = SnykWatchList()
     cache_data_errors = []
 
-    # such data paths should be set as script-wide variables in the future
-    # as these are accessed in various places
-    data_json_path = f"{cache_dir}/data.json"
+    if backend == "sqlite":
+        db_path = f"{cache_dir}/cache.db"
 
-    try:
-        cache_data = jopen(data_json_path)
-    except Exception as e:
-        print(f"WARNING: could not load cache data from file {data_json_path}: {repr(e)}")
-        return tmp_watchlist
-
-    for repo in cache_data:
         try:
-            tmp_watchlist.repos.append(Repo.parse_obj(repo))
+            if not path.isfile(db_path):
+                raise FileNotFoundError(db_path)
+
+            store = SqliteCache(db_path)
+            trusted = store.is_trusted(Repo)
+            cache_data = store.iter_repos()
         except Exception as e:
-            logger.exception(f"error loading watchlist, error={str(e)}")
-            logger.exception(f"Error {repr(e)} attempting to parse import.yaml in repo {repo['url']}")
-            cache_data_error_string = f"Error {repr(e)} attempting to parse import.yaml in repo {repo['url']}"
+            print(f"WARNING: could not load cache data from database {db_path}: {repr(e)}")
+            return tmp_watchlist
+
+        tmp_watchlist._store = store
+        from_store = True
+    else:
+        # such data paths should be set as script-wide variables in the future
+        # as these are accessed in various places
+        data_store = RecordStore.find(str(cache_dir), "data", Repo, fmt)
+        data_json_path = f"{cache_dir}/data.json"
+
+        # records are read and parsed one at a time, the record store written by SnykWatchList.save (in whichever
+        # format it was last saved in) is preferred over the single array data.json of older versions
+        if path.isfile(data_store.data_file):
+            trusted = data_store.is_trusted()
+            cache_data = data_store.read()
+            from_store = True
+        elif path.isfile(data_json_path):
+            trusted = False
+            cache_data = jarray(data_json_path)
+            from_store = False
+        else:
+            print(f"WARNING: could not load cache data from file {data_store.data_file}: file not found")
+            return tmp_watchlist
+
+    cached_repos: List[Repo] = list()
+
+    try:
+        for repo in cache_data:
+            try:
+                # the sqlite cache holds each repo as JSON text, the legacy data.json array is decoded as it's
+                # read and will be rewritten in full on the next save
+                if isinstance(repo, str):
+                    repo = json.loads(repo)
+
+                # only records from a cache written for the current schema skip validation
+                cached_repo = Repo.from_cache(repo, from_store and trusted)
 
-            # print(f"{cache_data_error_string}")
-            cache_data_errors.append(cache_data_error_string)
+                if from_store:
+                    cached_repo.mark_saved()
+
+                cached_repos.append(cached_repo)
+            except Exception as e:
+                repo_url = repo.get("url") if isinstance(repo, dict) else "<unreadable record>"
+                logger.exception(f"error loading watchlist, error={str(e)}")
+                logger.exception(f"Error {repr(e)} attempting to parse import.yaml in repo {repo_url}")
+                cache_data_error_string = f"Error {repr(e)} attempting to parse import.yaml in repo {repo_url}"
+
+                # print(f"{cache_data_error_string}")
+                cache_data_errors.append(cache_data_error_string)
+    except Exception as e:
+        print(f"WARNING: could not load cache data from {cache_dir}: {repr(e)}")
+        return SnykWatchList()
+
+    # assigned in one go, which drops any repo index the watchlist built while loading
+    tmp_watchlist.repos = cached_repos
 
     if cache_data_errors:
         print(f"{len(cache_data_errors)} errors when loading cache, please see log for details")
@@ -334,6 +462,20 @@ def load_watchlist(cache_dir: Path) -> SnykWatchList:
     return tmp_watchlist
 
 
+@log
+def load_sync_state(cache_dir: Path) -> dict:
+    sync_json_path = f"{cache_dir}/sync.json"
+
+    if not path.exists(sync_json_path):
+        return dict()
+
+    try:
+        return jopen(sync_json_path)
+    except Exception as e:
+        logger.warning(f"could not load sync state from {sync_json_path}: {repr(e)}")
+        return dict()
+
+
 @log
 def update_client(old_client, token):
     old_client.api_token = token
@@ -343,15 +485,37 @@ def update_client(old_client, token):
     return old_client
 
 
+@log
+def clone_client(template: SnykClient, token) -> SnykClient:
+    """
+    A new client with the template's settings but its own token, for when clients are used from several threads
+    and update_client can't be used to swap tokens in place
+    """
+    return MeteredSnykClient(
+        str(token),
+        url=template.api_url,
+        rest_api_url=template.rest_api_url,
+        user_agent=template.api_headers.get("User-Agent"),
+        tries=template.tries,
+        delay=template.delay,
+        backoff=template.backoff,
+        verify=template.verify,
+        version=template.version,
+    )
+
+
 @log
 def filter_chunk(chunk, exclude_list):
     return [y for y in chunk if y.repository.id not in exclude_list and y.name == "import.yaml"]
 
 
 # Function wrappers for GitHub API calls. Here we simply wrap the original call in a function which is decorated with
-# a "backoff". This will catch rate limit exceptions and automatically retry the function.
+# a "backoff". This will catch rate limit exceptions and retry the function, the rate governor having already taken
+# note of when the limit resets (or how long GitHub asked to pause), so the retry itself waits exactly that long.
 @log
-@backoff.on_exception(backoff.expo, RateLimitExceededException)
+@backoff.on_exception(
+    backoff.constant, RateLimitExceededException, interval=0, jitter=None, max_tries=RATE_LIMIT_TRIES
+)
 def get_page_wrapper(pg_list: PaginatedList, page_number: int, show_rate_limit: bool = False):
     try:
         return pg_list.get_page(page_number)
@@ -362,7 +526,9 @@ def get_page_wrapper(pg_list: PaginatedList, page_number: int, show_rate_limit:
 
 
 @log
-@backoff.on_exception(backoff.expo, RateLimitExceededException)
+@backoff.on_exception(
+    backoff.constant, RateLimitExceededException, interval=0, jitter=None, max_tries=RATE_LIMIT_TRIES
+)
 def get_organization_wrapper(gh: Github, gh_org_name: str, show_rate_limit: bool = False):
     try:
         return gh.get_organization(gh_org_name)
@@ -373,7 +539,9 @@ def get_organization_wrapper(gh: Github, gh_org_name: str, show_rate_limit: bool
 
 
 @log
-@backoff.on_exception(backoff.expo, RateLimitExceededException)
+@backoff.on_exception(
+    backoff.constant, RateLimitExceededException, interval=0, jitter=None, max_tries=RATE_LIMIT_TRIES
+)
 def get_repo_count_wrapper(gh: Github, repos, show_rate_limit: bool = False):
     try:
         return repos.totalCount
@@ -384,7 +552,9 @@ def get_repo_count_wrapper(gh: Github, repos, show_rate_limit: bool = False):
 
 
 @log
-@backoff.on_exception(backoff.expo, RateLimitExceededException)
+@backoff.on_exception(
+    backoff.constant, RateLimitExceededException, interval=0, jitter=None, max_tries=RATE_LIMIT_TRIES
+)
 def get_repos_wrapper(gh_org: Organization, type: str, sort: str, direction: str, show_rate_limit: bool = False):
     try:
         return gh_org.get_repos(type=type, sort=sort, direction=direction)
@@ -392,3 +562,253 @@ def get_repos_wrapper(gh_org: Organization, type: str, sort: str, direction: str
         if not show_rate_limit:
             typer.echo("GitHub rate limit was hit.. backing off...")
         raise e
+
+
+@log
+def get_organizations(
+    clients: "GithubClients", gh_org_names: List[str], workers: int = 1, show_rate_limit: bool = False
+):
+    """
+    Retrieves every GitHub org in gh_org_names concurrently, each worker through its own client, returned in the
+    same order as the names
+    """
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return list(
+            executor.map(lambda name: get_organization_wrapper(clients.get(), name, show_rate_limit), gh_org_names)
+        )
+
+
+@log
+def get_repo_count_estimate(gh: Github, gh_org: Organization, gh_repos: PaginatedList, show_rate_limit: bool = False):
+    """
+    The org object already carries its public and private repo counts, so we only fall back to the
+    (extra request) totalCount of the listing when the token can't see the private count
+    """
+    if gh_org.total_private_repos is None:
+        return get_repo_count_wrapper(gh, gh_repos, show_rate_limit)
+
+    return int(gh_org.public_repos) + int(gh_org.total_private_repos)
+
+
+@log
+def iter_repo_pages(
+    clients: "GithubClients",
+    gh_repos: Dict[str, PaginatedList],
+    pages: Dict[str, int],
+    per_page: int,
+    workers: int = 1,
+    show_rate_limit: bool = False,
+    updated_since: Optional[datetime] = None,
+) -> Iterator[Tuple[str, list, int]]:
+    """
+    Fetches the pages of every org's repo listing through a bounded pool of workers, each on its own client, and
+    yields (org name, page of repos, pages queued so far) as each page arrives, so the caller consumes them on one
+    thread.
+
+    The page counts are estimates, so whenever the last queued page of an org comes back full the next page
+    is queued as well, until a short page marks the end of the listing. With updated_since, listings sorted
+    by most recently updated also stop at the first page that reaches repos older than it.
+    """
+    last_page: Dict[str, int] = dict()
+    queued = 0
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        running: Dict[Future, Tuple[str, int]] = dict()
+
+        def fetch_page(pg_list: PaginatedList, page_number: int):
+            return get_page_wrapper(clients.listing(pg_list), page_number, show_rate_limit)
+
+        def queue_page(gh_org_name: str, page_number: int):
+            future = executor.submit(fetch_page, gh_repos[gh_org_name], page_number)
+            running[future] = (gh_org_name, page_number)
+            last_page[gh_org_name] = page_number
+
+        for gh_org_name in gh_repos:
+            for page_number in range(0, max(pages.get(gh_org_name, 1), 1)):
+                queue_page(gh_org_name, page_number)
+                queued += 1
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                gh_org_name, page_number = running.pop(future)
+                page = future.result()
+
+                more = len(page) == per_page and page_number == last_page[gh_org_name]
+
+                if more and updated_since is not None and page[-1].updated_at < updated_since:
+                    logger.debug(f"page {page_number} of {gh_org_name} reached repos older than {updated_since}")
+                    more = False
+
+                if more:
+                    logger.debug(f"page {page_number} of {gh_org_name} was full, queueing the next page")
+                    queue_page(gh_org_name, page_number + 1)
+                    queued += 1
+
+                yield gh_org_name, page, queued
+
+
+class SharedSessionConnection:
+    """
+    The connection a Github client made by make_github_client stages its requests on. Every connection to a host
+    shares one requests session (and its connection pool), so clients made for each thread are cheap to make.
+
+    When a response cache is set, GET requests are made conditional on the stored ETag / Last-Modified. When a
+    credential pool is set, each request made with the client's token goes out with whichever credential serving
+    its org has the most rate limit left. Both are set on a subclass made for each client.
+    """
+
+    _sessions: Dict[Tuple[str, str, int], requests.Session] = dict()
+    _sessions_lock = threading.Lock()
+
+    response_cache: Optional[ResponseCache] = None
+    credential_pool: Optional[CredentialPool] = None
+
+    def share_session(self):
+        key = (self.protocol, self.host, self.port)  # type: ignore
+
+        with self._sessions_lock:
+            self.session = self._sessions.setdefault(key, self.session)  # type: ignore
+
+    def getresponse(self) -> RequestsResponse:
+        pool = self.credential_pool
+        resource = governor.resource(self.url)  # type: ignore
+
+        # cached under the client's own token, whichever credential the request goes out with
+        cache_headers = dict(self.headers)  # type: ignore
+
+        # only the client's own token is swapped, a GitHub App's JWT requests go out as they are
+        if pool is not None and cache_headers.get("Authorization") == pool.default_authorization:
+            credential = governor.acquire(resource, pool.serving(request_org(self.url)))  # type: ignore
+            self.headers = {**cache_headers, "Authorization": pool.authorization(credential)}
+        elif pool is not None:
+            # a GitHub App's own requests count against the app, not any token
+            credential = governor.acquire(resource, ["app"])
+        else:
+            credential = governor.acquire(resource)
+
+        metrics.request("github_search" if resource == "search" else "github")
+
+        resp = self.cached_getresponse(cache_headers)
+        governor.update(resource, resp.status, resp.headers, resp.text, credential)
+
+        return resp
+
+    def cached_getresponse(self, cache_headers: Dict[str, str]) -> RequestsResponse:
+        cache = self.response_cache
+
+        if cache is None or self.verb != "GET":  # type: ignore
+            return super().getresponse()  # type: ignore
+
+        url = f"{self.protocol}://{self.host}:{self.port}{self.url}"  # type: ignore
+        headers = dict(self.headers)  # type: ignore
+
+        entry = cache.get(url, cache_headers)
+
+        if entry is not None:
+            headers.update(cache.conditional_headers(entry))
+
+        r = self.session.get(  # type: ignore
+            url,
+            headers=headers,
+            data=self.input,  # type: ignore
+            timeout=self.timeout,  # type: ignore
+            verify=self.verify,  # type: ignore
+            allow_redirects=False,
+        )
+
+        if entry is not None and r.status_code == 304:
+            r = cache.revalidated(r, entry)
+        elif r.status_code == 200:
+            cache.store(url, cache_headers, r)
+
+        return RequestsResponse(r)
+
+
+class SharedHTTPConnection(SharedSessionConnection, HTTPRequestsConnectionClass):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.share_session()
+
+
+class SharedHTTPSConnection(SharedSessionConnection, HTTPSRequestsConnectionClass):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.share_session()
+
+
+def requester_of(gh: Github) -> Requester:
+    return getattr(gh, "_Github__requester")
+
+
+@log
+def make_github_client(
+    token: str,
+    per_page: int = 100,
+    pool_size: int = 1,
+    base_url: str = "https://api.github.com",
+    response_cache: Optional[ResponseCache] = None,
+    credential_pool: Optional[CredentialPool] = None,
+) -> Github:
+    """
+    Makes a Github client on the shared session. PyGithub stages each request on its client's one connection,
+    so a client must not be used from more than one thread at a time, see GithubClients
+    """
+    client_state = {"response_cache": response_cache, "credential_pool": credential_pool}
+
+    gh = Github(token, base_url=base_url, per_page=per_page, pool_size=max(pool_size, 1))
+
+    # the requester makes its connection from this class on first use and keeps it for every later request
+    if base_url.startswith("https://"):
+        connection_class = type("SharedHTTPSConnection", (SharedHTTPSConnection,), client_state)
+    else:
+        connection_class = type("SharedHTTPConnection", (SharedHTTPConnection,), client_state)
+
+    setattr(requester_of(gh), "_Requester__connectionClass", connection_class)
+
+    return gh
+
+
+class GithubClients:
+    """
+    Hands each thread its own Github client, all made with the same token, response cache and credential pool and
+    sharing the session of each host
+    """
+
+    def __init__(
+        self,
+        token: str,
+        per_page: int = 100,
+        pool_size: int = 1,
+        base_url: str = "https://api.github.com",
+        response_cache: Optional[ResponseCache] = None,
+        credential_pool: Optional[CredentialPool] = None,
+    ):
+        self.client_args: Dict[str, Any] = {
+            "per_page": per_page,
+            "pool_size": pool_size,
+            "base_url": base_url,
+            "response_cache": response_cache,
+            "credential_pool": credential_pool,
+        }
+        self.token = token
+        self._local = threading.local()
+
+    def get(self) -> Github:
+        gh = getattr(self._local, "gh", None)
+
+        if gh is None:
+            gh = make_github_client(self.token, **self.client_args)
+            self._local.gh = gh
+
+        return gh
+
+    def listing(self, pg_list: PaginatedList) -> PaginatedList:
+        """
+        The same listing, with its pages requested through this thread's client
+        """
+        listing = copy.copy(pg_list)
+        setattr(listing, "_PaginatedList__requester", requester_of(self.get()))
+
+        return listing
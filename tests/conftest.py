@@ -0,0 +1,103 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+import yaml
+
+
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "snyk_scm_mapper", "cli.py")
+
+# the mapper only takes a UUID as the Snyk token, this one is outside the range of the fakes' synthetic ids
+SNYK_TOKEN = "ffffffff-ffff-4fff-bfff-ffffffffffff"
+
+# the mapper's modules import each other by their bare names, as they do when run with python cli.py
+sys.path.insert(0, os.path.dirname(CLI))
+
+from fakes import Estate  # noqa: E402
+from fakes import FakeGitHub  # noqa: E402
+from fakes import FakeSnyk  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_governor():
+    """
+    Each test starts without the rate limits earlier tests left behind in the shared governor
+    """
+    from rate_governor import governor
+
+    governor.budgets.clear()
+    yield
+    governor.budgets.clear()
+
+
+@pytest.fixture
+def estate() -> Estate:
+    """
+    A small estate: 10 repos over 2 GitHub orgs, half with an import.yaml, mapped to 3 Snyk orgs
+    """
+    return Estate(github_orgs=2, snyk_orgs=3, repos=10, projects=30, imports=0.5)
+
+
+@pytest.fixture
+def github(estate):
+    server = FakeGitHub(estate).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def snyk(estate):
+    server = FakeSnyk(estate).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class Mapper:
+    """
+    Runs the mapper's CLI in a process of its own, as the cache and settings it keeps in module globals would carry
+    over between runs otherwise, against the fake APIs with its config and cache in workdir
+    """
+
+    def __init__(self, workdir: Path, estate: Estate, github: FakeGitHub, snyk: FakeSnyk):
+        self.workdir = workdir
+        self.cache_dir = workdir / "cache"
+        self.github = github
+        self.snyk = snyk
+
+        conf = {
+            "schema": 2,
+            "github_orgs": estate.github_orgs,
+            "github_token_env_name": "GITHUB_TOKEN",
+            "snyk": {"groups": [{"name": "test", "id": estate.group_id, "token_env_name": "SNYK_TOKEN"}]},
+            "default": {"orgName": estate.snyk_org_slug(0), "integrationName": "github-enterprise"},
+            "forks": True,
+        }
+
+        with open(workdir / "snyk-sync.yaml", "w") as the_file:
+            yaml.safe_dump(conf, the_file)
+
+        with open(workdir / "snyk-orgs.yaml", "w") as the_file:
+            yaml.safe_dump(estate.orgs_file(), the_file)
+
+        self.cache_dir.mkdir()
+
+    def run(self, *args: str, options: tuple = ()) -> subprocess.CompletedProcess:
+        """
+        Runs a command, options going before it (--cache-backend sqlite, say)
+        """
+        base_args = ["--conf", str(self.workdir / "snyk-sync.yaml"), "--github-url", self.github.url]
+        base_args += ["--snyk-url", self.snyk.url, *options]
+        env = {**os.environ, "GITHUB_TOKEN": "test-github-token", "SNYK_TOKEN": SNYK_TOKEN}
+
+        return subprocess.run(
+            [sys.executable, CLI, *base_args, *args], cwd=self.workdir, env=env, capture_output=True, text=True
+        )
+
+
+@pytest.fixture
+def mapper(tmp_path, estate, github, snyk) -> Mapper:
+    return Mapper(tmp_path, estate, github, snyk)
@@ -0,0 +1,642 @@
+"""
+Local stand-ins for the GitHub REST, code search and GraphQL APIs and the Snyk v1 / REST APIs, serving a synthetic
+estate. Used by the tests and benchmarks/e2e.py, they can also be started on their own to point the mapper at:
+
+    python tests/fakes.py --repos 2000 --projects 24000
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+
+PAGE_SIZE = 100
+
+# kinds of synthetic id, kept in bits the uuid version and variant don't overwrite
+ORG, TARGET, PROJECT, GROUP, INTEGRATION = range(5)
+
+
+def make_id(kind: int, i: int = 0, j: int = 0) -> str:
+    return str(uuid.UUID(int=(kind << 56) | (i << 24) | j, version=4))
+
+
+def spread(i: int, ratio: float, salt: int) -> bool:
+    """
+    Whether item i is among the `ratio` of items picked for salt, spread evenly but not in runs
+    """
+    return ((i * 2654435761 + salt * 40503) % 10000) < ratio * 10000
+
+
+class Estate:
+    """
+    A synthetic GitHub / Snyk estate, generated on demand from its sizes so any size can be served.
+    Repo i belongs to GitHub org i % github_orgs and is mapped (through a topic, and its import.yaml if it has one)
+    to Snyk org i % snyk_orgs, where its target and projects live unless it hasn't been imported yet
+    """
+
+    def __init__(
+        self,
+        github_orgs: int = 10,
+        snyk_orgs: int = 50,
+        repos: int = 25000,
+        projects: int = 300000,
+        forks: float = 0.02,
+        imports: float = 0.2,
+        unimported: float = 0.05,
+        tagged: float = 0.5,
+        updated_at: str = "2022-06-01T12:00:00Z",
+    ):
+        self.github_orgs = [f"github-org-{g}" for g in range(max(github_orgs, 1))]
+        self.snyk_org_count = max(snyk_orgs, 1)
+        self.repo_count = repos
+        self.project_count = projects
+        self.forks = forks
+        self.imports = imports
+        self.unimported = unimported
+        self.tagged = tagged
+        self.updated_at = updated_at
+        self.updates: Dict[int, str] = dict()
+        self.group_id = make_id(GROUP)
+
+        self._org_indexes = {make_id(ORG, o): o for o in range(self.snyk_org_count)}
+        self._org_projects: Dict[int, List[Tuple[int, int]]] = dict()
+        self._lock = threading.Lock()
+
+    # GitHub
+
+    def github_org_repos(self, org: str) -> range:
+        return range(self.github_orgs.index(org), self.repo_count, len(self.github_orgs))
+
+    def repo_index(self, full_name: str) -> Optional[int]:
+        match = re.fullmatch(r"github-org-\d+/repo-(\d+)", full_name)
+
+        if match is None or int(match.group(1)) >= self.repo_count:
+            return None
+
+        return int(match.group(1))
+
+    def touch(self, i: int, updated_at: str):
+        """
+        Marks repo i as updated at updated_at. Listings stay in repo order, so only the first repos of an org
+        should be touched for them to stay sorted by most recently updated
+        """
+        self.updates[i] = updated_at
+
+    def is_fork(self, i: int) -> bool:
+        return spread(i, self.forks, 1)
+
+    def has_import(self, i: int) -> bool:
+        return spread(i, self.imports, 2)
+
+    def is_imported(self, i: int) -> bool:
+        return not spread(i, self.unimported, 3)
+
+    def full_name(self, i: int) -> str:
+        return f"{self.github_orgs[i % len(self.github_orgs)]}/repo-{i}"
+
+    def repo(self, i: int, base_url: str) -> dict:
+        owner, name = self.full_name(i).split("/")
+
+        return {
+            "id": i + 1,
+            "name": name,
+            "full_name": f"{owner}/{name}",
+            "owner": {"login": owner, "type": "Organization"},
+            "private": True,
+            "fork": self.is_fork(i),
+            "archived": False,
+            "visibility": "private",
+            "default_branch": "main",
+            "topics": ["service", f"snyk-org-{self.snyk_org(i)}"],
+            "html_url": f"https://github.example.com/{owner}/{name}",
+            "clone_url": f"https://github.example.com/{owner}/{name}.git",
+            "url": f"{base_url}/repos/{owner}/{name}",
+            "updated_at": self.updates.get(i, self.updated_at),
+            "pushed_at": self.updates.get(i, self.updated_at),
+        }
+
+    def import_yaml(self, i: int) -> str:
+        return f"orgName: {self.snyk_org_slug(self.snyk_org(i))}\ntags:\n  team: team-{i % 25}\n  tier: '{i % 3}'\n"
+
+    def import_tags(self, i: int) -> List[dict]:
+        return [{"key": "team", "value": f"team-{i % 25}"}, {"key": "tier", "value": str(i % 3)}]
+
+    def search_results(self, org: str) -> List[int]:
+        # GitHub doesn't index forks for code search, the mapper scans those itself
+        return [i for i in self.github_org_repos(org) if self.has_import(i) and not self.is_fork(i)]
+
+    # Snyk
+
+    def snyk_org(self, i: int) -> int:
+        return i % self.snyk_org_count
+
+    def snyk_org_slug(self, o: int) -> str:
+        return f"snyk-org-{o}"
+
+    def snyk_org_index(self, org_id: str) -> Optional[int]:
+        return self._org_indexes.get(org_id)
+
+    def snyk_orgs(self) -> List[dict]:
+        return [
+            {"id": make_id(ORG, o), "name": f"Snyk Org {o}", "slug": self.snyk_org_slug(o)}
+            for o in range(self.snyk_org_count)
+        ]
+
+    def orgs_file(self) -> dict:
+        """
+        The snyk-orgs.yaml mapping each org's topic to it
+        """
+        return {
+            self.snyk_org_slug(o): {
+                "orgId": make_id(ORG, o),
+                "integrations": {"github-enterprise": make_id(INTEGRATION, o)},
+                "topics": [f"snyk-org-{o}"],
+            }
+            for o in range(self.snyk_org_count)
+        }
+
+    def projects_of(self, i: int) -> int:
+        count, extra = divmod(self.project_count, max(self.repo_count, 1))
+
+        return count + (1 if i < extra else 0)
+
+    def org_targets(self, o: int) -> List[int]:
+        return [i for i in range(o, self.repo_count, self.snyk_org_count) if self.is_imported(i)]
+
+    def org_projects(self, o: int) -> List[Tuple[int, int]]:
+        with self._lock:
+            if o not in self._org_projects:
+                self._org_projects[o] = [(i, j) for i in self.org_targets(o) for j in range(self.projects_of(i))]
+
+            return self._org_projects[o]
+
+    def target(self, i: int) -> dict:
+        return {
+            "id": make_id(TARGET, i),
+            "type": "target",
+            "attributes": {
+                "displayName": self.full_name(i),
+                "origin": "github-enterprise",
+                "remoteUrl": f"https://github.example.com/{self.full_name(i)}",
+                "isPrivate": True,
+            },
+        }
+
+    def project_tags(self, i: int, j: int) -> List[dict]:
+        # projects of repos with an import.yaml that were already tagged by a previous run
+        if self.has_import(i) and spread(i * 131 + j, self.tagged, 4):
+            return self.import_tags(i)
+
+        return list()
+
+    def project(self, i: int, j: int) -> dict:
+        return {
+            "id": make_id(PROJECT, i, j),
+            "type": "project",
+            "attributes": {
+                "name": f"{self.full_name(i)}:services/svc-{j}/package.json",
+                "tags": self.project_tags(i, j),
+                "targetReference": "main",
+                "type": "npm",
+                "status": "active",
+                "origin": "github-enterprise",
+            },
+            "relationships": {"target": {"data": {"id": make_id(TARGET, i), "type": "target"}}},
+        }
+
+    def project_index(self, project_id: str) -> Optional[Tuple[int, int]]:
+        value = uuid.UUID(project_id).int
+
+        if (value >> 56) & 0x7 != PROJECT:
+            return None
+
+        return (value >> 24) & 0xFFFFFFFF, value & 0xFFFFFF
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """
+    Routes requests to the server's do_<verb> methods, counting each and adding the configured latency
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def handle_verb(self, verb: str):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        url = urlparse(self.path)
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        code, payload, headers = self.server.route(
+            verb, re.sub("/+", "/", url.path), parse_qs(url.query), body, dict(self.headers)
+        )
+        self.server.count(verb, url.path)
+
+        data = json.dumps(payload).encode("utf-8")
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+
+        if code == 200 and verb == "GET" and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if verb == "GET":
+            self.send_header("ETag", etag)
+        for key, value in (headers or dict()).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.handle_verb("GET")
+
+    def do_POST(self):
+        self.handle_verb("POST")
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # the request kinds counted, checked in order against the request path
+    kinds: List[Tuple[str, str]] = list()
+
+    def __init__(self, estate: Estate, latency: float = 0):
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.estate = estate
+        self.latency = latency
+        self.counts: Dict[str, int] = dict()
+        self.counts_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self) -> "FakeServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def count(self, verb: str, path: str):
+        kind = next((k for k, pattern in self.kinds if re.search(pattern, path)), "other")
+
+        with self.counts_lock:
+            self.counts[f"{verb} {kind}"] = self.counts.get(f"{verb} {kind}", 0) + 1
+
+    def take_counts(self) -> Dict[str, int]:
+        """
+        The requests counted since the last call
+        """
+        with self.counts_lock:
+            counts, self.counts = self.counts, dict()
+
+        return counts
+
+    def route(
+        self, verb: str, path: str, query: Dict[str, List[str]], body: bytes, headers: Dict[str, str]
+    ) -> Tuple[int, object, dict]:
+        raise NotImplementedError
+
+
+def page_of(items: list, query: Dict[str, List[str]]) -> list:
+    page = int(query.get("page", ["1"])[0])
+    per_page = int(query.get("per_page", ["30"])[0])
+
+    return items[(page - 1) * per_page : page * per_page]
+
+
+class FakeGitHub(FakeServer):
+    """
+    The GitHub REST endpoints sync uses: org lookups, repo listings, code search, contents and the rate limit, and
+    the GraphQL repositories query of github_graphql. Like GitHub, each token has its own budgets, every response carries the X-RateLimit headers of its budget, and
+    a request over the budget gets a 403 until the budget's window resets
+    """
+
+    kinds = [
+        ("search", r"^/search/"),
+        ("contents", r"/contents/"),
+        ("rate_limit", r"^/rate_limit"),
+        ("graphql", r"^/graphql"),
+        ("repos", r"^/orgs/[^/]+/repos"),
+        ("org", r"^/orgs/"),
+        ("repo", r"^/repos/"),
+    ]
+
+    def __init__(self, estate: Estate, latency: float = 0, core_limit: int = 5000, core_window: float = 3600):
+        super().__init__(estate, latency)
+        self.limits = {"core": (core_limit, core_window), "search": (30, 60), "graphql": (5000, 3600)}
+        self.budgets: Dict[Tuple[str, str], Tuple[int, float]] = dict()
+        self.budgets_lock = threading.Lock()
+
+    def take(self, token: str, resource: str) -> Tuple[bool, Dict[str, str]]:
+        """
+        Counts a request against its budget, returning whether it fits and the rate limit headers to send
+        """
+        limit, window = self.limits[resource]
+
+        with self.budgets_lock:
+            remaining, reset = self.budgets.get((token, resource), (limit, 0))
+            if reset <= time.time():
+                remaining, reset = limit, math.ceil(time.time() + window)
+            allowed = remaining > 0
+            remaining = max(remaining - 1, 0)
+            self.budgets[(token, resource)] = (remaining, reset)
+
+        headers = {
+            "X-RateLimit-Limit": str(limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(reset),
+            "X-RateLimit-Resource": resource,
+        }
+
+        return allowed, headers
+
+    def route(self, verb, path, query, body, headers):
+        # every token has its own budgets
+        token = headers.get("Authorization", "")
+
+        if path == "/rate_limit":
+            resources = dict()
+            for resource, (limit, window) in self.limits.items():
+                remaining, reset = self.budgets.get((token, resource), (limit, math.ceil(time.time() + window)))
+                resources[resource] = {
+                    "limit": limit,
+                    "remaining": remaining,
+                    "reset": reset,
+                    "used": limit - remaining,
+                }
+            return 200, {"resources": resources, "rate": resources["core"]}, None
+
+        if path == "/graphql":
+            allowed, limit_headers = self.take(token, "graphql")
+
+            # GraphQL reports its limit in the body
+            if not allowed:
+                error = {"type": "RATE_LIMITED", "message": "API rate limit exceeded for user ID 1."}
+                return 200, {"errors": [error]}, limit_headers
+
+            return 200, self.graphql(json.loads(body or b"{}")), limit_headers
+
+        allowed, limit_headers = self.take(token, "search" if path.startswith("/search/") else "core")
+
+        if not allowed:
+            return 403, {"message": "API rate limit exceeded for user ID 1."}, limit_headers
+
+        code, payload, _ = self.serve(path, query)
+
+        return code, payload, limit_headers
+
+    def serve(self, path, query):
+        estate = self.estate
+
+        match = re.fullmatch(r"/orgs/([^/]+)", path)
+        if match and match.group(1) in estate.github_orgs:
+            repos = len(estate.github_org_repos(match.group(1)))
+            return (
+                200,
+                {
+                    "login": match.group(1),
+                    "id": estate.github_orgs.index(match.group(1)) + 1,
+                    "url": f"{self.url}/orgs/{match.group(1)}",
+                    "public_repos": 0,
+                    "total_private_repos": repos,
+                },
+                None,
+            )
+
+        match = re.fullmatch(r"/orgs/([^/]+)/repos", path)
+        if match and match.group(1) in estate.github_orgs:
+            indexes = page_of(estate.github_org_repos(match.group(1)), query)
+            return 200, [estate.repo(i, self.url) for i in indexes], None
+
+        if path == "/search/code":
+            match = re.search(r"org:(\S+)", query.get("q", [""])[0])
+            org = match.group(1) if match else ""
+            results = estate.search_results(org) if org in estate.github_orgs else list()
+            items = [self.search_item(i) for i in page_of(results, query)]
+            return 200, {"total_count": len(results), "incomplete_results": False, "items": items}, None
+
+        match = re.fullmatch(r"/repos/([^/]+/[^/]+)(/contents/\.snyk\.d/import\.yaml)?", path)
+        if match and estate.repo_index(match.group(1)) is not None:
+            i = estate.repo_index(match.group(1))
+            if match.group(2) is None:
+                return 200, estate.repo(i, self.url), None
+            if estate.has_import(i):
+                return 200, self.content(i), None
+
+        return 404, {"message": "Not Found"}, None
+
+    def graphql(self, request: dict) -> dict:
+        """
+        Answers the repositories query of github_graphql, the cursor being the offset of the next page
+        """
+        variables = request.get("variables") or dict()
+        org = variables.get("org")
+
+        if "repositories(" not in request.get("query", "") or org not in self.estate.github_orgs:
+            return {"data": {"organization": None}, "errors": [{"type": "NOT_FOUND", "message": f"no org {org}"}]}
+
+        repos = self.estate.github_org_repos(org)
+        start = int(variables.get("cursor") or 0)
+        end = start + int(variables.get("first") or PAGE_SIZE)
+
+        repositories = {
+            "totalCount": len(repos),
+            "pageInfo": {"hasNextPage": end < len(repos), "endCursor": str(end)},
+            "nodes": [self.graphql_node(i) for i in repos[start:end]],
+        }
+
+        return {"data": {"organization": {"repositories": repositories}}}
+
+    def graphql_node(self, i: int) -> dict:
+        repo = self.estate.repo(i, self.url)
+
+        if self.estate.has_import(i):
+            text = self.estate.import_yaml(i)
+            import_yaml = {"oid": hashlib.sha1(text.encode("utf-8")).hexdigest(), "text": text}
+        else:
+            import_yaml = None
+
+        return {
+            "databaseId": repo["id"],
+            "name": repo["name"],
+            "nameWithOwner": repo["full_name"],
+            "url": repo["html_url"],
+            "isFork": repo["fork"],
+            "isArchived": repo["archived"],
+            "visibility": repo["visibility"].upper(),
+            "updatedAt": repo["updated_at"],
+            "owner": {"login": repo["owner"]["login"]},
+            "defaultBranchRef": {"name": repo["default_branch"]},
+            "repositoryTopics": {"nodes": [{"topic": {"name": t}} for t in repo["topics"]]},
+            "importYaml": import_yaml,
+        }
+
+    def content(self, i: int) -> dict:
+        text = self.estate.import_yaml(i)
+
+        return {
+            "type": "file",
+            "name": "import.yaml",
+            "path": ".snyk.d/import.yaml",
+            "sha": hashlib.sha1(text.encode("utf-8")).hexdigest(),
+            "size": len(text),
+            "encoding": "base64",
+            "content": base64.b64encode(text.encode("utf-8")).decode("ascii"),
+            "url": f"{self.url}/repos/{self.estate.full_name(i)}/contents/.snyk.d/import.yaml",
+        }
+
+    def search_item(self, i: int) -> dict:
+        content = self.content(i)
+
+        return {
+            "name": content["name"],
+            "path": content["path"],
+            "sha": content["sha"],
+            "url": content["url"],
+            "repository": self.estate.repo(i, self.url),
+        }
+
+
+class FakeSnyk(FakeServer):
+    """
+    The Snyk endpoints the mapper uses: group orgs, integrations, projects and tags on v1, targets and projects on
+    the REST API
+    """
+
+    kinds = [
+        ("targets", r"^/rest/orgs/[^/]+/targets"),
+        ("projects", r"^/rest/orgs/[^/]+/projects"),
+        ("tags", r"/tags$"),
+        ("project", r"^/v1/org/[^/]+/project/"),
+        ("integrations", r"/integrations$"),
+        ("orgs", r"^/v1/group/"),
+    ]
+
+    def __init__(self, estate: Estate, latency: float = 0):
+        super().__init__(estate, latency)
+        # ids of the projects whose tag updates fail
+        self.failing_tags: Set[str] = set()
+
+    def route(self, verb, path, query, body, headers):
+        estate = self.estate
+
+        match = re.fullmatch(r"/v1/group/([^/]+)/orgs", path)
+        if match and match.group(1) == estate.group_id:
+            return 200, {"id": estate.group_id, "name": "benchmark", "orgs": estate.snyk_orgs()}, None
+
+        match = re.fullmatch(r"/v1/org/([^/]+)/integrations", path)
+        if match and estate.snyk_org_index(match.group(1)) is not None:
+            return 200, {"github-enterprise": make_id(INTEGRATION, estate.snyk_org_index(match.group(1)))}, None
+
+        match = re.fullmatch(r"/v1/org/([^/]+)/project/([^/]+)(/tags)?", path)
+        if match and estate.project_index(match.group(2)) is not None:
+            i, j = estate.project_index(match.group(2))
+            if verb == "POST" and match.group(2) in self.failing_tags:
+                return 500, {"code": 500, "message": "Internal Server Error"}, None
+            if verb == "POST":
+                return 200, {"tags": estate.project_tags(i, j) + [json.loads(body)]}, None
+            project = estate.project(i, j)
+            attributes = project["attributes"]
+            return 200, {"id": project["id"], "name": attributes["name"], "tags": attributes["tags"]}, None
+
+        match = re.fullmatch(r"/rest/orgs/([^/]+)/(targets|projects)", path)
+        if match and estate.snyk_org_index(match.group(1)) is not None:
+            o = estate.snyk_org_index(match.group(1))
+
+            if match.group(2) == "targets":
+                items = [estate.target(i) for i in self.page(estate.org_targets(o), query)]
+            else:
+                items = [estate.project(i, j) for i, j in self.page(estate.org_projects(o), query)]
+
+            return 200, {"data": items, "links": self.links(path, estate, o, match.group(2), query)}, None
+
+        return 404, {"code": 404, "message": "Not Found"}, None
+
+    def page(self, items: list, query: Dict[str, List[str]]) -> list:
+        start = int(query.get("starting_after", ["0"])[0])
+        limit = int(query.get("limit", [str(PAGE_SIZE)])[0])
+
+        return items[start : start + limit]
+
+    def links(self, path: str, estate: Estate, o: int, kind: str, query: Dict[str, List[str]]) -> dict:
+        start = int(query.get("starting_after", ["0"])[0])
+        limit = int(query.get("limit", [str(PAGE_SIZE)])[0])
+        total = len(estate.org_targets(o)) if kind == "targets" else len(estate.org_projects(o))
+
+        if start + limit >= total:
+            return dict()
+
+        version = query.get("version", ["2022-04-06~beta"])[0]
+
+        return {"next": f"{path}?starting_after={start + limit}&limit={limit}&version={version}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_estate_arguments(parser)
+    args = parser.parse_args()
+
+    estate = estate_from_args(args)
+    github = FakeGitHub(estate, args.latency_ms / 1000, args.github_limit, args.github_window).start()
+    snyk = FakeSnyk(estate, args.latency_ms / 1000).start()
+
+    print(f"GitHub: {github.url}  (--github-url {github.url})")
+    print(f"Snyk:   {snyk.url}  (--snyk-url {snyk.url})")
+    print(f"Snyk group id: {estate.group_id}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+def add_estate_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--github-orgs", type=int, default=10)
+    parser.add_argument("--snyk-orgs", type=int, default=50)
+    parser.add_argument("--repos", type=int, default=25000)
+    parser.add_argument("--projects", type=int, default=300000)
+    parser.add_argument("--forks", type=float, default=0.02, help="share of repos that are forks")
+    parser.add_argument("--imports", type=float, default=0.2, help="share of repos with a .snyk.d/import.yaml")
+    parser.add_argument("--unimported", type=float, default=0.05, help="share of repos not yet imported to Snyk")
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every response of the fake APIs")
+    parser.add_argument("--github-limit", type=int, default=5000, help="GitHub core requests allowed per window")
+    parser.add_argument("--github-window", type=float, default=3600, help="seconds of a GitHub rate limit window")
+
+
+def estate_from_args(args: argparse.Namespace) -> Estate:
+    return Estate(
+        github_orgs=args.github_orgs,
+        snyk_orgs=args.snyk_orgs,
+        repos=args.repos,
+        projects=args.projects,
+        forks=args.forks,
+        imports=args.imports,
+        unimported=args.unimported,
+    )
+
+
+if __name__ == "__main__":
+    main()
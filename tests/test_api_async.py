@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+from api_async import AsyncRestClient
+from fakes import INTEGRATION
+from fakes import ORG
+from fakes import make_id
+from models.organizations import Org
+from snyk.client import SnykClient
+from snyk.errors import SnykHTTPError
+
+
+URL = "https://snyk.test/rest"
+TOKEN = "async-test-token"
+
+
+def make_client(**kwargs) -> AsyncRestClient:
+    return AsyncRestClient(url=URL, version="2022-04-06~beta", **kwargs)
+
+
+def collect(client: AsyncRestClient, path: str, params: dict = None) -> list:
+    async def pages():
+        return [page async for page in client.iter_pages(path, TOKEN, params)]
+
+    return asyncio.run(pages())
+
+
+def test_follows_next_links_until_there_are_none(requests_mock):
+    requests_mock.get(f"{URL}/orgs/1/targets?limit=2", json={"data": [1, 2], "links": {"next": "/rest/next?p=2"}})
+    requests_mock.get(f"{URL}/next?p=2", json={"data": [3], "links": {"self": "/rest/next?p=2"}})
+    client = make_client()
+
+    assert collect(client, "orgs/1/targets", {"limit": 2, "origin": None, "excludeEmpty": True}) == [[1, 2], [3]]
+
+    first = requests_mock.request_history[0]
+    assert first.qs == {"limit": ["2"], "excludeempty": ["true"], "version": ["2022-04-06~beta"]}
+    assert first.headers["Authorization"] == f"token {TOKEN}"
+    assert requests_mock.request_history[1].qs == {"p": ["2"]}
+
+
+def test_stops_on_a_next_link_to_itself_or_an_empty_page(requests_mock):
+    requests_mock.get(f"{URL}/a", json={"data": [1], "links": {"next": "/rest/a", "self": "/rest/a"}})
+    requests_mock.get(f"{URL}/b", json={"data": [1], "links": {"next": "/rest/c"}})
+    requests_mock.get(f"{URL}/c", json={"data": [], "links": {"next": "/rest/d"}})
+    client = make_client()
+
+    assert collect(client, "a") == [[1]]
+    assert collect(client, "b") == [[1]]
+    assert requests_mock.call_count == 3
+
+
+def test_retries_server_errors_with_backoff(requests_mock):
+    requests_mock.get(f"{URL}/a", [{"status_code": 502}, {"status_code": 500}, {"json": {"data": [1]}}])
+    client = make_client(tries=3, delay=0.01)
+
+    assert collect(client, "a") == [[1]]
+    assert requests_mock.call_count == 3
+
+
+def test_gives_up_after_its_tries(requests_mock):
+    requests_mock.get(f"{URL}/a", status_code=503)
+    client = make_client(tries=2, delay=0.01)
+
+    with pytest.raises(SnykHTTPError):
+        collect(client, "a")
+
+    assert requests_mock.call_count == 2
+
+
+def test_rate_limited_request_waits_as_long_as_retry_after_says(requests_mock):
+    requests_mock.get(f"{URL}/a", [{"status_code": 429, "headers": {"Retry-After": "0.2"}}, {"json": {"data": [1]}}])
+    requests_mock.get(f"{URL}/b", [{"status_code": 429, "headers": {"Retry-After": "0"}}, {"json": {"data": [2]}}])
+    client = make_client(tries=2, delay=0.01)
+
+    start = time.time()
+    assert collect(client, "a") == [[1]]
+    assert time.time() - start >= 0.2
+
+    # without the Retry-After of 0, the 10s backoff would be slept instead
+    client = make_client(tries=2, delay=10)
+    start = time.time()
+    assert collect(client, "b") == [[2]]
+    assert time.time() - start < 5
+
+
+class SlowSession:
+    """
+    Stands in for the client's session, answering every GET after a pause and keeping the most seen in flight
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    def get(self, url, headers=None, params=None, verify=True):
+        with self.lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+
+        time.sleep(0.05)
+
+        with self.lock:
+            self.in_flight -= 1
+
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = b'{"data": [1]}'
+        return resp
+
+
+def test_requests_in_flight_stay_within_the_concurrency():
+    client = make_client(concurrency=3)
+    client.session = SlowSession()
+
+    async def many():
+        return await asyncio.gather(*[client.get("a", TOKEN) for _ in range(12)])
+
+    assert len(asyncio.run(many())) == 12
+    assert client.session.most_in_flight == 3
+
+
+def test_refresh_async_links_projects_to_their_targets(requests_mock, estate):
+    org_id = make_id(ORG, 0)
+    targets = [estate.target(i) for i in estate.org_targets(0)]
+    projects = [estate.project(i, j) for i, j in estate.org_projects(0)]
+
+    requests_mock.get(f"{URL}/orgs/{org_id}/targets", json={"data": targets[:2], "links": {"next": "/rest/targets-2"}})
+    requests_mock.get(f"{URL}/targets-2", json={"data": targets[2:]})
+    requests_mock.get(
+        f"{URL}/orgs/{org_id}/projects", json={"data": projects[:4], "links": {"next": "/rest/projects-2"}}
+    )
+    requests_mock.get(f"{URL}/projects-2", json={"data": projects[4:]})
+    requests_mock.get(
+        f"https://snyk.test/v1/org/{org_id}/integrations", json={"github-enterprise": make_id(INTEGRATION, 0)}
+    )
+
+    org = Org.parse_obj(
+        {"id": org_id, "name": "Snyk Org 0", "slug": "snyk-org-0", "group_id": estate.group_id, "group_name": "g"}
+    )
+    v1client = SnykClient(TOKEN, url="https://snyk.test/v1")
+
+    asyncio.run(org.refresh_async(make_client(), TOKEN, v1client, "github-enterprise"))
+
+    assert [t.name for t in org.targets] == [estate.full_name(i) for i in estate.org_targets(0)]
+    assert len(org.projects) == len(projects)
+    assert all(p.repo_name == p.name.split(":")[0] for p in org.projects)
+    assert str(org.integrations["github-enterprise"]) == make_id(INTEGRATION, 0)
+    assert set(org.origins) == {"github-enterprise"}
@@ -0,0 +1,198 @@
+import json
+import os
+import shutil
+import threading
+
+import pytest
+from cache_store import CODECS
+from cache_store import RecordStore
+from models.tracking import TrackedModel
+
+
+class Record(TrackedModel):
+    id: str
+    value: int
+
+
+def records(*values: int) -> list:
+    return [Record(id=f"r{i}", value=v) for i, v in enumerate(values)]
+
+
+@pytest.fixture(params=["json", "msgpack"])
+def fmt(request):
+    return request.param
+
+
+def test_index_records_the_size_of_its_data_file(tmp_path, fmt):
+    store = RecordStore(str(tmp_path), "records", Record, fmt)
+    store.save(records(1, 2, 3))
+
+    reopened = RecordStore(str(tmp_path), "records", Record, fmt)
+
+    assert list(reopened.index()) == ["r0", "r1", "r2"]
+    assert reopened.get("r1")["value"] == 2
+
+
+def test_index_written_before_sizes_were_recorded_is_still_read(tmp_path):
+    store = RecordStore(str(tmp_path), "records", Record)
+    store.save(records(1, 2))
+
+    with open(store.index_file, "r") as the_file:
+        index = json.load(the_file)["records"]
+    with open(store.index_file, "w") as the_file:
+        json.dump(index, the_file)
+
+    assert RecordStore(str(tmp_path), "records", Record).get("r1")["value"] == 2
+
+
+def swap_in_new_data_file(tmp_path, store: RecordStore) -> str:
+    """
+    Leaves the store as a save in another process would between its two swaps: the new data file next to the old
+    index. Returns where the new index was set aside
+    """
+    shutil.copy(store.index_file, tmp_path / "old.idx")
+    store.save(records(10, 20, 30))
+    shutil.copy(store.index_file, tmp_path / "new.idx")
+    shutil.copy(tmp_path / "old.idx", store.index_file)
+
+    return str(tmp_path / "new.idx")
+
+
+def test_index_not_matching_its_data_file_is_refused(tmp_path):
+    store = RecordStore(str(tmp_path), "records", Record)
+    store.save(records(1, 2))
+    swap_in_new_data_file(tmp_path, store)
+
+    with pytest.raises(Exception, match="does not match"):
+        RecordStore(str(tmp_path), "records", Record).index()
+
+
+def test_index_swapped_in_while_reading_is_waited_for(tmp_path):
+    store = RecordStore(str(tmp_path), "records", Record)
+    store.save(records(1, 2))
+    new_index = swap_in_new_data_file(tmp_path, store)
+
+    finish_save = threading.Timer(0.06, os.replace, (new_index, store.index_file))
+    finish_save.start()
+
+    try:
+        assert RecordStore(str(tmp_path), "records", Record).get("r2")["value"] == 30
+    finally:
+        finish_save.join()
+
+
+@pytest.fixture
+def encoded(monkeypatch):
+    """
+    The records each save serialises, rather than copies from the current file
+    """
+    seen: list = list()
+
+    for codec in CODECS.values():
+
+        def encode(data, original=codec.encode):
+            if isinstance(data, Record):
+                seen.append(data.id)
+            return original(data)
+
+        monkeypatch.setattr(codec, "encode", encode)
+
+    return seen
+
+
+def saved(tmp_path, fmt: str, values: list) -> list:
+    saved_records = records(*values)
+    RecordStore(str(tmp_path), "records", Record, fmt).save(saved_records)
+
+    return saved_records
+
+
+def test_unchanged_save_writes_nothing(tmp_path, fmt, encoded):
+    saved_records = saved(tmp_path, fmt, [1, 2, 3])
+    store = RecordStore(str(tmp_path), "records", Record, fmt)
+    before = [os.stat(f).st_mtime_ns for f in (store.data_file, store.index_file)]
+    encoded.clear()
+
+    assert store.save(saved_records) is False
+    assert encoded == list()
+    assert [os.stat(f).st_mtime_ns for f in (store.data_file, store.index_file)] == before
+
+
+def test_changed_record_is_rewritten_and_the_rest_copied(tmp_path, fmt, encoded):
+    saved_records = saved(tmp_path, fmt, [1, 2, 3])
+    store = RecordStore(str(tmp_path), "records", Record, fmt)
+    old_index = store.index()
+    with open(store.data_file, "rb") as the_file:
+        old_data = the_file.read()
+    encoded.clear()
+
+    saved_records[1].value = 20
+
+    assert store.save(saved_records) is True
+    assert encoded == ["r1"]
+
+    reopened = RecordStore(str(tmp_path), "records", Record, fmt)
+    with open(reopened.data_file, "rb") as the_file:
+        new_data = the_file.read()
+
+    for record_id in ("r0", "r2"):
+        old_offset, old_length = old_index[record_id]
+        new_offset, new_length = reopened.index()[record_id]
+        assert new_data[new_offset : new_offset + new_length] == old_data[old_offset : old_offset + old_length]
+
+    assert reopened.get("r1")["value"] == 20
+    assert all(not r.is_changed() for r in saved_records)
+
+
+def test_rebuilt_record_with_the_same_content_is_copied(tmp_path, fmt, encoded):
+    saved(tmp_path, fmt, [1, 2])
+    store = RecordStore(str(tmp_path), "records", Record, fmt)
+    encoded.clear()
+
+    # re-fetched records start out changed
+    assert store.save(records(1, 2)) is False
+    assert encoded == ["r0", "r1"]
+
+
+def test_records_sharing_an_id_are_always_serialised(tmp_path, fmt, encoded):
+    saved_records = [Record(id="same", value=1), Record(id="same", value=2), Record(id="other", value=3)]
+    store = RecordStore(str(tmp_path), "records", Record, fmt)
+    store.save(saved_records)
+    encoded.clear()
+
+    assert store.save(saved_records) is True
+    assert encoded == ["same", "same"]
+    assert [r["value"] for r in RecordStore(str(tmp_path), "records", Record, fmt).read()] == [1, 2, 3]
+
+
+def test_reorder_forces_a_rewrite(tmp_path, fmt, encoded):
+    saved_records = saved(tmp_path, fmt, [1, 2, 3])
+    store = RecordStore(str(tmp_path), "records", Record, fmt)
+    encoded.clear()
+
+    assert store.save(list(reversed(saved_records))) is True
+    assert encoded == list()
+
+    reopened = RecordStore(str(tmp_path), "records", Record, fmt)
+    assert list(reopened.index()) == ["r2", "r1", "r0"]
+    assert [r["value"] for r in reopened.read()] == [3, 2, 1]
+
+
+def test_store_written_for_an_older_schema_is_not_copied_from(tmp_path, encoded):
+    saved_records = saved(tmp_path, "json", [1, 2, 3])
+    store = RecordStore(str(tmp_path), "records", Record)
+
+    with open(store.data_file, "r") as the_file:
+        lines = the_file.readlines()
+    header = json.loads(lines[0])
+    header["cache_schema"] -= 1
+    lines[0] = json.dumps(header, separators=(",", ":")) + "\n"
+    with open(store.data_file, "w") as the_file:
+        the_file.writelines(lines)
+    encoded.clear()
+
+    # the header line is the same length, so the index still matches the data file
+    store = RecordStore(str(tmp_path), "records", Record)
+    assert store.save(saved_records) is True
+    assert encoded == ["r0", "r1", "r2"]
+    assert RecordStore(str(tmp_path), "records", Record).is_trusted()
@@ -0,0 +1,85 @@
+import json
+from datetime import datetime
+from datetime import timedelta
+
+
+def test_targets_syncs_an_empty_cache_first(mapper, estate):
+    result = mapper.run("targets")
+
+    assert result.returncode == 0, result.stderr
+    assert "Getting all GitHub repos" in result.stderr
+    assert (mapper.cache_dir / "sync.json").is_file()
+
+    # the repos that aren't in Snyk yet are listed for import, after the warning that there was no cache to load
+    groups = json.loads(result.stdout[result.stdout.index("[") :])
+    names = [t["target"]["name"] for t in groups[0]["targets"]]
+    assert names == [estate.full_name(i).split("/")[1] for i in range(estate.repo_count) if not estate.is_imported(i)]
+
+
+def test_tags_syncs_an_empty_cache_first(mapper, estate):
+    result = mapper.run("tags", "--update")
+
+    assert result.returncode == 0, result.stderr
+    assert "Getting all GitHub repos" in result.stderr
+    assert (mapper.cache_dir / "org").is_dir()
+    assert mapper.snyk.take_counts().get("POST tags", 0) > 0
+
+
+def test_tags_on_the_sqlite_backend_update_projects_through_the_database(mapper):
+    result = mapper.run("tags", "--update", options=("--cache-backend", "sqlite"))
+
+    assert result.returncode == 0, result.stderr
+    assert (mapper.cache_dir / "cache.db").is_file()
+    assert mapper.snyk.take_counts().get("POST tags", 0) > 0
+
+
+def synced_tag_updates(mapper) -> list:
+    assert mapper.run("sync").returncode == 0
+
+    result = mapper.run("tags", options=("--cache-timeout", "60"))
+    assert result.returncode == 0, result.stderr
+    mapper.snyk.take_counts()
+
+    return json.loads(result.stdout[result.stdout.index("[") :])
+
+
+def test_tags_update_summarises_failed_projects_and_exits_1(mapper):
+    updates = synced_tag_updates(mapper)
+    failing = updates[0]
+    mapper.snyk.failing_tags.add(failing["project_id"])
+
+    result = mapper.run("tags", "--update", options=("--cache-timeout", "60", "--tag-workers", "4"))
+
+    assert result.returncode == 1
+    assert "1 failed" in result.stderr
+    assert f"org/{failing['org_id']}/project/{failing['project_id']}: POST returned 500" in result.stderr
+
+    # every other project was still tagged
+    posted = sum(len(u["tags"]) for u in updates[1:])
+    assert mapper.snyk.take_counts()["POST tags"] >= posted
+
+
+def test_tags_update_reads_projects_first_unless_the_cache_is_trusted(mapper):
+    updates = synced_tag_updates(mapper)
+    trusting = ("--cache-timeout", "1440", "--trust-cache-minutes", "60")
+
+    assert mapper.run("tags", "--update", options=trusting).returncode == 0
+    counts = mapper.snyk.take_counts()
+    assert "GET project" not in counts
+    assert counts["POST tags"] == sum(len(u["tags"]) for u in updates)
+
+    assert mapper.run("tags", "--update", options=("--cache-timeout", "1440")).returncode == 0
+    assert mapper.snyk.take_counts()["GET project"] == len(updates)
+
+    # a cache older than --trust-cache-minutes isn't trusted
+    with open(mapper.cache_dir / "sync.json") as the_file:
+        state = json.load(the_file)
+    state["last_sync"] = (datetime.utcnow() - timedelta(hours=2)).isoformat(timespec="microseconds")
+    with open(mapper.cache_dir / "sync.json", "w") as the_file:
+        json.dump(state, the_file)
+
+    result = mapper.run("tags", "--update", options=trusting)
+
+    assert result.returncode == 0, result.stderr
+    assert "Cache is older than 60" in result.stderr
+    assert mapper.snyk.take_counts()["GET project"] == len(updates)
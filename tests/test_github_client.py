@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from github.Requester import HTTPRequestsConnectionClass
+from github.Requester import Requester
+from github_pool import Credential
+from github_pool import CredentialPool
+from http_cache import ResponseCache
+from rate_governor import governor
+from utils import GithubClients
+from utils import get_organizations
+from utils import iter_repo_pages
+from utils import make_github_client
+from utils import requester_of
+
+
+def test_each_client_keeps_its_own_response_cache(tmp_path, github):
+    cache_a = ResponseCache(tmp_path / "a")
+    cache_b = ResponseCache(tmp_path / "b")
+    client_a = make_github_client("token-a", base_url=github.url, response_cache=cache_a)
+    client_b = make_github_client("token-b", base_url=github.url, response_cache=cache_b)
+    client_c = make_github_client("token-c", base_url=github.url)
+
+    client_a.get_organization("github-org-0")
+    client_a.get_organization("github-org-0")
+    client_c.get_organization("github-org-0")
+
+    assert (cache_a.hits, cache_a.misses) == (1, 1)
+    assert (cache_b.hits, cache_b.misses) == (0, 0)
+
+    client_b.get_organization("github-org-0")
+
+    assert (cache_a.hits, cache_a.misses) == (1, 1)
+    assert (cache_b.hits, cache_b.misses) == (0, 1)
+
+
+def test_each_client_keeps_its_own_credential_pool(github):
+    pool = CredentialPool("token-a", [Credential("pooled", "token-pooled")])
+    client_a = make_github_client("token-a", base_url=github.url, credential_pool=pool)
+    client_b = make_github_client("token-b", base_url=github.url)
+
+    # the pool spreads client a's requests over both its tokens
+    client_a.get_organization("github-org-0")
+    client_a.get_organization("github-org-0")
+    client_b.get_organization("github-org-0")
+
+    assert set(github.budgets) == {
+        ("token token-a", "core"),
+        ("token token-pooled", "core"),
+        ("token token-b", "core"),
+    }
+
+    # a token outside the pool would be taken for a GitHub App's own requests
+    assert set(governor.budgets) == {("default", "core"), ("pooled", "core")}
+
+
+def test_a_client_keeps_one_connection_and_leaves_pygithub_as_it_was(github):
+    client = make_github_client("token-a", base_url=github.url)
+
+    client.get_organization("github-org-0")
+    connection = getattr(requester_of(client), "_Requester__connection")
+    client.get_organization("github-org-1")
+
+    assert getattr(requester_of(client), "_Requester__connection") is connection
+    assert getattr(Requester, "_Requester__httpConnectionClass") is HTTPRequestsConnectionClass
+    assert getattr(Requester, "_Requester__persist") is True
+
+
+def test_each_thread_gets_its_own_client_on_the_shared_session(github):
+    clients = GithubClients("token-a", base_url=github.url)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        other = executor.submit(clients.get).result()
+
+    assert clients.get() is clients.get()
+    assert other is not clients.get()
+
+    clients.get().get_organization("github-org-0")
+    other.get_organization("github-org-0")
+
+    assert getattr(requester_of(other), "_Requester__connection").session is (
+        getattr(requester_of(clients.get()), "_Requester__connection").session
+    )
+
+
+def test_workers_list_every_repo_through_their_own_clients(estate, github):
+    clients = GithubClients("token-a", per_page=2, base_url=github.url)
+    gh_orgs = ["github-org-0", "github-org-1"]
+
+    gh_repos = {
+        name: org.get_repos(type="all", sort="updated", direction="desc")
+        for name, org in zip(gh_orgs, get_organizations(clients, gh_orgs, workers=2))
+    }
+
+    listed = [
+        (name, repo.id) for name, page, _ in iter_repo_pages(clients, gh_repos, {}, 2, workers=3) for repo in page
+    ]
+
+    assert sorted(listed) == sorted(
+        (name, estate.repo(i, github.url)["id"]) for name in gh_orgs for i in estate.github_org_repos(name)
+    )
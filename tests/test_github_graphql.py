@@ -0,0 +1,56 @@
+import time
+
+from github_graphql import iter_repos
+from rate_governor import governor
+
+
+TOKEN = "graphql-test-token"
+
+
+def walk(github, orgs):
+    return list(iter_repos(TOKEN, orgs, url=f"{github.url}/graphql", page_size=2, workers=2))
+
+
+def test_walks_every_page_of_every_org(estate, github):
+    pages = walk(github, ["github-org-0", "github-org-1"])
+
+    # 5 repos an org, 2 to a page
+    assert len(pages) == 6
+    assert pages[-1][2] == 10
+
+    names = sorted(repo.full_name for _, page, _ in pages for repo, _ in page)
+    assert names == sorted(estate.full_name(i) for i in range(10))
+
+    assert github.take_counts() == {"POST graphql": 6}
+
+
+def test_import_yaml_is_read_and_missing_ones_are_none(estate, github):
+    pages = walk(github, ["github-org-0"])
+    import_yamls = {repo.full_name: import_yaml for _, page, _ in pages for repo, import_yaml in page}
+
+    has_import = [i for i in estate.github_org_repos("github-org-0") if estate.has_import(i)]
+    assert 0 < len(has_import) < 5
+
+    for i in estate.github_org_repos("github-org-0"):
+        import_yaml = import_yamls[estate.full_name(i)]
+        if i in has_import:
+            assert import_yaml.decoded_content.decode("utf-8") == estate.import_yaml(i)
+            assert import_yaml.path == ".snyk.d/import.yaml"
+        else:
+            assert import_yaml is None
+
+
+def test_rate_limited_page_is_retried_after_the_reset(estate, github):
+    github.limits["graphql"] = (2, 1)
+
+    # another client used up the token's budget
+    github.take(f"bearer {TOKEN}", "graphql")
+    github.take(f"bearer {TOKEN}", "graphql")
+
+    start = time.time()
+    pages = walk(github, ["github-org-0"])
+
+    assert sum(len(page) for _, page, _ in pages) == 5
+    assert github.take_counts()["POST graphql"] > 3
+    assert time.time() - start >= 1
+    assert "graphql" in governor.state()
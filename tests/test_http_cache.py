@@ -0,0 +1,54 @@
+import os
+
+from http_cache import ResponseCache
+from utils import make_github_client
+
+
+def age(cache: ResponseCache, seconds: float):
+    for entry_file in cache.path.iterdir():
+        mtime = entry_file.stat().st_mtime - seconds
+        os.utime(entry_file, (mtime, mtime))
+
+
+def test_entries_a_run_did_not_use_are_pruned(tmp_path, github):
+    last_run = ResponseCache(tmp_path)
+    client = make_github_client("token-a", base_url=github.url, response_cache=last_run)
+
+    client.get_organization("github-org-0")
+    client.get_organization("github-org-1")
+    (tmp_path / "interrupted.1.tmp").write_text("{}")
+    age(last_run, 3600)
+
+    this_run = ResponseCache(tmp_path)
+    client = make_github_client("token-a", base_url=github.url, response_cache=this_run)
+    client.get_organization("github-org-0")
+
+    assert this_run.prune_unused() == 2
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # the entry that was read is kept and still answers the next run
+    next_run = ResponseCache(tmp_path)
+    client = make_github_client("token-a", base_url=github.url, response_cache=next_run)
+    client.get_organization("github-org-0")
+
+    assert (next_run.hits, next_run.misses) == (1, 0)
+    assert next_run.prune_unused() == 0
+
+
+def test_a_full_sync_prunes_the_entries_it_did_not_use(mapper):
+    assert mapper.run("sync").returncode == 0
+
+    cache = ResponseCache(mapper.cache_dir / "github")
+    (cache.path / "gone.json").write_text("{}")
+    age(cache, 3600)
+
+    result = mapper.run("sync")
+
+    assert result.returncode == 0, result.stderr
+
+    # what's left is what the second sync read or wrote
+    entry_files = list(cache.path.iterdir())
+
+    assert entry_files
+    assert all(entry_file.stat().st_mtime >= cache.opened for entry_file in entry_files)
+    assert not (cache.path / "gone.json").exists()
@@ -0,0 +1,74 @@
+import json
+from datetime import datetime
+
+from utils import GithubClients
+from utils import get_organizations
+from utils import iter_repo_pages
+from utils import load_watchlist
+
+
+INCREMENTAL = ("--github-incremental",)
+
+
+def sync_state(mapper) -> dict:
+    with open(mapper.cache_dir / "sync.json") as the_file:
+        return json.load(the_file)
+
+
+def listed(github, updated_since=None) -> list:
+    clients = GithubClients("token-a", per_page=2, base_url=github.url)
+    gh_org = get_organizations(clients, ["github-org-0"])[0]
+    gh_repos = {"github-org-0": gh_org.get_repos(type="all", sort="updated", direction="desc")}
+
+    pages = iter_repo_pages(clients, gh_repos, {"github-org-0": 1}, 2, updated_since=updated_since)
+
+    return [repo.id for _, page, _ in pages for repo in page]
+
+
+def test_the_listing_stops_at_the_first_page_older_than_the_watermark(estate, github):
+    # github-org-0 lists repos 0, 2, 4, 6 and 8, two to a page, and only the first two were updated since
+    estate.touch(0, "2030-01-02T00:00:00Z")
+    estate.touch(2, "2030-01-01T00:00:00Z")
+
+    assert listed(github, datetime(2029, 1, 1)) == [1, 3, 5, 7]
+    assert github.take_counts()["GET repos"] == 2
+
+    assert listed(github) == [1, 3, 5, 7, 9]
+    assert github.take_counts()["GET repos"] == 3
+
+
+def test_incremental_syncs_keep_deleted_repos_until_the_next_full_listing(mapper, estate):
+    result = mapper.run("sync", options=INCREMENTAL)
+
+    assert result.returncode == 0, result.stderr
+    assert "Listing only repos" not in result.stderr
+
+    first = sync_state(mapper)
+    assert first["last_full_listing"] == first["last_listing"]
+
+    # repos 8 and 9 are deleted and repo 1 is updated
+    estate.repo_count = 8
+    estate.touch(1, "2030-01-01T00:00:00Z")
+
+    result = mapper.run("sync", options=INCREMENTAL)
+
+    assert result.returncode == 0, result.stderr
+    assert f"Listing only repos updated since {datetime.fromisoformat(first['last_listing'])}" in result.stderr
+
+    watchlist = load_watchlist(mapper.cache_dir)
+    assert len(watchlist.repos) == 10
+    assert watchlist.get_repo(2).updated_at.startswith("2030-01-01")
+
+    second = sync_state(mapper)
+    assert second["last_full_listing"] == first["last_full_listing"]
+    assert second["last_listing"] > first["last_listing"]
+
+    # a full listing is due as soon as the interval has passed, and it's the one that prunes
+    result = mapper.run("sync", options=(*INCREMENTAL, "--full-listing-interval", "0"))
+
+    assert result.returncode == 0, result.stderr
+    assert "Listing only repos" not in result.stderr
+    assert sorted(r.id for r in load_watchlist(mapper.cache_dir).repos) == list(range(1, 9))
+
+    third = sync_state(mapper)
+    assert third["last_full_listing"] == third["last_listing"] > second["last_listing"]
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+from models.organizations import Orgs
+from utils import load_watchlist
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request):
+    return request.param
+
+
+def synced_orgs(mapper, backend: str = "json") -> Orgs:
+    result = mapper.run("sync", options=("--cache-backend", backend))
+    assert result.returncode == 0, result.stderr
+
+    return Orgs(cache=str(mapper.cache_dir), backend=backend)
+
+
+def loaded(orgs: Orgs, lazy: bool = False, cache_format: str = "json") -> Orgs:
+    copy = Orgs(cache=orgs.cache, backend=orgs.backend, cache_format=cache_format)
+    copy.load(lazy=lazy)
+
+    return copy
+
+
+def records(orgs: Orgs) -> dict:
+    return {
+        str(org.id): {
+            "integrations": {k: str(v) for k, v in org.integrations.items()},
+            "targets": [json.loads(t.json()) for t in org.targets],
+            "projects": [json.loads(p.json()) for p in org.projects],
+        }
+        for org in orgs.orgs
+    }
+
+
+def org_files(mapper) -> dict:
+    return {str(f.relative_to(mapper.cache_dir)): f.read_bytes() for f in (mapper.cache_dir / "org").rglob("*.*")}
+
+
+def test_lazy_orgs_only_read_their_records_once_used(mapper, backend):
+    lazy = loaded(synced_orgs(mapper, backend), lazy=True)
+    org = lazy.orgs[0]
+
+    assert org.name and org.slug
+    assert all(o.is_deferred() for o in lazy.orgs)
+
+    assert org.projects
+    assert not org.is_deferred()
+    assert all(o.is_deferred() for o in lazy.orgs[1:])
+
+
+def test_lazy_orgs_match_eagerly_loaded_ones(mapper, backend):
+    orgs = synced_orgs(mapper, backend)
+    eager = loaded(orgs)
+    lazy = loaded(orgs, lazy=True)
+
+    assert [o.id for o in lazy.orgs] == [o.id for o in eager.orgs]
+
+    # the lookup indexes are built over the deferred records the first time they're used
+    for repo in load_watchlist(mapper.cache_dir, backend).repos:
+        assert [p.id for p in lazy.find_projects_by_repo(repo.full_name, repo.id)] == [
+            p.id for p in eager.find_projects_by_repo(repo.full_name, repo.id)
+        ]
+
+    assert records(lazy) == records(eager)
+
+
+def test_saving_never_materialised_orgs_leaves_their_records_intact(mapper, backend):
+    orgs = synced_orgs(mapper, backend)
+    before = records(loaded(orgs))
+    files = org_files(mapper) if backend == "json" else None
+
+    lazy = loaded(orgs, lazy=True)
+    lazy.save()
+
+    assert all(o.is_deferred() for o in lazy.orgs)
+    assert records(loaded(orgs)) == before
+
+    if backend == "json":
+        assert org_files(mapper) == files
+
+
+def test_saving_lazy_orgs_in_another_format_writes_all_their_records(mapper):
+    orgs = synced_orgs(mapper)
+    before = records(loaded(orgs))
+
+    loaded(orgs, lazy=True, cache_format="msgpack").save()
+
+    assert list((mapper.cache_dir / "org").rglob("projects.msgpack"))
+    assert records(loaded(orgs, cache_format="msgpack")) == before
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+from github.GithubException import GithubException
+from github.GithubException import RateLimitExceededException
+from github_graphql import graphql_query
+from rate_governor import RATE_LIMIT_TRIES
+from rate_governor import RateGovernor
+
+
+class StubResponse:
+    def __init__(self, status_code: int, data: dict, headers: dict = None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or dict()
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+class StubSession:
+    def __init__(self, *responses: StubResponse):
+        self.responses = list(responses)
+        self.posts = 0
+
+    def post(self, url, json=None, headers=None):
+        self.posts += 1
+        return self.responses[min(self.posts, len(self.responses)) - 1]
+
+
+def limit_headers(remaining: int, reset: float) -> dict:
+    return {"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": str(remaining), "X-RateLimit-Reset": str(reset)}
+
+
+def test_permanent_403_is_not_retried():
+    saml = StubResponse(403, {"message": "Resource protected by organization SAML enforcement."})
+    session = StubSession(saml)
+
+    with pytest.raises(GithubException) as raised:
+        graphql_query(session, "http://github/graphql", "query", {"org": "acme"})
+
+    assert not isinstance(raised.value, RateLimitExceededException)
+    assert session.posts == 1
+
+
+def test_rate_limited_query_is_retried_after_the_pause():
+    limited = StubResponse(403, {"message": "secondary rate limit"}, {"Retry-After": "0"})
+    ok = StubResponse(200, {"data": {"organization": None}})
+    session = StubSession(limited, ok)
+
+    assert graphql_query(session, "http://github/graphql", "query", {"org": "acme"}) == {"organization": None}
+    assert session.posts == 2
+
+
+def test_rate_limited_retries_are_capped():
+    errors = {"errors": [{"type": "RATE_LIMITED", "message": "API rate limit exceeded"}]}
+    session = StubSession(StubResponse(200, errors, {"Retry-After": "0"}))
+
+    with pytest.raises(RateLimitExceededException):
+        graphql_query(session, "http://github/graphql", "query", {"org": "acme"})
+
+    assert session.posts == RATE_LIMIT_TRIES
+
+
+def test_exhausted_budget_waits_until_its_reset():
+    g = RateGovernor()
+
+    assert g.update("core", 403, limit_headers(0, time.time() + 0.5), "API rate limit exceeded")
+
+    start = time.time()
+    g.acquire("core")
+
+    assert time.time() - start >= 0.5
+
+
+def test_request_goes_to_the_credential_with_most_left():
+    g = RateGovernor()
+    reset = time.time() + 60
+    g.update("core", 200, limit_headers(10, reset), credential="a")
+    g.update("core", 200, limit_headers(900, reset), credential="b")
+
+    assert g.acquire("core", ["a", "b"]) == "b"
+    assert not g.update("core", 404, limit_headers(899, reset), "Not Found", credential="b")
@@ -0,0 +1,85 @@
+import json
+
+from fakes import Estate
+from models.organizations import Orgs
+from models.repositories import Repo
+from models.sync import SnykWatchList
+from sqlite_cache import SqliteCache
+from utils import load_watchlist
+
+
+def synced(mapper) -> SnykWatchList:
+    """
+    Syncs the fake estate into the mapper's json cache and returns the watchlist read back from it, with
+    each repo's projects
+    """
+    result = mapper.run("sync")
+    assert result.returncode == 0, result.stderr
+
+    return load_watchlist(mapper.cache_dir)
+
+
+def watching_sqlite(cache_dir, estate: Estate) -> SnykWatchList:
+    watchlist = SnykWatchList(default_org=estate.snyk_org_slug(0), snyk_orgs=estate.orgs_file())
+    watchlist.use_cache(load_watchlist(cache_dir, "sqlite"))
+
+    return watchlist
+
+
+def as_json(value) -> str:
+    return json.dumps(value, sort_keys=True, default=lambda v: json.loads(v.json()) if hasattr(v, "json") else str(v))
+
+
+def test_saved_repos_are_read_back_in_order_without_their_projects(tmp_path, mapper):
+    repos = synced(mapper).repos
+    store = SqliteCache(f"{tmp_path}/cache.db")
+
+    store.save_repos(repos)
+
+    assert [json.loads(data) for data in store.iter_repos()] == [
+        json.loads(r.json(exclude={"projects"})) for r in repos
+    ]
+    assert all(store.repo_project_ids(r.id) == [str(p.id) for p in r.projects] for r in repos)
+    assert store.is_trusted(Repo)
+
+    # reordered, one repo dropped and nothing changed since the last save
+    kept = list(reversed(repos[1:]))
+    store.save_repos(kept)
+
+    assert [json.loads(data)["id"] for data in store.iter_repos()] == [r.id for r in kept]
+    assert store.repo_project_ids(repos[0].id) == []
+    assert not store.has_projects(repos[0].id)
+
+    store.close()
+
+
+def test_lookups_through_the_store_match_the_in_memory_ones(tmp_path, estate, mapper):
+    in_memory = synced(mapper)
+    in_memory.default_org = estate.snyk_org_slug(0)
+    in_memory.snyk_orgs = estate.orgs_file()
+
+    orgs = Orgs(cache=str(mapper.cache_dir))
+    orgs.load()
+
+    store = SqliteCache(f"{tmp_path}/cache.db")
+    store.save_repos(in_memory.repos)
+    store.save_orgs(orgs.orgs)
+    store.close()
+
+    from_store = watching_sqlite(tmp_path, estate)
+    org_ids = [str(o.id) for o in orgs.orgs]
+
+    assert from_store._store is not None
+    assert [r.id for r in from_store.repos] == [r.id for r in in_memory.repos]
+    assert all(not r.projects for r in from_store.repos)
+
+    for repo in in_memory.repos:
+        stored = from_store.get_repo(repo.id)
+
+        assert from_store.needs_reimport(stored) == in_memory.needs_reimport(repo)
+        assert as_json(from_store.get_reimport(stored)) == as_json(in_memory.get_reimport(repo))
+
+    tag_updates = in_memory.get_proj_tag_updates(org_ids)
+
+    assert tag_updates
+    assert as_json(from_store.get_proj_tag_updates(org_ids)) == as_json(tag_updates)
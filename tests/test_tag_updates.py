@@ -0,0 +1,148 @@
+import json
+import threading
+from typing import Dict
+from typing import List
+
+import requests
+from snyk.errors import SnykHTTPError
+from tag_updates import update_tags
+
+
+def http_error(code: int) -> SnykHTTPError:
+    resp = requests.Response()
+    resp.status_code = code
+    resp._content = json.dumps({"code": code, "message": "error"}).encode("utf-8")
+
+    return SnykHTTPError(resp)
+
+
+class Response:
+    def __init__(self, data: dict):
+        self.data = data
+
+    def json(self) -> dict:
+        return self.data
+
+
+class StubClient:
+    """
+    Answers the v1 project and tag requests update_tags makes from each project's live tags, from any thread.
+    Projects in fail_gets / fail_posts answer with a 500, those in fail_once only the first time, and posts to
+    those in broken lose the connection
+    """
+
+    def __init__(self, live: Dict[str, List[dict]], barrier: threading.Barrier = None):
+        self.live = live
+        self.barrier = barrier
+        self.fail_gets: set = set()
+        self.fail_posts: set = set()
+        self.fail_once: set = set()
+        self.broken: set = set()
+        self.lock = threading.Lock()
+        self.gets: List[str] = list()
+        self.posts: List[tuple] = list()
+        self.threads: set = set()
+
+    def get(self, path: str) -> Response:
+        project_id = path.rsplit("/", 1)[-1]
+
+        with self.lock:
+            self.gets.append(project_id)
+
+        if project_id in self.fail_gets:
+            raise http_error(500)
+
+        return Response({"name": project_id, "tags": list(self.live[project_id])})
+
+    def post(self, path: str, tag: dict):
+        project_id = path.split("/")[-2]
+
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+
+        with self.lock:
+            self.threads.add(threading.get_ident())
+
+            if project_id in self.broken:
+                raise ConnectionError("connection reset")
+
+            if project_id in self.fail_posts or project_id in self.fail_once:
+                self.fail_once.discard(project_id)
+                raise http_error(500)
+
+            if tag in self.live[project_id]:
+                raise http_error(422)
+
+            self.live[project_id].append(tag)
+            self.posts.append((project_id, tag))
+
+
+def tag(key: str, value) -> dict:
+    return {"key": key, "value": value}
+
+
+def update(project_id: str, *tags: dict) -> dict:
+    return {"org_id": "org", "project_id": project_id, "tags": list(tags)}
+
+
+def test_projects_are_tagged_by_several_workers_at_once():
+    projects = [f"p{i}" for i in range(4)]
+    # every post waits for the other workers to post too, so this only passes when all four run at once
+    client = StubClient({p: [] for p in projects}, threading.Barrier(4))
+
+    summary = update_tags(client, [update(p, tag("team", "a")) for p in projects], "test", workers=4)
+
+    assert summary.failures == []
+    assert (summary.updated, summary.posted, summary.reads) == (4, 4, 4)
+    assert len(client.threads) == 4
+
+
+def test_only_the_tags_a_project_is_missing_live_are_posted():
+    client = StubClient({"p0": [tag("team", "a")], "p1": [tag("team", "a"), tag("tier", "1")]})
+
+    summary = update_tags(
+        client, [update("p0", tag("team", "a"), tag("tier", 1)), update("p1", tag("tier", 1))], "test", workers=2
+    )
+
+    # tag values are posted as strings
+    assert client.posts == [("p0", tag("tier", "1"))]
+    assert (summary.updated, summary.current, summary.posted, summary.existing) == (1, 1, 1, 0)
+
+
+def test_failed_projects_are_summarised_without_stopping_the_rest():
+    client = StubClient({p: [] for p in ("p0", "p1", "p2", "p3")})
+    client.fail_gets.add("p0")
+    client.fail_posts.add("p1")
+    client.broken.add("p2")
+
+    summary = update_tags(client, [update(p, tag("team", "a")) for p in ("p0", "p1", "p2", "p3")], "test", workers=2)
+
+    assert sorted(summary.failures, key=lambda f: f["project"]) == [
+        {"project": "org/org/project/p0", "error": "GET returned 500"},
+        {"project": "org/org/project/p1", "error": "POST returned 500"},
+        {"project": "org/org/project/p2", "error": repr(ConnectionError("connection reset"))},
+    ]
+    assert client.posts == [("p3", tag("team", "a"))]
+    assert "1 projects updated" in str(summary) and "3 failed" in str(summary)
+
+
+def test_a_trusted_cache_posts_without_reading_projects():
+    client = StubClient({"p0": [], "p1": [tag("team", "a")]})
+
+    summary = update_tags(
+        client, [update("p0", tag("team", "a")), update("p1", tag("team", "a"))], "test", trust_cache=True
+    )
+
+    assert client.gets == []
+    assert (summary.posted, summary.existing, summary.reads) == (1, 1, 0)
+
+
+def test_a_failed_post_with_a_trusted_cache_reads_the_project_and_retries():
+    client = StubClient({"p0": []})
+    client.fail_once.add("p0")
+
+    summary = update_tags(client, [update("p0", tag("team", "a"), tag("tier", "1"))], "test", trust_cache=True)
+
+    assert client.gets == ["p0"]
+    assert client.posts == [("p0", tag("team", "a")), ("p0", tag("tier", "1"))]
+    assert (summary.reverified, summary.reads, summary.failures) == (1, 1, [])
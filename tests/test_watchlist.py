@@ -0,0 +1,65 @@
+from fakes import Estate
+from github.Repository import Repository
+from models.sync import SnykWatchList
+from utils import load_watchlist
+
+
+def github_repo(estate: Estate, i: int, updated_at: str = None) -> Repository:
+    raw_repo = estate.repo(i, "https://github.test")
+    raw_repo["updated_at"] = updated_at or raw_repo["updated_at"]
+
+    return Repository(None, {}, raw_repo, completed=True)
+
+
+def watching(estate: Estate, *indexes: int) -> SnykWatchList:
+    watchlist = SnykWatchList()
+
+    for i in indexes:
+        watchlist.add_repo(github_repo(estate, i))
+
+    return watchlist
+
+
+def test_added_repos_are_found_and_updated_in_place(estate):
+    watchlist = watching(estate, 0, 1)
+
+    assert watchlist.get_repo(1).full_name == estate.full_name(0)
+    assert watchlist.has_repo(2) and not watchlist.has_repo(3)
+
+    watchlist.add_repo(github_repo(estate, 0, "2023-01-01T00:00:00Z"))
+
+    assert len(watchlist.repos) == 2
+    assert watchlist.get_repo(1).updated_at.startswith("2023-01-01")
+
+
+def test_pruned_repos_are_gone_even_when_as_many_are_added_back(estate):
+    watchlist = watching(estate, 0, 1)
+    watchlist.get_repo(1)
+
+    watchlist.prune([2])
+    watchlist.add_repo(github_repo(estate, 2))
+
+    # as many repos as before, but not the same ones
+    assert len(watchlist.repos) == 2
+    assert watchlist.get_repo(1) is None
+    assert watchlist.get_repo(3).full_name == estate.full_name(2)
+
+
+def test_assigned_repos_replace_the_index(estate):
+    watchlist = watching(estate, 0)
+    other = watching(estate, 1)
+
+    assert watchlist.has_repo(1)
+
+    watchlist.repos = other.repos
+
+    assert not watchlist.has_repo(1)
+    assert watchlist.get_repo(2) is other.repos[0]
+
+
+def test_loaded_watchlist_indexes_its_repos(tmp_path, estate):
+    watching(estate, 0, 1, 2).save(str(tmp_path))
+
+    watchlist = load_watchlist(tmp_path)
+
+    assert [watchlist.get_repo(i + 1).full_name for i in range(3)] == [estate.full_name(i) for i in range(3)]